@@ -0,0 +1,187 @@
+"""Time each phase of a depfinder scan of a synthetic source tree.
+
+Usage::
+
+    python benchmarks/run.py [--files N] [--imports N] ... [--output results.json]
+
+A synthetic tree is generated (see synthetic.py) unless ``--path`` points at
+an existing one. Every phase is run ``--repeat`` times and the fastest run is
+reported. The conda-forge lookups of the reports phase are answered from the
+bundled name mapping so that the network is not involved. Results are written
+as json so they can be compared across releases with ``--compare``.
+"""
+from __future__ import print_function, division, absolute_import
+
+import ast
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import depfinder  # noqa: E402
+from depfinder import inspection, main as depfinder_main, reports, utils  # noqa: E402
+from synthetic import add_arguments, generate_tree  # noqa: E402
+
+
+def time_phase(func, repeat):
+    """Return (fastest wall time in seconds, result of the last call)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmarks(path, custom_namespaces=None, repeat=3, jobs=None):
+    """Time the phases of scanning `path`
+
+    Returns
+    -------
+    dict
+        Maps the name of each phase to its timing and the number of items it
+        processed
+    """
+    # load the name mapping up front so that it is not billed to a phase
+    utils.namespace_packages
+    utils.import_to_conda
+    phases = {}
+
+    def record(name, func, items=None):
+        seconds, result = time_phase(func, repeat)
+        phases[name] = {'seconds': seconds}
+        if items is not None:
+            phases[name]['items'] = items
+        return result
+
+    files = record('walk', lambda: list(inspection._iter_python_files(path)))
+    n = len(files)
+
+    def read():
+        sources = []
+        for fname in files:
+            with open(fname) as f:
+                sources.append(f.read())
+        return sources
+    sources = record('read', read, n)
+    trees = record('ast.parse', lambda: [ast.parse(source) for source in sources], n)
+
+    def visit():
+        for fname, tree in zip(files, trees):
+            inspection.ImportFinder(
+                filename=fname, custom_namespaces=custom_namespaces).visit(tree)
+    record('ImportFinder.visit', visit, n)
+
+    catchers = record('parse_file', lambda: [
+        inspection.parse_file(fname, custom_namespaces=custom_namespaces)[2]
+        for fname in files], n)
+    if jobs is not None:
+        record('iterate_over_library (jobs={})'.format(jobs), lambda: list(
+            inspection.iterate_over_library(
+                path, custom_namespaces=custom_namespaces, jobs=jobs)), n)
+
+    all_deps = defaultdict(set)
+    total_imports = defaultdict(dict)
+    for catcher in catchers:
+        for k, v in catcher.describe().items():
+            all_deps[k].update(v)
+        for name, md in catcher.total_imports.items():
+            total_imports[name].update(md)
+    all_deps = {k: sorted(v) for k, v in all_deps.items()}
+    record('sanitize_deps', lambda: depfinder_main.sanitize_deps(all_deps),
+           sum(len(v) for v in all_deps.values()))
+
+    notebooks = sorted(glob.glob(os.path.join(path, '**', '*.ipynb'), recursive=True))
+    if notebooks:
+        record('notebook_path_to_dependencies', lambda: [
+            depfinder_main.notebook_path_to_dependencies(
+                nb, custom_namespaces=custom_namespaces)
+            for nb in notebooks], len(notebooks))
+
+    def resolve():
+        resolver = reports.ImportResolver(
+            lookup=reports.extract_pkg_from_import_with_index,
+            custom_namespaces=custom_namespaces)
+        reports.report_conda_forge_names_from_import_map(
+            total_imports, resolver=resolver)
+        return resolver
+    resolver = record('report_conda_forge_names_from_import_map', resolve,
+                      len(total_imports))
+    phases['report_conda_forge_names_from_import_map']['lookups'] = resolver.lookups
+    return phases
+
+
+def compare(results, baseline):
+    """Print how each phase compares to the same phase of `baseline`"""
+    print('{:<45} {:>10} {:>10} {:>8}'.format('phase', 'base (s)', 'now (s)', 'ratio'))
+    for name, phase in results['phases'].items():
+        base = baseline['phases'].get(name)
+        if base is None:
+            continue
+        print('{:<45} {:>10.4f} {:>10.4f} {:>8.2f}'.format(
+            name, base['seconds'], phase['seconds'],
+            phase['seconds'] / base['seconds'] if base['seconds'] else float('nan')))
+
+
+def main():
+    p = ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('--path', default=None,
+                   help="Benchmark an existing tree instead of generating one")
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help="Also time iterate_over_library with this many jobs")
+    p.add_argument('--output', default=None, help="Write the results to this file")
+    p.add_argument('--compare', default=None,
+                   help="Results of an earlier run to compare against")
+    add_arguments(p)
+    args = p.parse_args()
+
+    tmpdir = None
+    if args.path is None:
+        tmpdir = tempfile.mkdtemp(prefix='depfinder-bench-')
+        params = generate_tree(tmpdir, files=args.files, imports=args.imports,
+                               depth=args.depth, notebooks=args.notebooks,
+                               namespaces=args.namespaces, filler=args.filler,
+                               seed=args.seed)
+        path = tmpdir
+    else:
+        params = {'path': args.path, 'custom_namespaces': []}
+        path = args.path
+    try:
+        phases = run_benchmarks(path, custom_namespaces=params['custom_namespaces'],
+                                repeat=args.repeat, jobs=args.jobs)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    results = {
+        'depfinder_version': depfinder.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'params': params,
+        'repeat': args.repeat,
+        'phases': phases,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    elif not args.output:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Measure the cold start up time of depfinder.
+
+Each statement is run in a fresh interpreter so nothing is shared between
+runs. The interpreter start up time is reported separately so that it can be
+subtracted from the other numbers.
+
+Usage::
+
+    python benchmarks/startup.py [--repeat N] [--json]
+"""
+from __future__ import print_function, division, absolute_import
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+STATEMENTS = [
+    ('interpreter', 'pass'),
+    ('import depfinder', 'import depfinder'),
+    ('import depfinder.cli', 'import depfinder.cli'),
+    ('first mapping lookup',
+     'import depfinder.utils; depfinder.utils.namespace_packages'),
+]
+
+
+def time_statement(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    p = ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('--repeat', type=int, default=10)
+    p.add_argument('--json', action='store_true', default=False,
+                   help="Print the results as json")
+    args = p.parse_args()
+
+    results = {}
+    for name, statement in STATEMENTS:
+        timings = time_statement(statement, args.repeat)
+        results[name] = {
+            'statement': statement,
+            'min': min(timings),
+            'median': statistics.median(timings),
+        }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{:<25} {:>10} {:>10}'.format('', 'min (ms)', 'median (ms)'))
+    for name, result in results.items():
+        print('{:<25} {:>10.1f} {:>10.1f}'.format(
+            name, result['min'] * 1000, result['median'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Generate synthetic source trees to benchmark depfinder against.
+
+Usage::
+
+    python benchmarks/synthetic.py OUTPUT_DIR [--files N] [--imports N] ...
+
+The generated tree is deterministic for a given set of parameters and seed.
+"""
+from __future__ import print_function, division, absolute_import
+
+import json
+import os
+import random
+from argparse import ArgumentParser
+
+THIRD_PARTY = [
+    'numpy', 'numpy.linalg', 'pandas', 'scipy.interpolate', 'requests',
+    'yaml', 'matplotlib.pyplot', 'sklearn.svm', 'six.moves', 'IPython.display',
+    'bs4', 'PIL.Image', 'mpl_toolkits.mplot3d', 'dask.array', 'xarray',
+]
+STDLIB = [
+    'os', 'os.path', 'sys', 'json', 'ast', 'collections', 'itertools',
+    'logging', 'concurrent.futures', 'xml.etree.ElementTree', 're', 'typing',
+]
+NAMESPACES = [
+    'google.cloud.storage', 'google.cloud.bigquery', 'azure.mgmt.compute',
+    'azure.storage.blob', 'ruamel.yaml', 'zope.interface',
+]
+NESTING = ['try', 'if', 'def', 'for', 'while', 'with', 'class']
+
+FILLER = '''
+def function_{n}(a, b=None, *args, **kwargs):
+    """Filler so that files have a realistic number of AST nodes"""
+    result = [x * 2 for x in range(a) if x % 3]
+    mapping = {{str(k): v for k, v in zip(result, args)}}
+    if b is not None and len(mapping) > {n}:
+        result.append(sum(v for v in mapping.values() if isinstance(v, int)))
+    return result, mapping, kwargs.get('key_{n}', "{n}")
+'''
+
+
+def _import_statement(rng, name, relative_fraction):
+    if rng.random() < relative_fraction:
+        return 'from .{} import thing'.format(rng.choice(['sibling', 'utils', 'core']))
+    if '.' in name and rng.random() < 0.5:
+        module, attr = name.rsplit('.', 1)
+        return 'from {} import {}'.format(module, attr)
+    return 'import {}'.format(name)
+
+
+def _nest(rng, statement, depth):
+    """Wrap `statement` in `depth` randomly chosen blocks"""
+    lines = [statement]
+    for _ in range(depth):
+        kind = rng.choice(NESTING)
+        body = ['    ' + line for line in lines]
+        if kind == 'try':
+            lines = ['try:'] + body + ['except ImportError:', '    pass']
+        elif kind == 'if':
+            lines = ['if CONDITION:'] + body + ['else:', '    pass']
+        elif kind == 'def':
+            lines = ['def wrapper_{}():'.format(rng.randint(0, 10 ** 6))] + body
+        elif kind == 'for':
+            lines = ['for _ in range(1):'] + body
+        elif kind == 'while':
+            lines = ['while CONDITION:'] + body + ['    break']
+        elif kind == 'with':
+            lines = ['with CONTEXT:'] + body
+        else:
+            lines = ['class Wrapper{}:'.format(rng.randint(0, 10 ** 6))] + body
+    return lines
+
+
+def module_source(rng, imports=20, depth=2, nested_fraction=0.3,
+                  relative_fraction=0.1, filler=10, custom_namespaces=()):
+    names = THIRD_PARTY + STDLIB + NAMESPACES + [
+        '{}.{}'.format(ns, rng.choice(['core', 'io', 'plugins']))
+        for ns in custom_namespaces]
+    lines = ['"""Synthetic module generated by benchmarks/synthetic.py"""',
+             'CONDITION = True', 'CONTEXT = open(__file__)']
+    for _ in range(imports):
+        statement = _import_statement(rng, rng.choice(names), relative_fraction)
+        if depth and rng.random() < nested_fraction:
+            lines.extend(_nest(rng, statement, rng.randint(1, depth)))
+        else:
+            lines.append(statement)
+    for n in range(filler):
+        lines.append(FILLER.format(n=n))
+    return '\n'.join(lines) + '\n'
+
+
+def notebook_source(rng, cells=10, imports=5, output_bytes=10000):
+    """A notebook with code cells, markdown cells and large cell outputs"""
+    nb_cells = []
+    for _ in range(cells):
+        code = [_import_statement(rng, rng.choice(THIRD_PARTY + STDLIB), 0) + '\n'
+                for _ in range(imports)]
+        code.extend(['%matplotlib inline\n', 'x = 1\n', 'x'])
+        nb_cells.append({
+            'cell_type': 'code',
+            'execution_count': 1,
+            'metadata': {},
+            'source': code,
+            'outputs': [{
+                'output_type': 'display_data',
+                'metadata': {},
+                'data': {'image/png': 'A' * output_bytes, 'text/plain': ['<Figure>']},
+            }],
+        })
+        nb_cells.append({'cell_type': 'markdown', 'metadata': {},
+                         'source': ['# A heading\n', 'Some text']})
+    return json.dumps({'cells': nb_cells, 'metadata': {}, 'nbformat': 4,
+                       'nbformat_minor': 2})
+
+
+def generate_tree(root, files=1000, imports=20, depth=2, files_per_dir=20,
+                  notebooks=0, namespaces=0, filler=10, seed=12345):
+    """Write a synthetic package to `root`
+
+    Parameters
+    ----------
+    root : str
+        Directory to write to. Created if it does not exist.
+    files : int
+        Number of python modules
+    imports : int
+        Number of import statements per module
+    depth : int
+        Maximum number of try/if/def/... blocks an import is nested in
+    files_per_dir : int
+        Number of modules per sub package
+    notebooks : int
+        Number of jupyter notebooks
+    namespaces : int
+        Number of custom namespace packages to spread imports over. Their names
+        are returned under 'custom_namespaces'.
+    filler : int
+        Number of filler functions per module
+    seed : int
+
+    Returns
+    -------
+    dict
+        The parameters the tree was generated with, plus its total size
+    """
+    rng = random.Random(seed)
+    custom_namespaces = ['acme{}'.format(i) for i in range(namespaces)]
+    total_bytes = 0
+    for i in range(files):
+        subdir = os.path.join(root, 'synthetic_pkg', 'sub{}'.format(i // files_per_dir))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+            with open(os.path.join(subdir, '__init__.py'), 'w') as f:
+                f.write('')
+        source = module_source(rng, imports=imports, depth=depth, filler=filler,
+                               custom_namespaces=custom_namespaces)
+        total_bytes += len(source)
+        with open(os.path.join(subdir, 'mod{}.py'.format(i)), 'w') as f:
+            f.write(source)
+    if notebooks:
+        nbdir = os.path.join(root, 'notebooks')
+        if not os.path.isdir(nbdir):
+            os.makedirs(nbdir)
+        for i in range(notebooks):
+            source = notebook_source(rng)
+            total_bytes += len(source)
+            with open(os.path.join(nbdir, 'nb{}.ipynb'.format(i)), 'w') as f:
+                f.write(source)
+    return {
+        'files': files,
+        'imports': imports,
+        'depth': depth,
+        'files_per_dir': files_per_dir,
+        'notebooks': notebooks,
+        'namespaces': namespaces,
+        'custom_namespaces': custom_namespaces,
+        'filler': filler,
+        'seed': seed,
+        'total_bytes': total_bytes,
+    }
+
+
+def add_arguments(p):
+    p.add_argument('--files', type=int, default=1000,
+                   help="Number of python modules. Defaults to %(default)s")
+    p.add_argument('--imports', type=int, default=20,
+                   help="Import statements per module. Defaults to %(default)s")
+    p.add_argument('--depth', type=int, default=2,
+                   help="Maximum nesting depth of imports. Defaults to %(default)s")
+    p.add_argument('--notebooks', type=int, default=0,
+                   help="Number of notebooks. Defaults to %(default)s")
+    p.add_argument('--namespaces', type=int, default=0,
+                   help="Number of custom namespace packages. Defaults to %(default)s")
+    p.add_argument('--filler', type=int, default=10,
+                   help="Filler functions per module. Defaults to %(default)s")
+    p.add_argument('--seed', type=int, default=12345)
+
+
+def main():
+    p = ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('output_dir')
+    add_arguments(p)
+    args = p.parse_args()
+    summary = generate_tree(args.output_dir, files=args.files, imports=args.imports,
+                            depth=args.depth, notebooks=args.notebooks,
+                            namespaces=args.namespaces, filler=args.filler,
+                            seed=args.seed)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Finding the imports of the python files in wheels, sdists and other archives.
+
+`iter_archive` reads the ``.py`` members of a ``.whl``, ``.zip``, ``.tar.gz``
+or ``.tar.bz2`` file one at a time and parses them in memory, so nothing is
+extracted to disk. Members are named after the path of the archive, e.g.
+``dist/foo-1.0-py3-none-any.whl/foo/__init__.py``, so that the ignore patterns
+and the default excludes see the same paths as when walking the extracted
+tree. ``.gitignore`` files inside the archive are not honored.
+"""
+from __future__ import print_function, division, absolute_import
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import posixpath
+import tarfile
+import time
+import tokenize
+import traceback
+import zipfile
+
+from . import profiling
+from .ignore import ignore_matcher
+from .walk import ENVIRONMENT_MARKERS, PROJECT_FILES, _skips_directory, _skips_file
+
+logger = logging.getLogger('depfinder')
+
+ARCHIVE_SUFFIXES = ('.whl', '.zip', '.tar.gz', '.tgz', '.tar.bz2')
+
+
+def is_archive(path):
+    """Return whether `path` names an archive that `iter_archive` can read"""
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def archive_package_name(path):
+    """Guess the name of the package in a wheel or sdist from its file name
+
+    ``foo_bar-1.0-py3-none-any.whl`` and ``foo_bar-1.0.tar.gz`` both give
+    ``foo_bar``.
+    """
+    name = os.path.basename(path)
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.split('-')[0]
+
+
+def _read_tar_member(archive, member):
+    f = archive.extractfile(member)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _list_members(archive):
+    """Return (name, function returning the contents) for each regular file"""
+    if isinstance(archive, zipfile.ZipFile):
+        members = [(info.filename, functools.partial(archive.read, info))
+                   for info in archive.infolist() if not info.is_dir()]
+    else:
+        # symlinks and other special members are skipped, as the walk of a
+        # tree does not follow symlinked directories either
+        members = [(member.name, functools.partial(_read_tar_member, archive, member))
+                   for member in archive.getmembers() if member.isfile()]
+    listed = []
+    for name, read in members:
+        name = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+        if name == os.curdir or name.split('/')[0] == os.pardir:
+            continue
+        listed.append((name, read))
+    return listed
+
+
+def _open(path):
+    if path.lower().endswith(('.whl', '.zip')):
+        return zipfile.ZipFile(path)
+    return tarfile.open(path, 'r:*')
+
+
+def _decode(data):
+    """Decode python source the way `open` would, honoring coding cookies"""
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    return io.TextIOWrapper(io.BytesIO(data), encoding).read()
+
+
+def _member_digest(data):
+    # kept apart from the digests of files on disk in the parse cache, whose
+    # payloads leave out the source lines
+    return hashlib.sha256(b'archive-member\0' + data).hexdigest()
+
+
+def _parse_member(path, data, custom_namespaces, cache, target_python, lean):
+    from .inspection import ImportFinder, get_imported_libs
+    if cache is not None:
+        with profiling.phase('cache'):
+            key = cache.key(_member_digest(data), custom_namespaces, target_python)
+        payload = cache.get(key)
+        if payload is not None:
+            with profiling.phase('cache'):
+                return ImportFinder.from_payload(
+                    payload, filename=path, custom_namespaces=custom_namespaces,
+                    target_python=target_python)
+    catcher = get_imported_libs(_decode(data), filename=path,
+                                custom_namespaces=custom_namespaces,
+                                target_python=target_python, lean=lean)
+    catcher.total_imports = dict(catcher.total_imports)
+    catcher.detach_source()
+    if cache is not None:
+        cache.put(key, catcher.to_payload())
+    return catcher
+
+
+def iter_archive(path, custom_namespaces=None, cache=None, target_python=None, lean=False,
+                 ignore=None, default_excludes=False):
+    """Parse the python files of an archive without extracting it
+
+    Parameters
+    ----------
+    path : str
+        Path to a ``.whl``, ``.zip``, ``.tar.gz``, ``.tgz`` or ``.tar.bz2``
+    custom_namespaces, cache, target_python, lean
+        See `depfinder.inspection.parse_file`
+    ignore, default_excludes
+        See `depfinder.walk.walk_python_files`
+
+    Yields
+    ------
+    tuple
+        (path of the member, parse_file result or None, formatted traceback
+        or None), like `depfinder.parallel.parse_files_serially`
+    """
+    ignore = ignore_matcher(ignore)
+    profile = profiling.active()
+    with profiling.phase('read'):
+        archive = _open(path)
+    try:
+        with profiling.phase('read'):
+            members = _list_members(archive)
+        names = set(name for name, _ in members)
+        # the directories holding an environment, as recognized by the walk
+        environments = set()
+        if default_excludes:
+            for name, _ in members:
+                parts = name.split('/')
+                environments.update('/'.join(parts[:idx]) for idx, part in
+                                    enumerate(parts) if idx and part in ENVIRONMENT_MARKERS)
+        skipped_dirs = {}
+
+        def skips_directory(parts):
+            relpath = '/'.join(parts)
+            skip = skipped_dirs.get(relpath)
+            if skip is None:
+                in_build = default_excludes and len(parts) > 1 and parts[-2] == 'build' and \
+                    any('/'.join(parts[:-2] + [name]) in names for name in PROJECT_FILES)
+                skip = skipped_dirs[relpath] = (
+                    relpath in environments or
+                    _skips_directory(parts[-1], os.path.join(path, *parts), relpath,
+                                     in_build, ignore, None, default_excludes))
+                if skip:
+                    profiling.count('pruned_dirs')
+            return skip
+
+        for name, read in members:
+            if not name.endswith('.py'):
+                continue
+            parts = name.split('/')
+            if any(skips_directory(parts[:idx]) for idx in range(1, len(parts))):
+                continue
+            member_path = os.path.join(path, *parts)
+            if _skips_file(member_path, name, ignore, None):
+                profiling.count('ignored_files')
+                continue
+            start = time.perf_counter()
+            try:
+                with profiling.phase('read'):
+                    data = read()
+                catcher = _parse_member(member_path, data, custom_namespaces, cache,
+                                        target_python, lean)
+            except Exception:
+                yield member_path, None, traceback.format_exc()
+                continue
+            catcher.parse_seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.record_file(member_path, len(data), catcher.parse_seconds)
+            yield member_path, (os.path.split(member_path)[:-3], member_path, catcher), None
+    finally:
+        archive.close()
+        if cache is not None:
+            cache.flush()
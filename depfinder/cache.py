@@ -0,0 +1,623 @@
+"""Persistent, content-addressed cache of parse_file results."""
+from __future__ import print_function, division, absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from . import profiling
+
+logger = logging.getLogger('depfinder')
+
+# bump this whenever the layout of the cached payload changes
+CACHE_FORMAT = 3
+# 256 MB
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_dir():
+    """Return the directory depfinder keeps its caches in
+
+    Honors ``$DEPFINDER_CACHE_DIR`` and then ``$XDG_CACHE_HOME``, defaulting to
+    ``~/.cache/depfinder``.
+    """
+    if os.environ.get('DEPFINDER_CACHE_DIR'):
+        return os.environ['DEPFINDER_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'depfinder')
+
+
+def _version():
+    from . import __version__
+    return __version__
+
+
+_namespace_digest = None
+
+
+def namespace_packages_digest():
+    """Return a digest of the namespace packages known to the name mapping
+
+    They decide how far a dotted import is reported, e.g. ``google.cloud``
+    rather than ``google``, so results parsed with a different mapping can
+    not be reused. The digest is only recomputed when the mapping is reloaded.
+    """
+    global _namespace_digest
+    from . import utils
+    namespace_packages = utils.namespace_packages
+    if _namespace_digest is None or _namespace_digest[0] is not namespace_packages:
+        text = '\n'.join(sorted(namespace_packages))
+        _namespace_digest = (namespace_packages,
+                             hashlib.sha256(text.encode('utf-8')).hexdigest())
+    return _namespace_digest[1]
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache(object):
+    """Map the content of a source file to the result of parsing it
+
+    Entries are keyed on the sha256 of the file contents, the depfinder
+    version, the python version (which decides what counts as a builtin), the
+    custom namespaces and the namespace packages of the name mapping, so a
+    renamed or copied file is still a cache hit.
+    A table of (path, mtime, size) -> hash means that unchanged files are
+    never read, let alone hashed. Once the cache grows past `max_size` bytes
+    the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Defaults to `default_cache_dir()`
+    max_size : int, optional
+        Maximum total size of the cached payloads in bytes
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        import sqlite3
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.path = os.path.join(cache_dir, 'parse-cache.sqlite')
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, payload TEXT, size INTEGER, last_used REAL)"
+            )
+        self._seen_files = {}
+        self._new_results = {}
+        self._used_keys = set()
+        self.hits = 0
+        self.misses = 0
+
+    def file_digest(self, path):
+        """Return the sha256 of the contents of `path`
+
+        The file is only read when its mtime or size differ from the last time
+        it was hashed.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        row = self._conn.execute(
+            "SELECT mtime_ns, size, digest FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is not None and row[0] == mtime_ns and row[1] == st.st_size:
+            return row[2]
+        digest = hash_file(path)
+        self._seen_files[path] = (mtime_ns, st.st_size, digest)
+        return digest
+
+    def key(self, digest, custom_namespaces=None, target_python=None):
+        """Combine a content digest with everything else that affects the result"""
+        parts = [
+            str(CACHE_FORMAT),
+            _version(),
+            '%s.%s' % sys.version_info[:2],
+            ','.join(sorted(custom_namespaces or [])),
+            target_python or '',
+            namespace_packages_digest(),
+            digest,
+        ]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def key_for_file(self, path, custom_namespaces=None, target_python=None):
+        with profiling.phase('cache'):
+            return self.key(self.file_digest(path), custom_namespaces, target_python)
+
+    def get(self, key):
+        """Return the cached payload for `key`, or None"""
+        with profiling.phase('cache'):
+            payload = self._get(key)
+        profiling.count('parse_cache_misses' if payload is None else 'parse_cache_hits')
+        return payload
+
+    def _get(self, key):
+        if key in self._new_results:
+            self.hits += 1
+            return self._new_results[key]
+        row = self._conn.execute(
+            "SELECT payload FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used_keys.add(key)
+        return json.loads(row[0])
+
+    def put(self, key, payload):
+        self._new_results[key] = payload
+
+    def flush(self):
+        """Write pending entries to disk and evict old ones if needed"""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest) "
+                "VALUES (?, ?, ?, ?)",
+                [(path,) + info for path, info in self._seen_files.items()]
+            )
+            rows = []
+            for key, payload in self._new_results.items():
+                text = json.dumps(payload, sort_keys=True)
+                rows.append((key, text, len(text), now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (key, payload, size, last_used) "
+                "VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.executemany(
+                "UPDATE results SET last_used = ? WHERE key = ?",
+                [(now, key) for key in self._used_keys]
+            )
+        self._seen_files = {}
+        self._new_results = {}
+        self._used_keys = set()
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries until under `max_size`"""
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+        keep = 0
+        stale = []
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM results ORDER BY last_used DESC"):
+            keep += size
+            if keep > self.max_size:
+                stale.append((key,))
+        logger.debug("Evicting %s entries from the parse cache", len(stale))
+        with self._conn:
+            self._conn.executemany("DELETE FROM results WHERE key = ?", stale)
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_parse_cache(cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+    """Return a ParseCache, or None if the cache directory is not usable"""
+    import sqlite3
+    try:
+        return ParseCache(cache_dir, max_size=max_size)
+    except (OSError, sqlite3.Error):
+        logger.warning("Could not open the parse cache in %s. Continuing "
+                       "without it.", cache_dir or default_cache_dir(),
+                       exc_info=True)
+        return None
+
+
+def parse_files_with_cache(paths, cache, parse, custom_namespaces=None,
+                           target_python=None, streaming=False):
+    """Parse `paths`, serving unchanged and duplicated files from `cache`
+
+    Parameters
+    ----------
+    paths : iterable of str
+    cache : ParseCache
+    parse : callable
+        Called with a list of the files that actually need parsing. Must
+        yield (path, parse_file result or None, traceback or None) in order,
+        e.g. `depfinder.parallel.parse_files`.
+    custom_namespaces : list of str, optional
+    target_python : str, optional
+        See `depfinder.inspection.parse_file`
+    streaming : bool, optional
+        If True, every file is looked up in the cache, and parsed if need be,
+        right before its result is yielded, so that the first result does not
+        wait for all of `paths` to be read. `parse` is then called with one
+        file at a time. Defaults to looking up all of `paths` first and
+        parsing the files that are not cached in one call.
+
+    Yields
+    ------
+    tuple
+        (path, parse_file result or None, formatted traceback or None) for
+        every file in `paths`, in order
+    """
+    payloads = {}
+    errors = {}
+    chunks = ([path] for path in paths) if streaming else [list(paths)]
+    try:
+        for chunk in chunks:
+            for result in _parse_chunk_with_cache(chunk, cache, parse, payloads, errors,
+                                                  custom_namespaces, target_python):
+                yield result
+    finally:
+        cache.flush()
+
+
+def _parse_chunk_with_cache(paths, cache, parse, payloads, errors, custom_namespaces,
+                            target_python):
+    # payloads and errors are shared by the chunks of one parse_files_with_cache,
+    # so that a copy of a file that was already seen is not parsed again
+    from .inspection import ImportFinder
+    keys = []
+    to_parse = []
+    for path in paths:
+        try:
+            key = cache.key_for_file(path, custom_namespaces, target_python)
+        except OSError:
+            key = None
+        keys.append(key)
+        if key is None:
+            to_parse.append(path)
+        elif key not in payloads:
+            payloads[key] = cache.get(key)
+            if payloads[key] is None:
+                # the first copy of this content gets parsed, any identical
+                # copies later in the tree reuse its result
+                to_parse.append(path)
+    parsed = iter(parse(to_parse) if to_parse else ())
+    for path, key in zip(paths, keys):
+        if key is not None and (payloads[key] is not None or key in errors):
+            if key in errors:
+                yield path, None, errors[key]
+            else:
+                start = time.perf_counter()
+                with profiling.phase('cache'):
+                    catcher = ImportFinder.from_payload(
+                        payloads[key], filename=path,
+                        custom_namespaces=custom_namespaces,
+                        target_python=target_python)
+                catcher.parse_seconds = time.perf_counter() - start
+                yield path, (os.path.split(path)[:-3], path, catcher), None
+            continue
+        parsed_path, result, error = next(parsed)
+        assert parsed_path == path
+        if key is not None:
+            if error is not None:
+                errors[key] = error
+            else:
+                payloads[key] = result[2].to_payload()
+                cache.put(key, payloads[key])
+        yield path, result, error
+
+
+MAPPING_CACHE_FILENAME = 'pypi-name-mapping.bin'
+# bump this whenever the layout of the cached name mapping changes
+MAPPING_CACHE_FORMAT = 1
+
+
+class NameMappingCache(object):
+    """Local copy of the conda-forge pypi name mapping
+
+    The mapping is stored as a marshal dump of the records (in the order of
+    `depfinder.pkg_index.MAPPING_KEYS`) along with the time it was fetched.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Defaults to `default_cache_dir()`
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        self.path = os.path.join(cache_dir, MAPPING_CACHE_FILENAME)
+
+    def load(self):
+        """Return (fetched_at, mapping_list), or None if nothing usable is cached"""
+        import marshal
+        from .pkg_index import mapping_list_from_index
+        try:
+            with open(self.path, 'rb') as f:
+                data = marshal.loads(f.read())
+        except (OSError, IOError, ValueError, EOFError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('format') != MAPPING_CACHE_FORMAT:
+            return None
+        return data['fetched_at'], mapping_list_from_index(data)
+
+    def save(self, mapping_list, fetched_at=None):
+        """Store `mapping_list`. Failing to write the cache is not an error."""
+        import marshal
+        from .pkg_index import MAPPING_KEYS
+        data = {
+            'format': MAPPING_CACHE_FORMAT,
+            'fetched_at': time.time() if fetched_at is None else fetched_at,
+            'mapping_list': [tuple(record.get(k) for k in MAPPING_KEYS)
+                             for record in mapping_list],
+        }
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(tmp_path, 'wb') as f:
+                f.write(marshal.dumps(data))
+            os.replace(tmp_path, self.path)
+        except (OSError, IOError):
+            logger.debug("Could not write the name mapping cache to %s",
+                         self.path, exc_info=True)
+
+
+# a week for imports that matched a package, a day for those that did not
+DEFAULT_RESOLVER_TTL = 7 * 24 * 60 * 60
+DEFAULT_NO_MATCH_TTL = 24 * 60 * 60
+
+
+def resolver_source_version():
+    """Identify the data that import names are being resolved against
+
+    This is the version of conda-forge-metadata when it is installed, and the
+    depfinder version (whose bundled name mapping is used instead) otherwise.
+    """
+    try:
+        import conda_forge_metadata
+    except ImportError:
+        return 'depfinder-{}'.format(_version())
+    version = getattr(conda_forge_metadata, '__version__', None)
+    if version is None:
+        try:
+            from importlib.metadata import version as dist_version
+            version = dist_version('conda-forge-metadata')
+        except Exception:
+            version = 'unknown'
+    return 'conda-forge-metadata-{}'.format(version)
+
+
+class ResolverStore(object):
+    """Persistent store of import name -> conda-forge package lookups
+
+    Both matches and "no match" results are stored, each with their own time
+    to live. Everything in the store is dropped when the data the lookups are
+    made against changes. See `resolver_source_version`.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Defaults to `default_cache_dir()`
+    ttl : float, optional
+        Seconds for which a lookup that matched a package is reused
+    no_match_ttl : float, optional
+        Seconds for which a lookup that did not match any package is reused
+    source_version : str, optional
+        Defaults to `resolver_source_version()`
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_RESOLVER_TTL,
+                 no_match_ttl=DEFAULT_NO_MATCH_TTL, source_version=None):
+        import sqlite3
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.ttl = ttl
+        self.no_match_ttl = no_match_ttl
+        self.source_version = source_version or resolver_source_version()
+        self.path = os.path.join(cache_dir, 'resolver-store.sqlite')
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        self._pending = {}
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS resolutions "
+                "(name TEXT PRIMARY KEY, best TEXT, supplying TEXT, resolved_at REAL)"
+            )
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'source_version'").fetchone()
+            if row is None or row[0] != self.source_version:
+                logger.debug("Resolving against %s, clearing the resolver store",
+                             self.source_version)
+                self._conn.execute("DELETE FROM resolutions")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('source_version', ?)",
+                    (self.source_version,))
+
+    def get(self, name):
+        """Return (most likely package, set of supplying packages) or None
+
+        None is returned when nothing is stored for `name` or the stored
+        result has expired.
+        """
+        row = self._conn.execute(
+            "SELECT best, supplying, resolved_at FROM resolutions WHERE name = ?",
+            (name,)).fetchone()
+        if row is None:
+            return None
+        best, supplying, resolved_at = row
+        supplying = set(json.loads(supplying))
+        ttl = self.ttl if supplying else self.no_match_ttl
+        if time.time() - resolved_at > ttl:
+            return None
+        return best, supplying
+
+    def put(self, name, best, supplying):
+        self._pending[name] = (best, sorted(supplying), time.time())
+
+    def flush(self):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO resolutions (name, best, supplying, resolved_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(name, best, json.dumps(supplying), resolved_at)
+                 for name, (best, supplying, resolved_at) in self._pending.items()]
+            )
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ScanSnapshot(object):
+    """Per-file results of a scan of one source tree, for incremental scans
+
+    Holds the `describe()` of every file of the tree along with a count of how
+    many files import each name, so that replacing the results of a few files
+    and reading back the result for the whole tree only touches the rows of
+    those files. Used by `depfinder.main.incremental_import_search`.
+
+    Parameters
+    ----------
+    root : str
+        The directory that was scanned. Paths are stored relative to it.
+    cache_dir : str, optional
+        Defaults to `default_cache_dir()`. Each tree gets its own database in
+        the ``snapshots`` directory.
+    """
+
+    def __init__(self, root, cache_dir=None):
+        import sqlite3
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        directory = os.path.join(cache_dir, 'snapshots')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.root = os.path.abspath(root)
+        digest = hashlib.sha256(self.root.encode('utf-8')).hexdigest()[:32]
+        self.path = os.path.join(directory, digest + '.sqlite')
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, deps TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS counts (category TEXT, name TEXT, "
+                "n INTEGER, PRIMARY KEY (category, name))")
+
+    def get_meta(self, key, default=None):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           (key, json.dumps(value)))
+
+    def reset(self):
+        """Forget every file
+
+        The options of the new snapshot are only stored with `set_meta` once
+        all of its files are in, so that a scan that stops half way is not
+        taken for a complete one.
+        """
+        self._conn.execute("DELETE FROM files")
+        self._conn.execute("DELETE FROM counts")
+        self._conn.execute("DELETE FROM meta")
+
+    def _count(self, deps, step):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO counts (category, name, n) VALUES (?, ?, 0)",
+            [(category, name) for category, names in deps.items() for name in names])
+        self._conn.executemany(
+            "UPDATE counts SET n = n + ? WHERE category = ? AND name = ?",
+            [(step, category, name) for category, names in deps.items() for name in names])
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def remove(self, path):
+        """Forget the file at `path`"""
+        relpath = self.relpath(path)
+        row = self._conn.execute(
+            "SELECT deps FROM files WHERE path = ?", (relpath,)).fetchone()
+        if row is not None:
+            self._count(json.loads(row[0]), -1)
+            self._conn.execute("DELETE FROM files WHERE path = ?", (relpath,))
+
+    def replace(self, path, deps):
+        """Store `deps`, the describe() of the file at `path`"""
+        self.remove(path)
+        deps = {category: sorted(names) for category, names in deps.items() if names}
+        self._conn.execute("INSERT INTO files (path, deps) VALUES (?, ?)",
+                           (self.relpath(path), json.dumps(deps)))
+        self._count(deps, 1)
+
+    def paths_under(self, directory):
+        """Return the stored paths in `directory`, as absolute paths"""
+        relpath = self.relpath(directory)
+        if relpath == os.curdir:
+            rows = self._conn.execute("SELECT path FROM files")
+        else:
+            # '0' sorts right after '/', so this is every path starting with
+            # relpath + '/'
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE path >= ? AND path < ?",
+                (relpath + '/', relpath + '0'))
+        return [os.path.join(self.root, *row[0].split('/')) for row in rows]
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def aggregate(self):
+        """Return the union of the stored results, as {category: sorted names}"""
+        deps = {}
+        for category, name in self._conn.execute(
+                "SELECT category, name FROM counts WHERE n > 0 ORDER BY category, name"):
+            deps.setdefault(category, []).append(name)
+        return deps
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        """Drop the changes made since the last commit"""
+        self._conn.rollback()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.rollback()
+        self.close()
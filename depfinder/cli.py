@@ -30,19 +30,22 @@
 from __future__ import absolute_import, division, print_function
 from argparse import ArgumentParser
 from collections import defaultdict
+import json
 import logging
 import os
-from pprint import pprint
 import itertools
-import pdb
 import sys
+import time
 
-import yaml
-
-from . import main
-from .inspection import parse_file
-from .main import (simple_import_search, notebook_path_to_dependencies,
-                   sanitize_deps)
+from . import main, profiling, utils
+from .archive import is_archive
+from .cache import open_parse_cache
+from .inspection import get_imported_libs, iterate_over_library, parse_file
+from .main import (simple_import_search, incremental_import_search,
+                   distribution_import_search, notebook_path_to_dependencies,
+                   notebooks_to_dependencies, sanitize_deps)
+from .notebook import iter_notebook_dependencies
+from .stdliblist import TARGET_PYTHON_VERSIONS
 
 logger = logging.getLogger('depfinder')
 
@@ -60,12 +63,15 @@ Tool for inspecting the dependencies of your python project.
     p.add_argument(
         "file_or_directory",
         help=(
-            "Valid options are a single python file, a single jupyter "
-            "(ipython) notebook or a directory of files that include "
-            "python files"
+            "Valid options are a single python file, one or more jupyter "
+            "(ipython) notebooks, a directory of files that include "
+            "python files, a wheel, sdist, .zip, .tar.gz or .tar.bz2 "
+            "archive of python files or '-' to read python source from "
+            "stdin. `depfinder serve` starts a server instead, see "
+            "`depfinder serve --help`"
         ),
         # default=".",
-        nargs="?",
+        nargs="*",
     )
     p.add_argument(
         '-y',
@@ -74,6 +80,15 @@ Tool for inspecting the dependencies of your python project.
         default=False,
         help=("Output in syntactically valid yaml when true. Defaults to "
               "%(default)s"))
+    p.add_argument(
+        '--format',
+        default=None,
+        choices=['pprint', 'yaml', 'conda', 'ndjson'],
+        help=("Output format. 'ndjson' prints one json object per file as soon "
+              "as it has been parsed, with its path, dependencies and parse "
+              "time in seconds, and then one with the dependencies of all the "
+              "files. -y/--yaml and --conda are short for 'yaml' and 'conda'. "
+              "Defaults to 'pprint'"))
     p.add_argument(
         '-V',
         '--version',
@@ -144,12 +159,146 @@ Tool for inspecting the dependencies of your python project.
             "both foo.bar and foo.baz instead of foo when run with --custom-namespaces=foo)."
         )
     )
+    p.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help=("Number of worker processes used to parse the files in a "
+              "directory or the cells of several notebooks. 0 uses one worker "
+              "per CPU. Small jobs are always done serially. Defaults to "
+              "%(default)s")
+    )
+    p.add_argument(
+        '--cache-dir',
+        default=None,
+        help=("Directory for the persistent parse cache. Defaults to "
+              "$DEPFINDER_CACHE_DIR or ~/.cache/depfinder")
+    )
+    p.add_argument(
+        '--no-cache',
+        action="store_true",
+        default=False,
+        help="Do not read from or write to the persistent parse cache"
+    )
+    p.add_argument(
+        '--offline',
+        action="store_true",
+        default=False,
+        help=("Never fetch the conda-forge name mapping over the network. A "
+              "previously cached copy or the bundled one is used instead. Can "
+              "also be set with $DEPFINDER_OFFLINE=1")
+    )
+    p.add_argument(
+        '--mapping-ttl',
+        type=float,
+        default=None,
+        help=("Seconds after which the cached conda-forge name mapping is "
+              "refreshed in the background. Defaults to $DEPFINDER_MAPPING_TTL "
+              "or one day")
+    )
+    p.add_argument(
+        '--target-python',
+        default=None,
+        choices=TARGET_PYTHON_VERSIONS,
+        metavar='X.Y',
+        help=("Classify imports as builtin against the standard library of "
+              "this version of python ({}) instead of the one running "
+              "depfinder".format(', '.join(TARGET_PYTHON_VERSIONS)))
+    )
+    p.add_argument(
+        '--respect-gitignore',
+        action='store_true',
+        default=False,
+        help=("Do not inspect the files and directories that git ignores, "
+              "according to the .gitignore files of the directory and of "
+              "its parents")
+    )
+    p.add_argument(
+        '--no-default-excludes',
+        action='store_true',
+        default=False,
+        help=("Also inspect version control and tool directories such as .git "
+              "and .tox, virtual environments, site-packages and build/lib "
+              "copies, which are skipped by default")
+    )
+    p.add_argument(
+        '--include-notebooks',
+        action='store_true',
+        default=False,
+        help=("Also inspect the code cells of the jupyter notebooks when "
+              "inspecting a directory")
+    )
+    p.add_argument(
+        '--by-distribution',
+        action='store_true',
+        default=False,
+        help=("Treat the directory as a site-packages directory and report "
+              "the dependencies of each installed distribution, from the "
+              "files listed in its RECORD. Files that no distribution "
+              "installed are not inspected")
+    )
+    p.add_argument(
+        '--incremental',
+        action='store_true',
+        default=False,
+        help=("Keep the results of every file of the directory in the cache "
+              "directory and only parse the files that changed since the "
+              "last run, as reported by git or listed with --changed")
+    )
+    p.add_argument(
+        '--changed',
+        default=None,
+        help=("Comma separated list of the files and directories that changed "
+              "since the last --incremental run. Implies --incremental")
+    )
+    p.add_argument(
+        '--profile',
+        nargs='?',
+        const='table',
+        default=None,
+        choices=['table', 'json'],
+        help=("Print the time spent in each phase of the scan, the slowest "
+              "files and the cache and resolver hit counts to stderr, as a "
+              "table or as json. Defaults to a table")
+    )
+    p.add_argument(
+        '--profile-top',
+        type=int,
+        default=10,
+        help="Number of slowest files listed by --profile. Defaults to %(default)s"
+    )
+    p.add_argument(
+        '--server',
+        default=os.environ.get('DEPFINDER_SERVER'),
+        help=("Send the scan to a running `depfinder serve` and print its "
+              "answer. Either the path of its unix socket or [host:]port. "
+              "Defaults to $DEPFINDER_SERVER")
+    )
     return p
 
 
-def cli():
+def cli(argv=None, open_cache=None):
+    """Run depfinder from the command line
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Defaults to ``sys.argv[1:]``
+    open_cache : callable, optional
+        Called with --cache-dir to get the parse cache. `depfinder.server`
+        passes its resident caches this way, and the scan is then never
+        forwarded to another server.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['serve']:
+        from .server import serve_cli
+        return serve_cli(argv[1:])
     p = _init_parser()
-    args = p.parse_args()
+    args = p.parse_args(argv)
+    if args.server and open_cache is None:
+        from .server import forward
+        return forward(args.server, argv)
     if args.verbose and args.quiet:
         msg = ("You have enabled both verbose mode (--verbose or -v) and "
                "quiet mode (-q or --quiet).  Please pick one. Exiting...")
@@ -158,12 +307,17 @@ def cli():
     if args.pdb:
         # set the pdb_hook as the except hook for all exceptions
         def pdb_hook(exctype, value, traceback):
+            import pdb
             pdb.post_mortem(traceback)
         sys.excepthook = pdb_hook
 
     cs = args.custom_namespaces.split(",")
 
     main.STRICT_CHECKING = args.strict
+    if args.offline:
+        utils.OFFLINE = True
+    if args.mapping_ttl is not None:
+        utils.MAPPING_TTL = args.mapping_ttl
 
     # Configure Logging
     loglevel = logging.INFO
@@ -186,15 +340,19 @@ def cli():
         print(__version__)
         return 0
 
-    file_or_dir = args.file_or_directory
-    logger.debug("file_or_dir: %s", file_or_dir)
-    if file_or_dir is None:
+    paths = args.file_or_directory
+    logger.debug("file_or_dir: %s", paths)
+    if not paths:
         logger.warning("positional argument `file_or_directory` not provided.")
         raise RuntimeError("positional argument `file_or_directory` is required")
+    file_or_dir = paths[0]
     keys = args.key
     if keys == []:
         keys = None
     logger.debug('keys: %s', keys)
+    output_format = args.format
+    if output_format is None:
+        output_format = 'yaml' if args.yaml else 'conda' if args.conda else 'pprint'
 
     def dump_deps(deps, keys):
         """
@@ -208,58 +366,258 @@ def cli():
         if keys is None:
             keys = list(deps.keys())
         deps = {k: list(v) for k, v in deps.items() if k in keys}
-        if args.yaml:
+        if output_format == 'yaml':
+            import yaml
             print(yaml.dump(deps, default_flow_style=False))
-        elif args.conda:
+        elif output_format == 'conda':
             list_of_deps = [item for sublist in itertools.chain(deps.values())
                             for item in sublist]
             print(' '.join(list_of_deps))
         else:
+            from pprint import pprint
             pprint(deps)
 
-    if os.path.isdir(file_or_dir):
-        logger.debug("Treating {} as a directory and recursively searching "
-                     "it for python files".format(file_or_dir))
-        # directories are a little easier from the purpose of the API call.
-        # print the dependencies to the console and then exit
-        ignore = args.ignore.split(',')
-        deps = simple_import_search(
-            file_or_dir, remap=not args.no_remap,
-            ignore=ignore, custom_namespaces=cs,
-        )
-        dump_deps(deps, keys)
+    def stream_deps(results):
+        """
+        Print one json line per file as soon as it has been parsed, then one
+        with the dependencies of all of them.
+
+        Parameters
+        ----------
+        results : iterable
+            Yields (path, parse time in seconds or None, dependencies)
+        """
+        total = defaultdict(set)
+        files = 0
+        start = time.perf_counter()
+        for path, seconds, deps in results:
+            if not args.no_remap:
+                deps = sanitize_deps(deps)
+            deps = {k: sorted(v) for k, v in deps.items()
+                    if v and (keys is None or k in keys)}
+            for k, v in deps.items():
+                total[k].update(v)
+            files += 1
+            print(json.dumps({'path': path, 'deps': deps, 'seconds': seconds}),
+                  flush=True)
+        print(json.dumps({'path': None, 'files': files,
+                          'deps': {k: sorted(v) for k, v in total.items()},
+                          'seconds': time.perf_counter() - start}), flush=True)
+
+    cache = None
+    if not args.no_cache:
+        cache = (open_cache or open_parse_cache)(args.cache_dir)
+
+    def scan_notebooks():
+        not_notebooks = [path for path in paths if not path.endswith('.ipynb')]
+        if not_notebooks:
+            raise RuntimeError("Only jupyter notebooks can be inspected several at a "
+                               "time, not {}".format(', '.join(not_notebooks)))
+        logger.debug("Searching the code cells of {} jupyter notebooks"
+                     "".format(len(paths)))
+        if output_format == 'ndjson':
+            def results():
+                for path, deps, error in iter_notebook_dependencies(
+                        paths, custom_namespaces=cs, target_python=args.target_python,
+                        jobs=args.jobs, cache=cache):
+                    if error is not None:
+                        logger.error("Could not parse notebook: {}\n{}".format(path, error))
+                        continue
+                    # the cells of all the notebooks are analyzed as one batch
+                    yield path, None, deps
+            stream_deps(results())
+            return 0
+        all_deps = defaultdict(set)
+        for deps in notebooks_to_dependencies(
+                paths, remap=not args.no_remap, custom_namespaces=cs,
+                target_python=args.target_python, jobs=args.jobs, cache=cache).values():
+            for k, v in deps.items():
+                all_deps[k].update(v)
+        dump_deps({k: sorted(v) for k, v in all_deps.items() if v}, keys)
         return 0
-    elif os.path.isfile(file_or_dir):
-        if file_or_dir.endswith('ipynb'):
-            logger.debug("Treating {} as a jupyter notebook and searching "
-                         "all of its code cells".format(file_or_dir))
-            deps = notebook_path_to_dependencies(
-                file_or_dir,
-                remap=not args.no_remap,
-                custom_namespaces=cs,
-            )
-            sanitized = sanitize_deps(deps)
-            # print the dependencies to the console and then exit
-            dump_deps(sanitized, keys)
+
+    def scan_site_packages():
+        logger.debug("Treating {} as a site-packages directory and searching the "
+                     "python files of each distribution".format(file_or_dir))
+        ignore = [pattern for pattern in args.ignore.split(',') if pattern]
+        if output_format == 'ndjson':
+            from .distributions import scan_distributions
+            total = defaultdict(set)
+            start = time.perf_counter()
+            for dist, deps in scan_distributions(
+                    file_or_dir, custom_namespaces=cs, jobs=args.jobs, cache=cache,
+                    target_python=args.target_python, ignore=ignore):
+                if not args.no_remap:
+                    deps = sanitize_deps(deps)
+                deps = {k: v for k, v in deps.items() if keys is None or k in keys}
+                for k, v in deps.items():
+                    total[k].update(v)
+                print(json.dumps({'distribution': dist.name, 'version': dist.version,
+                                  'files': len(dist.files), 'deps': deps}), flush=True)
+            print(json.dumps({'distribution': None,
+                              'deps': {k: sorted(v) for k, v in total.items()},
+                              'seconds': time.perf_counter() - start}), flush=True)
+            return 0
+        all_deps = distribution_import_search(
+            file_or_dir, remap=not args.no_remap, ignore=ignore, custom_namespaces=cs,
+            jobs=args.jobs, cache=cache, target_python=args.target_python)
+        if output_format == 'conda':
+            union = defaultdict(set)
+            for deps in all_deps.values():
+                for k, v in deps.items():
+                    union[k].update(v)
+            dump_deps({k: sorted(v) for k, v in union.items()}, keys)
             return 0
-        elif file_or_dir.endswith('.py'):
-            logger.debug("Treating {} as a single python file"
-                         "".format(file_or_dir))
-            mod, path, import_finder = parse_file(file_or_dir, custom_namespaces=cs)
-            mods = defaultdict(set)
-            for k, v in import_finder.describe().items():
-                mods[k].update(v)
-            deps = {k: sorted(list(v)) for k, v in mods.items() if v}
+        per_distribution = {}
+        for name, deps in all_deps.items():
+            deps = {k: v for k, v in deps.items() if keys is None or k in keys}
+            if deps:
+                per_distribution[name] = deps
+        if output_format == 'yaml':
+            import yaml
+            print(yaml.dump(per_distribution, default_flow_style=False))
+        else:
+            from pprint import pprint
+            pprint(per_distribution)
+        return 0
 
-            sanitized = sanitize_deps(deps)
+    def scan_stdin():
+        logger.debug("Reading python source from stdin")
+        start = time.perf_counter()
+        import_finder = get_imported_libs(sys.stdin.read(), filename='<stdin>',
+                                          custom_namespaces=cs,
+                                          target_python=args.target_python, lean=True)
+        if output_format == 'ndjson':
+            stream_deps([('-', time.perf_counter() - start, import_finder.describe())])
+            return 0
+        deps = {k: sorted(v) for k, v in import_finder.describe().items()}
+        if not args.no_remap:
+            deps = sanitize_deps(deps)
+        dump_deps(deps, keys)
+        return 0
+
+    def scan():
+        if len(paths) > 1:
+            return scan_notebooks()
+        if file_or_dir == '-':
+            return scan_stdin()
+        if args.by_distribution and os.path.isdir(file_or_dir):
+            return scan_site_packages()
+        if args.by_distribution:
+            logger.warning("--by-distribution is ignored for {}, which is not a "
+                           "directory".format(file_or_dir))
+        archive = os.path.isfile(file_or_dir) and is_archive(file_or_dir)
+        if os.path.isdir(file_or_dir) or archive:
+            if archive:
+                logger.debug("Treating {} as an archive and searching the python "
+                             "files in it".format(file_or_dir))
+            else:
+                logger.debug("Treating {} as a directory and recursively searching "
+                             "it for python files".format(file_or_dir))
+            # directories are a little easier from the purpose of the API call.
             # print the dependencies to the console and then exit
-            dump_deps(sanitized, keys)
+            ignore = [pattern for pattern in args.ignore.split(',') if pattern]
+            incremental = args.incremental or args.changed is not None
+            if incremental and output_format == 'ndjson':
+                logger.warning("--incremental is ignored with --format ndjson")
+            elif incremental and archive:
+                logger.warning("--incremental is ignored for archives")
+            elif incremental:
+                from .cache import ScanSnapshot
+                changed = None
+                if args.changed is not None:
+                    changed = [path for path in args.changed.split(',') if path]
+                with ScanSnapshot(file_or_dir, cache_dir=args.cache_dir) as snapshot:
+                    deps = incremental_import_search(
+                        file_or_dir, changed=changed, remap=not args.no_remap,
+                        ignore=ignore, custom_namespaces=cs, jobs=args.jobs,
+                        cache=cache, target_python=args.target_python,
+                        default_excludes=not args.no_default_excludes,
+                        respect_gitignore=args.respect_gitignore,
+                        include_notebooks=args.include_notebooks, snapshot=snapshot,
+                    )
+                dump_deps(deps, keys)
+                return 0
+            if output_format == 'ndjson':
+                catchers = iterate_over_library(
+                    file_or_dir, custom_namespaces=cs, jobs=args.jobs, cache=cache,
+                    target_python=args.target_python, lean=True, ignore=ignore,
+                    default_excludes=not args.no_default_excludes,
+                    respect_gitignore=args.respect_gitignore,
+                    include_notebooks=args.include_notebooks,
+                )
+                stream_deps((path, catcher.parse_seconds, catcher.describe())
+                            for _, path, catcher in catchers)
+                return 0
+            deps = simple_import_search(
+                file_or_dir, remap=not args.no_remap,
+                ignore=ignore, custom_namespaces=cs, jobs=args.jobs,
+                cache=cache, target_python=args.target_python,
+                default_excludes=not args.no_default_excludes,
+                respect_gitignore=args.respect_gitignore,
+                include_notebooks=args.include_notebooks,
+            )
+            dump_deps(deps, keys)
             return 0
-        else:
-            # Any file with a suffix that is not ".ipynb" or ".py" will not
-            # be parsed correctly
-            msg = ("depfinder is only configured to work with jupyter "
-                   "notebooks and python source code files. It is anticipated "
-                   "that the file {} will not work with depfinder"
-                   "".format(file_or_dir))
-            raise RuntimeError(msg)
+        elif os.path.isfile(file_or_dir):
+            if file_or_dir.endswith('ipynb'):
+                logger.debug("Treating {} as a jupyter notebook and searching "
+                             "all of its code cells".format(file_or_dir))
+                if output_format == 'ndjson':
+                    start = time.perf_counter()
+                    deps = notebook_path_to_dependencies(
+                        file_or_dir, remap=False, custom_namespaces=cs,
+                        target_python=args.target_python,
+                    )
+                    stream_deps([(file_or_dir, time.perf_counter() - start, deps)])
+                    return 0
+                deps = notebook_path_to_dependencies(
+                    file_or_dir,
+                    remap=not args.no_remap,
+                    custom_namespaces=cs,
+                    target_python=args.target_python,
+                )
+                sanitized = sanitize_deps(deps)
+                # print the dependencies to the console and then exit
+                dump_deps(sanitized, keys)
+                return 0
+            elif file_or_dir.endswith('.py'):
+                logger.debug("Treating {} as a single python file"
+                             "".format(file_or_dir))
+                mod, path, import_finder = parse_file(file_or_dir, custom_namespaces=cs,
+                                                      cache=cache,
+                                                      target_python=args.target_python,
+                                                      lean=True)
+                if cache is not None:
+                    cache.flush()
+                if output_format == 'ndjson':
+                    stream_deps([(path, import_finder.parse_seconds,
+                                  import_finder.describe())])
+                    return 0
+                mods = defaultdict(set)
+                for k, v in import_finder.describe().items():
+                    mods[k].update(v)
+                deps = {k: sorted(list(v)) for k, v in mods.items() if v}
+
+                sanitized = sanitize_deps(deps)
+                # print the dependencies to the console and then exit
+                dump_deps(sanitized, keys)
+                return 0
+            else:
+                # Any file with a suffix that is not ".ipynb" or ".py" will not
+                # be parsed correctly
+                msg = ("depfinder is only configured to work with jupyter "
+                       "notebooks and python source code files. It is anticipated "
+                       "that the file {} will not work with depfinder"
+                       "".format(file_or_dir))
+                raise RuntimeError(msg)
+
+    if args.profile is None:
+        return scan()
+    with profiling.ScanProfile(top=args.profile_top) as profile:
+        ret = scan()
+    if args.profile == 'json':
+        print(profile.to_json(), file=sys.stderr)
+    else:
+        print(profile.format_table(), file=sys.stderr)
+    return ret
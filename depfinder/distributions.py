@@ -0,0 +1,216 @@
+"""Finding the imports of every distribution installed in an environment.
+
+Rather than walk a whole ``site-packages`` directory, `find_distributions`
+reads the ``RECORD`` of each ``*.dist-info`` directory, or the
+``installed-files.txt`` of each ``*.egg-info`` directory, to learn which
+python files every distribution installed. `scan_distributions` then parses
+all of those files in one go, through the parse cache and the worker
+processes like `depfinder.inspection.iterate_over_library`, and reports the
+dependencies of each distribution as soon as its files are done.
+
+Files that no distribution claims, such as those of packages installed with
+``setup.py develop`` or copied in by hand, are not scanned.
+"""
+from __future__ import print_function, division, absolute_import
+
+import csv
+import io
+import logging
+import os
+from collections import defaultdict
+
+from . import profiling
+from .ignore import ignore_matcher
+
+logger = logging.getLogger('depfinder')
+
+METADATA_SUFFIXES = ('.dist-info', '.egg-info')
+
+
+class Distribution(object):
+    """An installed distribution and the python files it installed
+
+    Attributes
+    ----------
+    name : str
+    version : str
+        Empty when the metadata does not say
+    metadata_dir : str
+        Path of the ``.dist-info`` or ``.egg-info`` directory
+    files : list of str
+        Paths of the python files of the distribution
+    """
+    __slots__ = ('name', 'version', 'metadata_dir', 'files')
+
+    def __init__(self, name, version, metadata_dir, files):
+        self.name = name
+        self.version = version
+        self.metadata_dir = metadata_dir
+        self.files = files
+
+    def __repr__(self):
+        return 'Distribution(%r, %r, %s files)' % (self.name, self.version, len(self.files))
+
+
+def _read_name_and_version(metadata_dir):
+    """Return (name, version) from the METADATA or PKG-INFO headers"""
+    name = version = None
+    for filename in ('METADATA', 'PKG-INFO'):
+        try:
+            with io.open(os.path.join(metadata_dir, filename), encoding='utf-8',
+                         errors='replace') as f:
+                for line in f:
+                    if not line.strip():
+                        # the end of the headers
+                        break
+                    key, _, value = line.partition(':')
+                    if key == 'Name':
+                        name = value.strip()
+                    elif key == 'Version':
+                        version = value.strip()
+        except (OSError, IOError):
+            continue
+        break
+    if name is None:
+        # foo_bar-1.0.dist-info
+        stem = os.path.splitext(os.path.basename(metadata_dir))[0]
+        name, _, dir_version = stem.partition('-')
+        version = version or dir_version.split('-')[0]
+    return name, version or ''
+
+
+def _installed_files(metadata_dir):
+    """Return the paths listed by RECORD or installed-files.txt, as absolute paths"""
+    if metadata_dir.endswith('.dist-info'):
+        # RECORD paths are relative to the directory the metadata is in
+        base = os.path.dirname(metadata_dir)
+        try:
+            with io.open(os.path.join(metadata_dir, 'RECORD'), encoding='utf-8',
+                         newline='') as f:
+                paths = [row[0] for row in csv.reader(f) if row]
+        except (OSError, IOError, csv.Error):
+            return []
+    else:
+        # and those of installed-files.txt to the .egg-info directory
+        base = metadata_dir
+        try:
+            with io.open(os.path.join(metadata_dir, 'installed-files.txt'),
+                         encoding='utf-8') as f:
+                paths = [line.rstrip('\n') for line in f if line.strip()]
+        except (OSError, IOError):
+            return []
+    return [os.path.normpath(os.path.join(base, *path.split('/'))) for path in paths]
+
+
+def find_distributions(site_packages, ignore=None):
+    """Return the distributions installed in `site_packages`, sorted by name
+
+    Parameters
+    ----------
+    site_packages : str
+    ignore : list of str or depfinder.ignore.IgnoreMatcher, optional
+        fnmatch patterns of file paths to leave out
+
+    Returns
+    -------
+    list of Distribution
+        The python files of each distribution are those of its files that are
+        in `site_packages`. A file claimed by several distributions is only
+        given to the first one.
+    """
+    ignore = ignore_matcher(ignore)
+    site_packages = os.path.abspath(site_packages)
+    prefix = os.path.join(site_packages, '')
+    with os.scandir(site_packages) as it:
+        metadata_dirs = sorted(entry.path for entry in it
+                               if entry.name.endswith(METADATA_SUFFIXES) and entry.is_dir())
+    distributions = []
+    claimed = set()
+    for metadata_dir in metadata_dirs:
+        name, version = _read_name_and_version(metadata_dir)
+        files = []
+        for path in _installed_files(metadata_dir):
+            if not path.endswith('.py') or not path.startswith(prefix) or path in claimed:
+                continue
+            if ignore and ignore(path):
+                profiling.count('ignored_files')
+                continue
+            claimed.add(path)
+            files.append(path)
+        distributions.append(Distribution(name, version, metadata_dir, files))
+    distributions.sort(key=lambda dist: (dist.name.lower(), dist.version))
+    return distributions
+
+
+def _own_modules(distribution, site_packages, trie):
+    """Return the names the modules of `distribution` are reported as"""
+    prefix = os.path.join(os.path.abspath(site_packages), '')
+    names = set()
+    for path in distribution.files:
+        parts = path[len(prefix):-len('.py')].split(os.sep)
+        if parts[-1] == '__init__':
+            parts.pop()
+        if parts:
+            names.add(trie.top_level('.'.join(parts)))
+    return names
+
+
+def scan_distributions(site_packages, custom_namespaces=None, jobs=None, cache=None,
+                       target_python=None, ignore=None):
+    """Find the dependencies of every distribution installed in `site_packages`
+
+    Parameters
+    ----------
+    site_packages : str
+    custom_namespaces, jobs, cache, target_python
+        See `depfinder.inspection.iterate_over_library`
+    ignore : list of str, optional
+        fnmatch patterns of file paths to leave out
+
+    Yields
+    ------
+    tuple
+        (Distribution, dict of sorted lists of names) for every distribution,
+        in the order of `find_distributions`. Imports of the distribution's
+        own modules are left out of 'required' and 'questionable'.
+    """
+    from . import inspection
+    from .trie import module_trie
+    if inspection.PACKAGE_NAME is None:
+        # the same as iterate_over_library, rather than the name of whichever
+        # file parse_file happens to see first
+        inspection.PACKAGE_NAME = os.path.basename(site_packages).split('.')[0]
+    target_python = inspection.normalize_target_python(target_python)
+    with profiling.phase('walk'):
+        distributions = find_distributions(site_packages, ignore)
+    trie = module_trie(custom_namespaces, target_python)
+    owner = {path: idx for idx, dist in enumerate(distributions) for path in dist.files}
+    paths = [path for dist in distributions for path in dist.files]
+    logger.debug("Scanning %s files of %s distributions in %s", len(paths),
+                 len(distributions), site_packages)
+
+    def summary(idx, deps):
+        own = _own_modules(distributions[idx], site_packages, trie)
+        for category in ('required', 'questionable'):
+            if category in deps:
+                deps[category] -= own
+        return distributions[idx], {k: sorted(v) for k, v in deps.items() if v}
+
+    # the files of a distribution are next to each other, so each summary is
+    # complete as soon as a file of a later distribution comes back
+    done = 0
+    deps = defaultdict(set)
+    for _, path, catcher in inspection._iterate_over_files(
+            paths, custom_namespaces=custom_namespaces, jobs=jobs, cache=cache,
+            target_python=target_python, lean=True):
+        idx = owner[path]
+        while done < idx:
+            yield summary(done, deps)
+            done += 1
+            deps = defaultdict(set)
+        for k, v in catcher.describe().items():
+            deps[k].update(v)
+    while done < len(distributions):
+        yield summary(done, deps)
+        done += 1
+        deps = defaultdict(set)
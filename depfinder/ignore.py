@@ -0,0 +1,73 @@
+"""Matching file paths against the user's ``ignore`` patterns.
+
+The patterns are shell style globs, as understood by `fnmatch`, that are
+matched against the full path of each file, e.g. ``*/tests/*``. Rather than
+calling `fnmatch` once per pattern and file, `IgnoreMatcher` compiles all of
+them into a single regular expression.
+
+Patterns that end in ``/*`` also match every path below any directory that
+matches the rest of the pattern, so the directory walk skips those directories
+without listing them.
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+from fnmatch import translate
+
+
+def _compile(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:%s)' % translate(pattern) for pattern in patterns))
+
+
+class IgnoreMatcher(object):
+    """Compiled set of ignore patterns
+
+    Parameters
+    ----------
+    patterns : iterable of str, optional
+        fnmatch style patterns, matched against full file paths
+
+    Examples
+    --------
+    >>> ignore = IgnoreMatcher(['*/tests/*', '*_pb2.py'])
+    >>> ignore('pkg/tests/test_foo.py')
+    True
+    >>> ignore.prunes('pkg/tests')
+    True
+    """
+    __slots__ = ('patterns', '_files', '_dirs')
+
+    def __init__(self, patterns=None):
+        self.patterns = tuple(os.path.normcase(pattern) for pattern in patterns or ())
+        self._files = _compile(self.patterns)
+        suffix = os.path.normcase('/*')
+        self._dirs = _compile([pattern[:-len(suffix)] for pattern in self.patterns
+                               if pattern.endswith(suffix) and len(pattern) > len(suffix)])
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    __nonzero__ = __bool__
+
+    def __call__(self, path):
+        """Return whether `path` matches any of the patterns"""
+        return self._files is not None and \
+            self._files.match(os.path.normcase(path)) is not None
+
+    def prunes(self, directory):
+        """Return whether every path below `directory` is ignored"""
+        return self._dirs is not None and \
+            self._dirs.match(os.path.normcase(directory)) is not None
+
+    def __repr__(self):
+        return 'IgnoreMatcher(%r)' % (list(self.patterns),)
+
+
+def ignore_matcher(ignore):
+    """Turn a list of patterns, None or an IgnoreMatcher into an IgnoreMatcher"""
+    if isinstance(ignore, IgnoreMatcher):
+        return ignore
+    return IgnoreMatcher(ignore)
@@ -33,16 +33,20 @@ import ast
 import logging
 import os
 import sys
+import time
 from collections import defaultdict
+from collections.abc import Mapping
 from typing import Union
 
-from .stdliblist import builtin_modules
+from .archive import archive_package_name, is_archive, iter_archive
+from .cache import parse_files_with_cache
+from .parallel import parse_files, parse_files_serially, resolve_jobs
+from .stdliblist import normalize_target_python, stdlib_modules
+from .trie import module_trie
+from .walk import walk_python_files
 
-from .utils import (
-    AST_QUESTIONABLE,
-    namespace_packages,
-    SKETCHY_TYPES_TABLE,
-)
+from . import profiling
+from .utils import SKETCHY_TYPES_TABLE
 
 logger = logging.getLogger('depfinder')
 
@@ -51,27 +55,203 @@ PACKAGE_NAME = None
 STRICT_CHECKING = False
 
 
-def get_top_level_import_name(name, custom_namespaces=None):
-    num_dot = name.count(".")
-    custom_namespaces = custom_namespaces or []
+def get_top_level_import_name(name, custom_namespaces=None, target_python=None):
+    """Return the name that an import of `name` is reported as
 
-    if name in namespace_packages or name in custom_namespaces or name in builtin_modules:
-        return name
-    elif any(
-        ((num_dot - nsp.count(".")) == 1) and name.startswith(nsp + ".")
-        for nsp in custom_namespaces
-    ):
-        # this branch happens when name is foo.bar.baz and the namespace is
-        # foo.bar
-        return name
-    else:
-        if '.' not in name:
-            return name
-        else:
-            return get_top_level_import_name(
-                name.rsplit('.', 1)[0],
-                custom_namespaces=custom_namespaces
-            )
+    This is the top level package of `name`, unless `name` is part of the
+    standard library of `target_python`, of a known namespace package or of
+    one of `custom_namespaces`, e.g. ``numpy.linalg`` -> ``numpy`` but
+    ``google.cloud.storage.blob`` -> ``google.cloud.storage``.
+    """
+    return module_trie(custom_namespaces, target_python).top_level(name)
+
+
+# the fields of a node that can hold statements, and so imports
+_BODY_FIELDS = frozenset(['body', 'orelse', 'finalbody', 'handlers', 'cases'])
+_STATEMENT_FIELDS = {}
+# marks where the walk in ImportFinder.visit leaves a questionable node
+_LEAVE_CONTEXT = object()
+
+
+def _statement_fields(cls):
+    fields = tuple(field for field in cls._fields if field in _BODY_FIELDS)
+    _STATEMENT_FIELDS[cls] = fields
+    return fields
+
+
+# the keys of the questionable flags in the dict view of an ImportRecord, in
+# the order they have always been listed in
+SKETCHY_KINDS = tuple(sorted(set(SKETCHY_TYPES_TABLE.values()),
+                             key=list(SKETCHY_TYPES_TABLE.values()).index))
+_KIND_FLAGS = dict((kind, 1 << idx) for idx, kind in enumerate(SKETCHY_KINDS))
+
+
+class SourceLines(object):
+    """The source lines that the ImportRecords of one piece of code point into
+
+    `parse_file` replaces them with the source of each import statement once
+    the file has been parsed, see `ImportFinder.detach_source`, so that the
+    records of a file do not hold on to all of its contents.
+    """
+    __slots__ = ('lines',)
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __reduce__(self):
+        return (SourceLines, (self.lines,))
+
+    def get(self):
+        return self.lines
+
+
+def _utf8_slice(line, start=None, end=None):
+    # ast column offsets count utf-8 bytes
+    try:
+        line.encode('ascii')
+    except UnicodeEncodeError:
+        return line.encode('utf-8')[start:end].decode('utf-8', 'replace')
+    return line[start:end]
+
+
+class ImportRecord(Mapping):
+    """A single import statement in `ImportFinder.total_imports`
+
+    Records are read-only mappings that look like the dicts depfinder used to
+    store, e.g.::
+
+        {'exact_line': 'import numpy as np', 'try': False, 'match': False,
+         'function': True, 'async-function': False, 'if': False,
+         'while': False, 'for': False, 'async-for': False,
+         'import': {'numpy'}}
+
+    but only store the questionable context as a bitmask and compute
+    `exact_line` from the source when it is asked for. Records are not dicts:
+    they can not be changed, and `json.dumps` needs ``dict(record)``.
+
+    Attributes
+    ----------
+    kind : str
+        'import' or 'import_from'
+    names : frozenset of str
+        The imported modules
+    flags : int
+        Bitmask of the questionable statements the import is nested in
+    lineno, end_lineno, col_offset, end_col_offset : int
+        Where the statement is in the source
+    """
+    __slots__ = ('kind', 'names', 'flags', 'lineno', 'end_lineno', 'col_offset',
+                 'end_col_offset', '_source')
+
+    def __init__(self, kind, names, flags, lineno, end_lineno=None, col_offset=None,
+                 end_col_offset=None, source=None):
+        self.kind = kind
+        self.names = frozenset(names)
+        self.flags = flags
+        self.lineno = lineno
+        self.end_lineno = end_lineno if end_lineno is not None else lineno
+        self.col_offset = col_offset
+        self.end_col_offset = end_col_offset
+        # a SourceLines, the source of the statement or None if it is unknown
+        self._source = source
+
+    @property
+    def questionable(self):
+        """Whether the import is in a questionable context, e.g. a try block"""
+        return bool(self.flags)
+
+    @property
+    def exact_line(self):
+        """The import statement as ``ast.unparse`` writes it
+
+        The statement is sliced from the source and unparsed again, so that
+        it reads the same as when it was unparsed while scanning. On python
+        < 3.9 the source of the statement is returned as it is written.
+        """
+        segment = self.source_segment()
+        if segment is None:
+            return None
+        try:
+            tree = ast.parse(segment)
+        except SyntaxError:
+            # python < 3.8 only knows where a statement starts
+            return segment
+        line = _unparse(tree.body[0]) if tree.body else None
+        return segment if line is None else line
+
+    def source_segment(self):
+        """Return the source of the import statement, as it was written
+
+        Like `ast.get_source_segment`, the lines after the first one keep
+        their indentation. Records that were made without the source hold the
+        unparsed statement instead. None if neither is available.
+        """
+        source = self._source
+        if source is None:
+            return None
+        if isinstance(source, str):
+            return source
+        lines = source.get()[self.lineno - 1:self.end_lineno]
+        if not lines:
+            return None
+        if self.end_col_offset is None:
+            return lines[0].strip()
+        if len(lines) == 1:
+            return _utf8_slice(lines[0], self.col_offset, self.end_col_offset)
+        lines[0] = _utf8_slice(lines[0], self.col_offset)
+        lines[-1] = _utf8_slice(lines[-1], None, self.end_col_offset)
+        return '\n'.join(lines)
+
+    def _keys(self):
+        if self._source is not None:
+            yield 'exact_line'
+        for kind in SKETCHY_KINDS:
+            yield kind
+        yield self.kind
+
+    def __getitem__(self, key):
+        if key == self.kind:
+            return set(self.names)
+        if key in _KIND_FLAGS:
+            return bool(self.flags & _KIND_FLAGS[key])
+        if key == 'exact_line' and self._source is not None:
+            return self.exact_line
+        raise KeyError(key)
+
+    def __iter__(self):
+        return self._keys()
+
+    def __len__(self):
+        return len(SKETCHY_KINDS) + 1 + (self._source is not None)
+
+    def __repr__(self):
+        return 'ImportRecord(%r)' % dict(self)
+
+    def __reduce__(self):
+        # positional arguments pickle much smaller than the default slot state
+        return (ImportRecord, (self.kind, self.names, self.flags, self.lineno,
+                               self.end_lineno, self.col_offset, self.end_col_offset,
+                               self._source))
+
+    def to_payload(self):
+        """Return the record as plain, json-able data. See `from_payload`."""
+        return [self.kind, sorted(self.names), self.flags, self.end_lineno,
+                self.col_offset, self.end_col_offset, self.source_segment()]
+
+    @classmethod
+    def from_payload(cls, lineno, payload):
+        kind, names, flags, end_lineno, col_offset, end_col_offset, segment = payload
+        return cls(kind, names, flags, lineno, end_lineno, col_offset, end_col_offset,
+                   segment)
+
+
+def _unparse(node):
+    try:
+        with profiling.phase('unparse'):
+            return ast.unparse(node)
+    except AttributeError:
+        # python < 3.9
+        return None
 
 
 class ImportFinder(ast.NodeVisitor):
@@ -86,13 +266,29 @@ class ImportFinder(ast.NodeVisitor):
         The list of imports that were found inside of try/except blocks,
         function definitions and class definitions
     imports : list
-        The list of all ast.Import nodes in the AST
+        The list of all ast.Import nodes in the AST. Always empty when `lean`
     import_froms : list
-        The list of all ast.ImportFrom nodes in the AST
+        The list of all ast.ImportFrom nodes in the AST. Always empty when
+        `lean`
+    total_imports : dict
+        Maps every imported name to a dict of {(filename, lineno): ImportRecord}
+    target_python : str or None
+        The version of python whose standard library imports are classified
+        as builtin, e.g. '3.12'. None means the running interpreter.
+    source : SourceLines or None
+        The source that was parsed. The `exact_line` of the ImportRecords is
+        read from it. None once `detach_source` has been called.
+    parse_seconds : float or None
+        How long it took `parse_file`, or the parse cache, to produce this
+        ImportFinder. None if it came from neither.
+    lean : bool
+        If True, the AST nodes are not kept in `imports` and `import_froms`,
+        so that nothing holds on to the tree once it has been visited
 
     """
 
-    def __init__(self, filename='', custom_namespaces=None):
+    def __init__(self, filename='', custom_namespaces=None, target_python=None,
+                 source=None, lean=False):
         self.filename = filename
         self.required_modules = set()
         self.sketchy_modules = set()
@@ -101,30 +297,71 @@ class ImportFinder(ast.NodeVisitor):
         self.imports = []
         self.import_froms = []
         self.total_imports = defaultdict(dict)
-        self.sketchy_nodes = {}
+        # the SKETCHY_TYPES_TABLE kinds of the nodes enclosing the import that
+        # is being visited
+        self._context = []
         self.custom_namespaces = custom_namespaces or []
+        self.nodes_visited = 0
+        self.parse_seconds = None
+        self.target_python = normalize_target_python(target_python)
+        self._stdlib_modules = stdlib_modules(self.target_python)
+        self.source = source
+        self.lean = lean
+        self._module_trie = None
         super(ImportFinder, self).__init__()
 
     def visit(self, node):
-        """Recursively visit all ast nodes.
+        """Find the imports in the tree under `node`.
 
         Look for Import and ImportFrom nodes. Classify them as being imports
         that are built in, relative, required or questionable. Questionable
-        imports are those that occur within the context of a try/except block, a
-        function definition or a class definition.
+        imports are those that occur within the context of a try/except block,
+        a function definition, a loop or an if/else or match statement.
+
+        Only the statements that can contain other statements are descended
+        into, since an import can not occur inside an expression. The tree is
+        walked with an explicit stack so that deeply nested code does not run
+        into the recursion limit.
 
         Parameters
         ----------
         node : ast.AST
-            The node to start the recursion
+            The node to start the search from
         """
-        # add the node to the try/except block to signify that
-        # something potentially odd is going on in this import
-        if isinstance(node, AST_QUESTIONABLE):
-            self.sketchy_nodes[node] = node
-        super(ImportFinder, self).visit(node)
-        # after the node has been recursed in to, remove the try node
-        self.sketchy_nodes.pop(node, None)
+        context = self._context
+        todo = [node]
+        while todo:
+            node = todo.pop()
+            if node is _LEAVE_CONTEXT:
+                context.pop()
+                continue
+            self.nodes_visited += 1
+            cls = node.__class__
+            if cls is ast.Import:
+                self.visit_Import(node)
+                continue
+            if cls is ast.ImportFrom:
+                self.visit_ImportFrom(node)
+                continue
+            fields = _STATEMENT_FIELDS.get(cls)
+            if fields is None:
+                fields = _statement_fields(cls)
+            if not fields:
+                continue
+            kind = SKETCHY_TYPES_TABLE.get(cls)
+            if kind is not None:
+                # something potentially odd is going on with the imports under
+                # this node. The marker pops it off again once they are done
+                context.append(kind)
+                todo.append(_LEAVE_CONTEXT)
+            children = []
+            for field in fields:
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    children.extend(value)
+            # reversed, so that the statements are visited in source order
+            children.reverse()
+            todo.extend(children)
 
     def visit_Import(self, node: ast.Import):
         """Executes when an ast.Import node is encountered
@@ -136,13 +373,11 @@ class ImportFinder(ast.NodeVisitor):
         attribute. Otherwise the module will be added to the `required_modules`
         instance attribute
         """
-        self.imports.append(node)
+        if not self.lean:
+            self.imports.append(node)
         self._add_to_total_imports(node)
 
-        mods = set([
-            get_top_level_import_name(name.name, custom_namespaces=self.custom_namespaces)
-            for name in node.names
-        ])
+        mods = set([self._top_level_import_name(name.name) for name in node.names])
         for mod in mods:
             self._add_import_node(mod)
 
@@ -156,57 +391,60 @@ class ImportFinder(ast.NodeVisitor):
         attribute. Otherwise the module will be added to the `required_modules`
         instance attribute
         """
-        self.import_froms.append(node)
+        if not self.lean:
+            self.import_froms.append(node)
         if node.module is None:
             # this is a relative import like 'from . import bar'
             # so do nothing
             return
         if node.level > 0:
             # this is a relative import like 'from .foo import bar'
-            node_name = get_top_level_import_name(
-                node.module, custom_namespaces=self.custom_namespaces
-            )
+            node_name = self._top_level_import_name(node.module)
             self.relative_modules.add(node_name)
             return
         # this is a non-relative import like 'from foo import bar'
         self._add_to_total_imports(node)
-        node_name = get_top_level_import_name(
-            node.module,
-            custom_namespaces=self.custom_namespaces,
-        )
+        node_name = self._top_level_import_name(node.module)
         self._add_import_node(node_name)
 
-    def _add_to_total_imports(self, node: Union[ast.Import, ast.ImportFrom]):
-        import_metadata = {}
-        try:
-            import_metadata.update({'exact_line': ast.unparse(node)})
-        except AttributeError:
-            pass
+    def _top_level_import_name(self, name):
+        if '.' not in name:
+            return name
+        if self._module_trie is None:
+            # looked up on first use since building it loads the name mapping
+            self._module_trie = module_trie(self.custom_namespaces, self.target_python)
+        return self._module_trie.top_level(name)
 
-        import_metadata.update({v: False for v in SKETCHY_TYPES_TABLE.values()})
-        import_metadata.update({SKETCHY_TYPES_TABLE[node.__class__]: True for node in self.sketchy_nodes})
-        names = set()
+    def _add_to_total_imports(self, node: Union[ast.Import, ast.ImportFrom]):
         if isinstance(node, ast.Import):
-            _names = set(name.name for name in node.names)
-            import_metadata['import'] = _names
-            names.update(_names)
+            kind = 'import'
+            names = set(name.name for name in node.names)
         elif isinstance(node, ast.ImportFrom):
-            import_metadata['import_from'] = {node.module}
-            names.add(node.module)
+            kind = 'import_from'
+            names = {node.module}
         else:
             raise NotImplementedError(f"Expected ast.Import or ast.ImportFrom this is {type(node)}")
-
+        flags = 0
+        for context_kind in self._context:
+            flags |= _KIND_FLAGS[context_kind]
+        # without the source, fall back to rebuilding the line from the AST
+        source = self.source if self.source is not None else _unparse(node)
+        record = ImportRecord(
+            kind, names, flags, node.lineno, getattr(node, 'end_lineno', None),
+            getattr(node, 'col_offset', None), getattr(node, 'end_col_offset', None),
+            source,
+        )
         for name in names:
-            self.total_imports[name].update({(self.filename, node.lineno): import_metadata})
+            self.total_imports[name][(self.filename, node.lineno)] = record
 
     def _add_import_node(self, node_name):
         # see if the module is a builtin
-        if node_name in builtin_modules:
+        if node_name in self._stdlib_modules:
             self.builtin_modules.add(node_name)
             return
 
         # see if we are in a try block
-        if self.sketchy_nodes:
+        if self._context:
             self.sketchy_modules.add(node_name)
             return
 
@@ -237,17 +475,76 @@ class ImportFinder(ast.NodeVisitor):
         desc = {k: v for k, v in desc.items() if v}
         return desc
 
+    def to_payload(self):
+        """Return the results of this ImportFinder as plain, json-able data
+
+        The file name is left out of `total_imports` so that the payload only
+        depends on the contents of the file. See `from_payload`.
+        """
+        total_imports = []
+        for name, locations in self.total_imports.items():
+            for (_, lineno), record in locations.items():
+                total_imports.append([name, lineno, record.to_payload()])
+        return {
+            'describe': {k: sorted(v) for k, v in self.describe().items()},
+            'total_imports': total_imports,
+        }
+
+    @classmethod
+    def from_payload(cls, payload, filename='', custom_namespaces=None,
+                     target_python=None):
+        """Rebuild an ImportFinder from the output of `to_payload`
+
+        The `imports` and `import_froms` lists of AST nodes are not part of the
+        payload and are left empty.
+        """
+        finder = cls(filename=filename, custom_namespaces=custom_namespaces,
+                     target_python=target_python)
+        describe = payload['describe']
+        finder.required_modules = set(describe.get('required', []))
+        finder.relative_modules = set(describe.get('relative', []))
+        finder.sketchy_modules = set(describe.get('questionable', []))
+        finder.builtin_modules = set(describe.get('builtin', []))
+        total_imports = defaultdict(dict)
+        for name, lineno, record in payload['total_imports']:
+            total_imports[name][(filename, lineno)] = ImportRecord.from_payload(
+                lineno, record)
+        finder.total_imports = dict(total_imports)
+        return finder
+
+    def detach_source(self):
+        """Keep the source of each import on its record and drop the rest
+
+        The `exact_line` of the records then no longer needs `source`, which
+        is set to None.
+        """
+        if not isinstance(self.source, SourceLines):
+            return
+        seen = set()
+        for locations in self.total_imports.values():
+            for record in locations.values():
+                if id(record) not in seen:
+                    seen.add(id(record))
+                    record._source = record.source_segment()
+        self.source = None
+
     def __repr__(self):
         return 'ImportCatcher: %s' % repr(self.describe())
 
 
-def get_imported_libs(code, filename='', custom_namespaces=None):
+def get_imported_libs(code, filename='', custom_namespaces=None, target_python=None,
+                      lean=False):
     """Given a code snippet, return a list of the imported libraries
 
     Parameters
     ----------
     code : str
         The code to parse and look for imports
+    target_python : str, optional
+        Classify builtin imports against the standard library of this
+        version of python, e.g. '3.12'. Defaults to the running interpreter.
+    lean : bool, optional
+        Do not keep the AST nodes of the imports. See `ImportFinder`.
 
     Returns
     -------
@@ -268,22 +565,39 @@ def get_imported_libs(code, filename='', custom_namespaces=None):
     {'builtin': {'__future__', 'json', 'ast', 'os', 'sys', 'collections'},
      'required': {'stdlib_list'}}
     """
-    # skip ipython notebook lines
-    code = '\n'.join([line for line in code.split('\n')
-                      if not line.startswith('%')])
-    tree = ast.parse(code)
-    import_finder = ImportFinder(filename=filename, custom_namespaces=custom_namespaces)
-    import_finder.visit(tree)
+    with profiling.phase('parse'):
+        # skip ipython notebook lines
+        lines = [line for line in code.split('\n') if not line.startswith('%')]
+        tree = ast.parse('\n'.join(lines))
+    import_finder = ImportFinder(filename=filename, custom_namespaces=custom_namespaces,
+                                 target_python=target_python, source=SourceLines(lines),
+                                 lean=lean)
+    with profiling.phase('visit'):
+        import_finder.visit(tree)
+    profiling.count('ast_nodes', import_finder.nodes_visited)
     return import_finder
 
 
-def parse_file(python_file, custom_namespaces=None):
+def parse_file(python_file, custom_namespaces=None, cache=None, target_python=None,
+               lean=False):
     """Parse a single python file
 
     Parameters
     ----------
     python_file : str
-        Path to the python file to parse for imports
+        Path to the python file to parse for imports. The code cells of a
+        jupyter notebook, a path ending in ``.ipynb``, are parsed as one
+        python script, see `depfinder.notebook.notebook_to_python`.
+    custom_namespaces : list of str or None
+    cache : depfinder.cache.ParseCache, optional
+        If provided, the result is served from / stored in this cache. New
+        results are only written to disk when the cache is flushed or closed,
+        so that a loop over many files commits once.
+    target_python : str, optional
+        Classify builtin imports against the standard library of this
+        version of python, e.g. '3.12'. Defaults to the running interpreter.
+    lean : bool, optional
+        Do not keep the AST nodes of the imports. See `ImportFinder`.
 
     Returns
     -------
@@ -295,28 +609,84 @@ def parse_file(python_file, custom_namespaces=None):
         PACKAGE_NAME = os.path.basename(python_file).split('.')[0]
         logger.debug("Setting PACKAGE_NAME global variable to {}"
                      "".format(PACKAGE_NAME))
+    start = time.perf_counter()
+    profile = profiling.active()
+    if profile is None:
+        result = _parse_file(python_file, custom_namespaces, cache, target_python, lean)
+    else:
+        with profile.file(python_file):
+            result = _parse_file(python_file, custom_namespaces, cache, target_python, lean)
+    result[2].parse_seconds = time.perf_counter() - start
+    return result
+
+
+def _parse_file(python_file, custom_namespaces, cache, target_python, lean=False):
+    if cache is not None:
+        key = cache.key_for_file(python_file, custom_namespaces, target_python)
+        payload = cache.get(key)
+        if payload is not None:
+            catcher = ImportFinder.from_payload(
+                payload, filename=python_file, custom_namespaces=custom_namespaces,
+                target_python=target_python)
+            return os.path.split(python_file)[:-3], python_file, catcher
+        result = _parse_file(python_file, custom_namespaces, None, target_python, lean)
+        cache.put(key, result[2].to_payload())
+        return result
+    if python_file.endswith('.ipynb'):
+        from .notebook import notebook_to_python
+        with profiling.phase('read'):
+            code = notebook_to_python(python_file)
+        catcher = get_imported_libs(
+            code, filename=python_file, custom_namespaces=custom_namespaces,
+            target_python=target_python, lean=lean,
+        )
+        catcher.total_imports = dict(catcher.total_imports)
+        catcher.detach_source()
+        return os.path.split(python_file)[:-3], python_file, catcher
     # Try except block added for adal package which has a BOM at the beginning,
     # requiring a different encoding to load properly
     try:
-        with open(python_file, 'r') as f:
-            code = f.read()
+        with profiling.phase('read'):
+            with open(python_file, 'r') as f:
+                code = f.read()
         catcher = get_imported_libs(
-            code, filename=python_file, custom_namespaces=custom_namespaces
+            code, filename=python_file, custom_namespaces=custom_namespaces,
+            target_python=target_python, lean=lean,
         )
     except SyntaxError:
-        with open(python_file, 'r', encoding='utf-8-sig') as f:
-            code = f.read()
+        with profiling.phase('read'):
+            with open(python_file, 'r', encoding='utf-8-sig') as f:
+                code = f.read()
         catcher = get_imported_libs(
-            code, filename=python_file, custom_namespaces=custom_namespaces
+            code, filename=python_file, custom_namespaces=custom_namespaces,
+            target_python=target_python, lean=lean,
         )
     catcher.total_imports = dict(catcher.total_imports)
+    # rather than keep the whole source alive, or read the file again, which
+    # may have changed by the time an exact_line is asked for
+    catcher.detach_source()
     mod_name = os.path.split(python_file)[:-3]
     return mod_name, python_file, catcher
 
 
-def iterate_over_library(path_to_source_code, custom_namespaces=None):
+def _iter_python_files(path_to_source_code, ignore=None, default_excludes=False,
+                       respect_gitignore=False, include_notebooks=False):
+    return walk_python_files(path_to_source_code, ignore=ignore,
+                             default_excludes=default_excludes,
+                             respect_gitignore=respect_gitignore,
+                             include_notebooks=include_notebooks)
+
+
+def iterate_over_library(path_to_source_code, custom_namespaces=None, jobs=None,
+                         cache=None, target_python=None, lean=False, ignore=None,
+                         default_excludes=False, respect_gitignore=False,
+                         include_notebooks=False):
     """Helper function to recurse into a library and find imports in .py files.
 
+    `path_to_source_code` can also be a wheel, sdist, zip or tar archive,
+    whose python files are read without extracting it. See
+    `depfinder.archive.iter_archive`.
+
     This allows the user to apply filters on the user-side to exclude imports
     based on their file names.
     `conda-skeletor <https://github.com/ericdill/conda-skeletor>`_
@@ -325,6 +695,39 @@ def iterate_over_library(path_to_source_code, custom_namespaces=None):
     Parameters
     ----------
     path_to_source_code : str
+    custom_namespaces : list of str or None
+    jobs : int, optional
+        Number of worker processes used to parse the files. None or 1 parses
+        serially, 0 uses one worker per CPU. Small trees, and archives, are
+        always parsed serially since starting the workers would cost more
+        than it saves. The results are yielded in the same order either way.
+    cache : depfinder.cache.ParseCache, optional
+        If provided, files whose contents are already in the cache are not
+        parsed again and identical copies of a file are only parsed once.
+        Results served from the cache have empty `imports` and `import_froms`
+        lists.
+    target_python : str, optional
+        Classify builtin imports against the standard library of this
+        version of python, e.g. '3.12'. Defaults to the running interpreter.
+    lean : bool, optional
+        Do not keep the AST nodes of the imports in the yielded ImportCatchers,
+        so that memory does not grow with the size of the tree when the
+        catchers are kept around. Their `imports` and `import_froms` lists
+        are empty. This also saves sending the nodes back from the worker
+        processes when `jobs` > 1.
+    ignore : list of str or depfinder.ignore.IgnoreMatcher, optional
+        fnmatch patterns of file paths to skip. Matching files are neither
+        read nor parsed, and directories whose contents all match a pattern
+        ending in ``/*``, such as ``*/tests/*``, are not walked at all.
+    default_excludes : bool, optional
+        Skip version control and tool directories, virtual environments,
+        site-packages and build copies of the sources. See
+        `depfinder.walk`. Defaults to False, the cli turns it on.
+    respect_gitignore : bool, optional
+        Skip the files and directories that git ignores
+    include_notebooks : bool, optional
+        Also find the imports in the code cells of the .ipynb files. They go
+        through the parse cache and the worker processes like .py files.
 
     Yields
     -------
@@ -333,22 +736,66 @@ def iterate_over_library(path_to_source_code, custom_namespaces=None):
     """
     global PACKAGE_NAME
     global STRICT_CHECKING
+    archive = is_archive(path_to_source_code) and os.path.isfile(path_to_source_code)
     if PACKAGE_NAME is None:
-        PACKAGE_NAME = os.path.basename(path_to_source_code).split('.')[0]
+        if archive:
+            PACKAGE_NAME = archive_package_name(path_to_source_code)
+        else:
+            PACKAGE_NAME = os.path.basename(path_to_source_code).split('.')[0]
         logger.debug("Setting PACKAGE_NAME global variable to {}"
                      "".format(PACKAGE_NAME))
+    if archive:
+        results = iter_archive(path_to_source_code, custom_namespaces, cache,
+                               normalize_target_python(target_python), lean, ignore,
+                               default_excludes)
+        for result in _skip_failures(results):
+            yield result
+        return
+    python_files = profiling.iterate('walk', _iter_python_files(
+        path_to_source_code, ignore, default_excludes, respect_gitignore,
+        include_notebooks))
+    for result in _iterate_over_files(python_files, custom_namespaces, jobs, cache,
+                                      target_python, lean):
+        yield result
+
+
+def _iterate_over_files(python_files, custom_namespaces=None, jobs=None, cache=None,
+                        target_python=None, lean=False):
+    """Parse `python_files`, see `iterate_over_library`"""
+    jobs = resolve_jobs(jobs)
+    target_python = normalize_target_python(target_python)
+    if cache is not None:
+        # a serial scan looks every file up as it gets to it, so that the
+        # results come out as they are found, like they do without a cache
+        results = parse_files_with_cache(
+            python_files, cache,
+            lambda paths: parse_files(paths, jobs, custom_namespaces=custom_namespaces,
+                                      target_python=target_python, lean=lean),
+            custom_namespaces=custom_namespaces, target_python=target_python,
+            streaming=jobs == 1,
+        )
+    elif jobs > 1:
+        results = parse_files(list(python_files), jobs,
+                              custom_namespaces=custom_namespaces,
+                              target_python=target_python, lean=lean)
+    else:
+        results = parse_files_serially(python_files, custom_namespaces=custom_namespaces,
+                                       target_python=target_python, lean=lean)
+    for result in _skip_failures(results):
+        yield result
+
+
+def _skip_failures(results):
+    """Yield the parse_file results of `results`, logging the files that failed"""
     skipped_files = []
     all_files = []
-    for parent, folders, files in os.walk(path_to_source_code):
-        for f in files:
-            if f.endswith('.py'):
-                full_file_path = os.path.join(parent, f)
-                all_files.append(full_file_path)
-                try:
-                    yield parse_file(full_file_path, custom_namespaces=custom_namespaces)
-                except Exception:
-                    logger.exception("Could not parse file: {}".format(full_file_path))
-                    skipped_files.append(full_file_path)
+    for full_file_path, result, error in results:
+        all_files.append(full_file_path)
+        if error is not None:
+            logger.error("Could not parse file: {}\n{}".format(full_file_path, error))
+            skipped_files.append(full_file_path)
+            continue
+        yield result
     if skipped_files:
         logger.warning("Skipped {}/{} files".format(len(skipped_files), len(all_files)))
         for idx, f in enumerate(skipped_files):
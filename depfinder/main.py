@@ -30,21 +30,24 @@
 from __future__ import print_function, division, absolute_import
 
 import copy
-import io
-import json
 import logging
+import os
 from collections import defaultdict
-from fnmatch import fnmatch
 
-from .inspection import iterate_over_library, get_imported_libs
-from .utils import pkg_data
+from . import profiling, utils
+from .ignore import ignore_matcher
+from .inspection import get_imported_libs, iterate_over_library  # noqa: F401
+from .notebook import cell_dependencies, iter_code_cells, iter_notebook_dependencies
+from .trie import builtin_trie
 
 logger = logging.getLogger('depfinder')
 
 STRICT_CHECKING = False
 
 
-def simple_import_search(path_to_source_code, remap=True, ignore=None, custom_namespaces=None):
+def simple_import_search(path_to_source_code, remap=True, ignore=None, custom_namespaces=None,
+                         jobs=None, cache=None, target_python=None, default_excludes=False,
+                         respect_gitignore=False, include_notebooks=False):
     """Return all imported modules in all .py files in `path_to_source_code`
 
     Parameters
@@ -58,6 +61,22 @@ def simple_import_search(path_to_source_code, remap=True, ignore=None, custom_na
         If not None, then resulting package outputs will list everying under these
         namespaces (e.g., for packages foo.bar and foo.baz, the outputs are foo.bar
         and foo.baz instead of foo if custom_namespaces=["foo"]).
+    jobs : int, optional
+        Number of worker processes used to parse the files. None or 1 parses
+        serially, 0 uses one worker per CPU. See `iterate_over_library`.
+    cache : depfinder.cache.ParseCache, optional
+        Persistent parse cache. Unchanged files are not parsed again.
+    target_python : str, optional
+        Classify builtin imports against the standard library of this version
+        of python, e.g. '3.12', instead of that of the running interpreter.
+    default_excludes : bool, optional
+        Skip version control and tool directories, virtual environments,
+        site-packages and build copies. See `iterate_over_library`. The cli
+        turns this on unless --no-default-excludes is given.
+    respect_gitignore : bool, optional
+        Skip the files and directories that git ignores
+    include_notebooks : bool, optional
+        Also find the imports in the code cells of the .ipynb files
 
     Returns
     -------
@@ -85,11 +104,14 @@ def simple_import_search(path_to_source_code, remap=True, ignore=None, custom_na
                   'test_with_code']}
     """
     all_deps = defaultdict(set)
-    catchers = iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces)
+    # only the summaries are kept, so the AST nodes need not be
+    catchers = iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces,
+                                    jobs=jobs, cache=cache, target_python=target_python,
+                                    lean=True, ignore=ignore,
+                                    default_excludes=default_excludes,
+                                    respect_gitignore=respect_gitignore,
+                                    include_notebooks=include_notebooks)
     for mod, path, catcher in catchers:
-        # if ignore provided skip things which match the ignore pattern
-        if ignore and any(fnmatch(path, i) for i in ignore):
-            continue
         for k, v in catcher.describe().items():
             all_deps[k].update(v)
 
@@ -99,7 +121,168 @@ def simple_import_search(path_to_source_code, remap=True, ignore=None, custom_na
     return all_deps
 
 
-def notebook_path_to_dependencies(path_to_notebook, remap=True, custom_namespaces=None):
+def _git(root, *args):
+    """Return the output of a git command run in `root`, or None if it fails"""
+    import subprocess
+    try:
+        return subprocess.check_output(('git', '-C', root) + args,
+                                       stderr=subprocess.DEVNULL).decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _git_state(root, base=None):
+    """Return (HEAD, files changed since `base`, files that differ from HEAD)
+
+    Paths are absolute. The changed files are None if `base` is None or git
+    cannot compare against it. Returns None when `root` is not in a git
+    repository.
+    """
+    head = _git(root, 'rev-parse', 'HEAD')
+    dirty = _git(root, 'diff', '--name-only', '--relative', '-z', 'HEAD', '--')
+    untracked = _git(root, 'ls-files', '--others', '--exclude-standard', '-z')
+    if head is None or dirty is None or untracked is None:
+        return None
+    dirty = [os.path.join(root, path) for path in (dirty + untracked).split('\0') if path]
+    changed = None
+    if base is not None:
+        diff = _git(root, 'diff', '--name-only', '--relative', '-z', base, '--')
+        if diff is not None:
+            changed = [os.path.join(root, path) for path in diff.split('\0') if path]
+            changed.extend(dirty)
+    return head.strip(), changed, dirty
+
+
+def incremental_import_search(path_to_source_code, changed=None, remap=True, ignore=None,
+                              custom_namespaces=None, jobs=None, cache=None,
+                              target_python=None, default_excludes=False,
+                              respect_gitignore=False, include_notebooks=False,
+                              snapshot=None):
+    """`simple_import_search` that only parses the files that changed
+
+    The per-file results of the tree are kept in a `depfinder.cache.ScanSnapshot`.
+    The first call, and any call with different options, scans the whole tree.
+    Later calls only parse the `changed` files and work the result out from the
+    snapshot, so they take time in proportion to the size of the change
+    rather than of the tree. The result is the same as that of
+    `simple_import_search`.
+
+    Parameters
+    ----------
+    path_to_source_code : str
+    changed : list of str, optional
+        Files and directories that were added, modified or deleted since the
+        last call, e.g. the output of ``git diff --name-only``. Defaults to
+        asking git for what changed since the snapshot was taken. Changes to
+        files that git ignores are not noticed that way. Outside of a git
+        repository the whole tree is scanned again.
+    snapshot : depfinder.cache.ScanSnapshot, optional
+        Defaults to the snapshot of `path_to_source_code` in the default
+        cache directory
+    remap, ignore, custom_namespaces, jobs, cache, target_python, default_excludes, respect_gitignore, include_notebooks
+        See `simple_import_search`
+
+    Returns
+    -------
+    dict
+        See `simple_import_search`
+    """
+    from . import inspection
+    from .cache import ScanSnapshot, CACHE_FORMAT, namespace_packages_digest
+    from .walk import is_walked, walk_python_files
+    from . import __version__
+    owns_snapshot = snapshot is None
+    if owns_snapshot:
+        snapshot = ScanSnapshot(path_to_source_code)
+    try:
+        root = snapshot.root
+        options = {
+            'version': __version__,
+            'format': CACHE_FORMAT,
+            'custom_namespaces': sorted(custom_namespaces or []),
+            'namespace_packages': namespace_packages_digest(),
+            'target_python': inspection.normalize_target_python(target_python),
+            'ignore': list(ignore_matcher(ignore).patterns),
+            'default_excludes': default_excludes,
+            'respect_gitignore': respect_gitignore,
+            'include_notebooks': include_notebooks,
+        }
+        git_state = None
+        if snapshot.get_meta('options') != options:
+            logger.debug("No snapshot of %s with these options, scanning all of it", root)
+            to_scan = None
+        elif changed is not None:
+            to_scan = [os.path.abspath(path) for path in changed]
+        else:
+            git_state = _git_state(root, snapshot.get_meta('git_head'))
+            if git_state is None or git_state[1] is None:
+                logger.debug("Could not find the changes to %s with git, "
+                             "scanning all of it", root)
+                to_scan = None
+            else:
+                to_scan = git_state[1] + [os.path.join(root, *path.split('/'))
+                                          for path in snapshot.get_meta('git_dirty', [])]
+        if changed is None and git_state is None:
+            git_state = _git_state(root)
+
+        if inspection.PACKAGE_NAME is None:
+            # the same as iterate_over_library, so that remapping matches
+            inspection.PACKAGE_NAME = os.path.basename(path_to_source_code).split('.')[0]
+        walk_options = dict(ignore=ignore, default_excludes=default_excludes,
+                            respect_gitignore=respect_gitignore,
+                            include_notebooks=include_notebooks)
+        if to_scan is None:
+            snapshot.reset()
+            python_files = walk_python_files(path_to_source_code, **walk_options)
+        else:
+            python_files = []
+            for path in sorted(set(to_scan)):
+                relpath = os.path.relpath(path, root)
+                if relpath.split(os.sep)[0] == os.pardir:
+                    continue
+                # build the paths the way the walk of the whole tree does, so
+                # that the ignore patterns see the same paths
+                path = path_to_source_code if relpath == os.curdir else \
+                    os.path.join(path_to_source_code, relpath)
+                if os.path.isdir(path):
+                    for stale in snapshot.paths_under(path):
+                        snapshot.remove(stale)
+                    if is_walked(path_to_source_code, path, **walk_options):
+                        python_files.extend(walk_python_files(path, **walk_options))
+                else:
+                    snapshot.remove(path)
+                    for stale in snapshot.paths_under(path):
+                        # a directory that was deleted
+                        snapshot.remove(stale)
+                    if os.path.isfile(path) and is_walked(path_to_source_code, path,
+                                                          **walk_options):
+                        python_files.append(path)
+            logger.debug("Parsing %s changed files of %s", len(python_files), root)
+        for _, path, catcher in inspection._iterate_over_files(
+                profiling.iterate('walk', python_files), custom_namespaces=custom_namespaces,
+                jobs=jobs, cache=cache, target_python=target_python, lean=True):
+            snapshot.replace(path, catcher.describe())
+        if git_state is not None:
+            snapshot.set_meta('git_head', git_state[0])
+            snapshot.set_meta('git_dirty', [snapshot.relpath(path) for path in git_state[2]])
+        snapshot.set_meta('options', options)
+        snapshot.commit()
+        all_deps = snapshot.aggregate()
+    except BaseException:
+        # keep the snapshot of the last scan that went through rather than
+        # the results of part of this one
+        snapshot.rollback()
+        raise
+    finally:
+        if owns_snapshot:
+            snapshot.close()
+    if remap:
+        return sanitize_deps(all_deps)
+    return all_deps
+
+
+def notebook_path_to_dependencies(path_to_notebook, remap=True, custom_namespaces=None,
+                                  target_python=None):
     """Helper function that turns a jupyter notebook into a list of dependencies
 
     Parameters
@@ -111,6 +294,9 @@ def notebook_path_to_dependencies(path_to_notebook, remap=True, custom_namespace
         If not None, then resulting package outputs will list everying under these
         namespaces (e.g., for packages foo.bar and foo.baz, the outputs are foo.bar
         and foo.baz instead of foo if custom_namespaces=["foo"]).
+    target_python : str, optional
+        Classify builtin imports against the standard library of this version
+        of python, e.g. '3.12', instead of that of the running interpreter.
 
     Returns
     -------
@@ -127,23 +313,14 @@ def notebook_path_to_dependencies(path_to_notebook, remap=True, custom_namespace
     >>> depfinder.notebook_path_to_dependencies('depfinder_usage.ipynb')
     {'builtin': ['os', 'pprint'], 'required': ['depfinder']}
     """
-    try:
-        from IPython.core.inputsplitter import IPythonInputSplitter
-        transform = IPythonInputSplitter(line_input_checker=False).transform_cell
-    except:
-        transform = lambda code: code
-
-    nb = json.load(io.open(path_to_notebook, encoding='utf8'))
-    codeblocks = [''.join(cell['source']) for cell in nb['cells']
-                  if cell['cell_type'] == 'code']
     all_deps = defaultdict(set)
-
-    for codeblock in codeblocks:
-        codeblock = transform(codeblock)
+    # the outputs of the cells are skipped over rather than loaded
+    for codeblock in profiling.iterate('read', iter_code_cells(path_to_notebook)):
         # TODO this may fail on py2/py3 syntax when running in the other runtime.
         # May want to consider updating some error handling around that case.
         # Will wait until that use case surfaces before modifying
-        deps_dict = get_imported_libs(codeblock, custom_namespaces=custom_namespaces).describe()
+        deps_dict = cell_dependencies(codeblock, custom_namespaces=custom_namespaces,
+                                      target_python=target_python)
         for k, v in deps_dict.items():
             all_deps[k].update(v)
 
@@ -153,6 +330,93 @@ def notebook_path_to_dependencies(path_to_notebook, remap=True, custom_namespace
     return all_deps
 
 
+def notebooks_to_dependencies(paths, remap=True, custom_namespaces=None,
+                              target_python=None, jobs=None, cache=None):
+    """Helper function that turns many jupyter notebooks into lists of dependencies
+
+    The imports of identical cells, such as the setup cells of notebooks made
+    from the same template, are only looked for once. See
+    `depfinder.notebook.iter_notebook_dependencies`.
+
+    Parameters
+    ----------
+    paths : list of str
+    remap : bool, optional
+        Normalize the import names to be synonymous with their conda/pip names
+    custom_namespaces : list of str, optional
+    target_python : str, optional
+        See `notebook_path_to_dependencies`
+    jobs : int, optional
+        Number of worker processes. 0 uses one worker per CPU.
+    cache : depfinder.cache.ParseCache, optional
+        Persistent cache of the dependencies of each cell
+
+    Returns
+    -------
+    dict
+        The dependencies of each notebook, as returned by
+        `notebook_path_to_dependencies`, keyed on its path. Notebooks that
+        could not be read or parsed are logged and left out.
+    """
+    all_deps = {}
+    skipped = []
+    for path, deps, error in iter_notebook_dependencies(
+            paths, custom_namespaces=custom_namespaces, target_python=target_python,
+            jobs=jobs, cache=cache):
+        if error is not None:
+            logger.error("Could not parse notebook: {}\n{}".format(path, error))
+            skipped.append(path)
+            continue
+        all_deps[path] = sanitize_deps(deps) if remap else deps
+    if skipped:
+        logger.warning("Skipped {}/{} notebooks".format(len(skipped), len(paths)))
+        if STRICT_CHECKING:
+            raise RuntimeError("Some notebooks failed to parse. See logs for full "
+                               "stack traces.")
+    return all_deps
+
+
+def distribution_import_search(path_to_site_packages, remap=True, ignore=None,
+                               custom_namespaces=None, jobs=None, cache=None,
+                               target_python=None):
+    """Return the imports of every distribution installed in `path_to_site_packages`
+
+    The files of each distribution are found from its ``RECORD`` (or
+    ``installed-files.txt``) and all of them are parsed as one batch. See
+    `depfinder.distributions.scan_distributions`.
+
+    Parameters
+    ----------
+    path_to_site_packages : str
+    remap : bool, optional
+        Normalize the import names to be synonymous with their conda/pip names
+    ignore : list, optional
+        String pattern which if matched causes the file to not be inspected
+    custom_namespaces : list of str or None
+        If provided, the list of namespaces to treat as non-builtin
+    jobs : int, optional
+        Number of worker processes. 0 uses one worker per CPU.
+    cache : depfinder.cache.ParseCache, optional
+        Persistent cache of the parse results of unchanged files
+    target_python : str, optional
+        See `simple_import_search`
+
+    Returns
+    -------
+    dict
+        The dependencies of each distribution, as returned by
+        `simple_import_search`, keyed on its name. The imports of its own
+        modules are left out.
+    """
+    from .distributions import scan_distributions
+    all_deps = {}
+    for dist, deps in scan_distributions(
+            path_to_site_packages, custom_namespaces=custom_namespaces, jobs=jobs,
+            cache=cache, target_python=target_python, ignore=ignore):
+        all_deps[dist.name] = sanitize_deps(deps) if remap else deps
+    return all_deps
+
+
 def sanitize_deps(deps_dict):
     """
     Helper function that takes the output of `notebook_path_to_dependencies`
@@ -171,7 +435,8 @@ def sanitize_deps(deps_dict):
     """
     from .inspection import PACKAGE_NAME
     new_deps_dict = {}
-    list_of_possible_fakes = set([v for val in pkg_data['_FAKE_PACKAGES'].values() for v in val])
+    list_of_possible_fakes = utils.fake_packages
+    package_mapping = utils.package_mapping
     for k, packages_list in deps_dict.items():
 
         pkgs = copy.copy(packages_list)
@@ -190,7 +455,7 @@ def sanitize_deps(deps_dict):
                              "find the dependencies for. Set the `--no-remap` "
                              "cli flag if you want to disable this.".format(pkg))
                 continue
-            pkg_to_add = pkg_data['_PACKAGE_MAPPING'].get(pkg, pkg)
+            pkg_to_add = package_mapping.get(pkg, pkg)
             if pkg != pkg_to_add:
                 logger.debug("Renaming {} to {}".format(pkg, pkg_to_add))
             new_deps_dict[k].add(pkg_to_add)
@@ -198,7 +463,10 @@ def sanitize_deps(deps_dict):
     return new_deps_dict
 
 
-def simple_import_search_conda_forge_import_map(path_to_source_code, builtins=None, ignore=None, custom_namespaces=None):
+def simple_import_search_conda_forge_import_map(path_to_source_code, builtins=None, ignore=None, custom_namespaces=None,
+                                                jobs=None, cache=None, resolver=None,
+                                                target_python=None, default_excludes=False,
+                                                respect_gitignore=False, include_notebooks=False):
     """Return all conda-forge packages used in all .py files in `path_to_source_code`
 
     Parameters
@@ -212,6 +480,26 @@ def simple_import_search_conda_forge_import_map(path_to_source_code, builtins=No
         If not None, then resulting package outputs will list everying under these
         namespaces (e.g., for packages foo.bar and foo.baz, the outputs are foo.bar
         and foo.baz instead of foo if custom_namespaces=["foo"]).
+    jobs : int, optional
+        Number of worker processes used to parse the files. None or 1 parses
+        serially, 0 uses one worker per CPU. See `iterate_over_library`.
+    cache : depfinder.cache.ParseCache, optional
+        Persistent parse cache. Unchanged files are not parsed again.
+    resolver : depfinder.reports.ImportResolver, optional
+        Resolver used to look the imports up on conda-forge. Pass one with a
+        `depfinder.cache.ResolverStore` to reuse lookups across runs, e.g.
+        ``ImportResolver(store=ResolverStore())``.
+    target_python : str, optional
+        Classify builtin imports against the standard library of this version
+        of python, e.g. '3.12', instead of that of the running interpreter.
+    default_excludes : bool, optional
+        Skip version control and tool directories, virtual environments,
+        site-packages and build copies. See `iterate_over_library`. The cli
+        turns this on unless --no-default-excludes is given.
+    respect_gitignore : bool, optional
+        Skip the files and directories that git ignores
+    include_notebooks : bool, optional
+        Also find the imports in the code cells of the .ipynb files
 
     Returns
     -------
@@ -239,23 +527,30 @@ def simple_import_search_conda_forge_import_map(path_to_source_code, builtins=No
                   'test_with_code']}
     """
     # run depfinder on source code
-    if ignore is None:
-        ignore = []
-    total_imports_list = []
-    for _, _, c in iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces):
-        total_imports_list.append(c.total_imports)
+    ignore = ignore_matcher(ignore)
     total_imports = defaultdict(dict)
-    for total_import in total_imports_list:
-        for name, md in total_import.items():
+    for _, _, c in iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces,
+                                        jobs=jobs, cache=cache, target_python=target_python,
+                                        lean=True, ignore=ignore,
+                                        default_excludes=default_excludes,
+                                        respect_gitignore=respect_gitignore,
+                                        include_notebooks=include_notebooks):
+        for name, md in c.total_imports.items():
             total_imports[name].update(md)
     from .reports import report_conda_forge_names_from_import_map
+    if builtins is None and target_python is not None:
+        builtins = builtin_trie(target_python)
     imports, _ = report_conda_forge_names_from_import_map(
-        total_imports, builtin_modules=builtins, ignore=ignore
+        total_imports, builtin_modules=builtins, ignore=ignore, resolver=resolver,
+        custom_namespaces=custom_namespaces,
     )
     return {k: sorted(list(v)) for k, v in imports.items()}
 
 
-def simple_import_to_pkg_map(path_to_source_code, builtins=None, ignore=None, custom_namespaces=None):
+def simple_import_to_pkg_map(path_to_source_code, builtins=None, ignore=None, custom_namespaces=None,
+                             jobs=None, cache=None, resolver=None,
+                             target_python=None, default_excludes=False,
+                             respect_gitignore=False, include_notebooks=False):
     """Provide the map beteen all the imports and their possible packages
 
     Parameters
@@ -269,6 +564,26 @@ def simple_import_to_pkg_map(path_to_source_code, builtins=None, ignore=None, cu
         If not None, then resulting package outputs will list everying under these
         namespaces (e.g., for packages foo.bar and foo.baz, the outputs are foo.bar
         and foo.baz instead of foo if custom_namespaces=["foo"]).
+    jobs : int, optional
+        Number of worker processes used to parse the files. None or 1 parses
+        serially, 0 uses one worker per CPU. See `iterate_over_library`.
+    cache : depfinder.cache.ParseCache, optional
+        Persistent parse cache. Unchanged files are not parsed again.
+    resolver : depfinder.reports.ImportResolver, optional
+        Resolver used to look the imports up on conda-forge. Pass one with a
+        `depfinder.cache.ResolverStore` to reuse lookups across runs, e.g.
+        ``ImportResolver(store=ResolverStore())``.
+    target_python : str, optional
+        Classify builtin imports against the standard library of this version
+        of python, e.g. '3.12', instead of that of the running interpreter.
+    default_excludes : bool, optional
+        Skip version control and tool directories, virtual environments,
+        site-packages and build copies. See `iterate_over_library`. The cli
+        turns this on unless --no-default-excludes is given.
+    respect_gitignore : bool, optional
+        Skip the files and directories that git ignores
+    include_notebooks : bool, optional
+        Also find the imports in the code cells of the .ipynb files
 
     Returns
     -------
@@ -278,17 +593,21 @@ def simple_import_to_pkg_map(path_to_source_code, builtins=None, ignore=None, cu
 
     """
     # run depfinder on source code
-    if ignore is None:
-        ignore = []
-    total_imports_list = []
-    for _, _, c in iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces):
-        total_imports_list.append(c.total_imports)
+    ignore = ignore_matcher(ignore)
     total_imports = defaultdict(dict)
-    for total_import in total_imports_list:
-        for name, md in total_import.items():
+    for _, _, c in iterate_over_library(path_to_source_code, custom_namespaces=custom_namespaces,
+                                        jobs=jobs, cache=cache, target_python=target_python,
+                                        lean=True, ignore=ignore,
+                                        default_excludes=default_excludes,
+                                        respect_gitignore=respect_gitignore,
+                                        include_notebooks=include_notebooks):
+        for name, md in c.total_imports.items():
             total_imports[name].update(md)
     from .reports import report_conda_forge_names_from_import_map
+    if builtins is None and target_python is not None:
+        builtins = builtin_trie(target_python)
     _, import_to_pkg = report_conda_forge_names_from_import_map(
-        total_imports, builtin_modules=builtins, ignore=ignore
+        total_imports, builtin_modules=builtins, ignore=ignore, resolver=resolver,
+        custom_namespaces=custom_namespaces,
     )
     return import_to_pkg
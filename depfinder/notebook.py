@@ -0,0 +1,383 @@
+"""Reading the code cells of jupyter notebooks.
+
+Notebooks are json, but most of their bytes are usually in the outputs of the
+cells: base64 encoded images, rendered dataframes and so on. Rather than load
+the whole document with `json.load`, `iter_code_cells` reads large notebooks a
+chunk at a time and only decodes the sources of the code cells. Everything
+else is skipped over without being built in memory, so memory use does not
+depend on the size of the outputs. Small notebooks are still loaded with
+`json`, which is faster than reading them a piece at a time in python.
+
+`iter_notebook_dependencies` finds the dependencies of many notebooks at once.
+Notebooks made from the same template share most of their cells, so the
+imports of each distinct cell are only looked for once, and are kept in the
+parse cache keyed on the hash of the cell. Cells that do not contain the word
+``import`` are skipped without being parsed.
+
+`notebook_to_python` turns a notebook into a python script, which is how
+notebooks are parsed as part of directory scans.
+"""
+from __future__ import print_function, division, absolute_import
+
+import hashlib
+import io
+import json
+import os
+import re
+import traceback
+from collections import defaultdict
+
+from . import profiling
+from .inspection import get_imported_libs
+
+CHUNK_SIZE = 64 * 1024
+# notebooks smaller than this are loaded whole
+STREAMING_THRESHOLD = 1024 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# the characters that matter when skipping over a container
+_CONTAINER_SPECIAL = re.compile(r'["\[\]{}]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+
+
+class _Reader(object):
+    """Pull parser for the handful of json constructs a notebook needs"""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, keep_from=None):
+        """Read another chunk, dropping what is before `keep_from` (or `pos`)"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        start = self.pos if keep_from is None else keep_from
+        self.buf = self.buf[start:] + chunk
+        self.pos -= start
+        return True
+
+    def _error(self, expected):
+        found = self.buf[self.pos:self.pos + 20] or 'end of file'
+        raise ValueError("Invalid notebook: expected {} at {!r}".format(expected, found))
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            self._error(repr(char))
+        self.pos += 1
+
+    def _string_end(self, keep):
+        """Return the index just past the closing quote of the string at `pos`
+
+        With `keep` False, the part of the string that has been scanned is
+        dropped from the buffer as more of it is read.
+        """
+        # str.find is much faster than a regex search over the long base64
+        # strings of the outputs
+        start = self.pos
+        i = start + 1
+        quote = None
+        while True:
+            if quote is None or -1 < quote < i:
+                quote = self.buf.find('"', i)
+            end = len(self.buf) if quote == -1 else quote
+            backslash = self.buf.find('\\', i, end)
+            if backslash != -1 and backslash + 1 < len(self.buf):
+                # skip the escaped character
+                i = backslash + 2
+                continue
+            if backslash == -1 and quote != -1:
+                self.pos = start
+                return quote + 1
+            # need more of the string, a trailing backslash is kept since it
+            # escapes what follows
+            i = end if backslash == -1 else backslash
+            if not keep:
+                self.pos = start = i
+            if not self._fill(start):
+                self._error('the end of a string')
+            i -= start
+            start = 0
+            quote = None
+
+    def read_string(self):
+        if self.peek() != '"':
+            self._error('a string')
+        end = self._string_end(keep=True)
+        value = json.loads(self.buf[self.pos:end])
+        self.pos = end
+        return value
+
+    def skip_value(self):
+        char = self.peek()
+        if char == '"':
+            self.pos = self._string_end(keep=False)
+        elif char in ('{', '['):
+            depth = 0
+            while True:
+                match = _CONTAINER_SPECIAL.search(self.buf, self.pos)
+                if match is None:
+                    # nothing of interest in the rest of the buffer
+                    self.pos = len(self.buf)
+                    if not self._fill():
+                        self._error("the end of {!r}".format(char))
+                    continue
+                self.pos = match.start()
+                token = match.group()
+                if token == '"':
+                    self.pos = self._string_end(keep=False)
+                    continue
+                self.pos += 1
+                depth += 1 if token in '[{' else -1
+                if depth == 0:
+                    return
+        elif char:
+            # a number, true, false or null
+            while True:
+                match = _SCALAR_END.search(self.buf, self.pos)
+                if match is not None:
+                    self.pos = match.start()
+                    return
+                if not self._fill():
+                    self.pos = len(self.buf)
+                    return
+        else:
+            self._error('a value')
+
+    def iter_object(self):
+        """Yield the keys of an object, the caller reads or skips each value"""
+        self.expect('{')
+        first = True
+        while True:
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            if not first:
+                self.expect(',')
+            first = False
+            key = self.read_string()
+            self.expect(':')
+            yield key
+
+    def iter_array(self):
+        """Yield once per item of an array, the caller reads or skips each item"""
+        self.expect('[')
+        first = True
+        while True:
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            if not first:
+                self.expect(',')
+            first = False
+            yield
+
+
+def _read_source(reader):
+    # nbformat allows a string or a list of strings
+    if reader.peek() == '[':
+        return ''.join(reader.read_string() for _ in reader.iter_array())
+    return reader.read_string()
+
+
+def iter_code_cells(path_to_notebook, chunk_size=CHUNK_SIZE):
+    """Yield the source of each code cell of a notebook, in order
+
+    Parameters
+    ----------
+    path_to_notebook : str
+        Path to a notebook in the nbformat 4 layout
+    chunk_size : int, optional
+        Number of characters read from the file at a time, for the notebooks
+        of at least `STREAMING_THRESHOLD` bytes
+
+    Raises
+    ------
+    ValueError
+        If the notebook is not valid json
+    """
+    with io.open(path_to_notebook, encoding='utf8') as f:
+        if os.fstat(f.fileno()).st_size < STREAMING_THRESHOLD:
+            cells = _load_cells(f)
+        else:
+            cells = _stream_cells(_Reader(f, chunk_size))
+        for source in cells:
+            yield source
+
+
+def _load_cells(f):
+    nb = json.load(f)
+    if not isinstance(nb, dict):
+        raise ValueError("Invalid notebook: expected a json object")
+    return [''.join(cell['source']) for cell in nb.get('cells', ())
+            if cell.get('cell_type') == 'code' and 'source' in cell]
+
+
+def _stream_cells(reader):
+    for key in reader.iter_object():
+        if key != 'cells':
+            reader.skip_value()
+            continue
+        for _ in reader.iter_array():
+            cell_type = source = None
+            for cell_key in reader.iter_object():
+                if cell_key == 'cell_type':
+                    cell_type = reader.read_string()
+                elif cell_key == 'source' and cell_type in (None, 'code'):
+                    source = _read_source(reader)
+                else:
+                    reader.skip_value()
+            if cell_type == 'code' and source is not None:
+                yield source
+
+
+_transform = None
+
+
+def transform_cell(source):
+    """Turn the IPython syntax of a cell, such as magics, into python
+
+    The IPython transformer is only built once per process. The source is
+    returned as is when IPython is not installed.
+    """
+    global _transform
+    if _transform is None:
+        try:
+            from IPython.core.inputsplitter import IPythonInputSplitter
+            _transform = IPythonInputSplitter(line_input_checker=False).transform_cell
+        except Exception:
+            def _transform(code):
+                return code
+    return _transform(source)
+
+
+def may_import(source):
+    """Return False if the cell cannot hold an import statement"""
+    return 'import' in source
+
+
+def cell_dependencies(source, custom_namespaces=None, target_python=None):
+    """Return the describe() of one code cell, with sorted lists of names"""
+    if not may_import(source):
+        return {}
+    import_finder = get_imported_libs(transform_cell(source),
+                                      custom_namespaces=custom_namespaces,
+                                      target_python=target_python, lean=True)
+    return {k: sorted(v) for k, v in import_finder.describe().items()}
+
+
+def notebook_to_python(path_to_notebook):
+    """Return the code cells of a notebook as a single python script
+
+    The IPython syntax of the cells is turned into python, and the cells that
+    cannot hold an import are left out.
+    """
+    return '\n'.join(transform_cell(source) for source in iter_code_cells(path_to_notebook)
+                     if may_import(source))
+
+
+def _cell_digest(source):
+    # kept apart from the digests of whole files in the parse cache
+    return hashlib.sha256(b'ipynb-cell\0' + source.encode('utf-8')).hexdigest()
+
+
+def iter_notebook_dependencies(paths, custom_namespaces=None, target_python=None,
+                               jobs=None, cache=None):
+    """Find the dependencies of many notebooks
+
+    Parameters
+    ----------
+    paths : list of str
+    custom_namespaces : list of str, optional
+    target_python : str, optional
+        See `depfinder.main.notebook_path_to_dependencies`
+    jobs : int, optional
+        Number of worker processes the cells are analyzed with, see
+        `depfinder.parallel.resolve_jobs`. Few cells are always analyzed
+        serially.
+    cache : depfinder.cache.ParseCache, optional
+        Serve the cells that were seen before from this cache
+
+    Yields
+    ------
+    tuple
+        (path, dict of sorted lists of names or None, formatted traceback or
+        None) for every notebook, in order. The traceback is that of the
+        first cell of the notebook that failed to parse.
+    """
+    from .parallel import analyze_cells, resolve_jobs
+    from .stdliblist import normalize_target_python
+    jobs = resolve_jobs(jobs)
+    target_python = normalize_target_python(target_python)
+    notebooks = []
+    # the dependencies of every distinct cell, None until they are known
+    results = {}
+    keys = {}
+    for path in paths:
+        try:
+            sources = list(profiling.iterate('read', iter_code_cells(path)))
+        except (OSError, ValueError):
+            notebooks.append((path, None, traceback.format_exc()))
+            continue
+        profiling.count('notebook_cells', len(sources))
+        sources = [source for source in sources if may_import(source)]
+        for source in sources:
+            if source in results:
+                continue
+            results[source] = None
+            if cache is not None:
+                with profiling.phase('cache'):
+                    keys[source] = cache.key(_cell_digest(source), custom_namespaces,
+                                             target_python)
+                results[source] = cache.get(keys[source])
+        notebooks.append((path, sources, None))
+
+    to_analyze = [source for source, deps in results.items() if deps is None]
+    profiling.count('analyzed_cells', len(to_analyze))
+    # cells are analyzed in the order they first appear in, so the results of
+    # each notebook are yielded as soon as its own cells are done
+    analyzed = analyze_cells(to_analyze, jobs, custom_namespaces=custom_namespaces,
+                             target_python=target_python)
+    errors = {}
+    try:
+        for path, sources, error in notebooks:
+            if error is not None:
+                yield path, None, error
+                continue
+            for source in sources:
+                while results[source] is None and source not in errors:
+                    done, deps, error = next(analyzed)
+                    if error is not None:
+                        errors[done] = error
+                        continue
+                    results[done] = deps
+                    if cache is not None:
+                        cache.put(keys[done], deps)
+            failed = [errors[source] for source in sources if source in errors]
+            if failed:
+                yield path, None, failed[0]
+                continue
+            deps = defaultdict(set)
+            for source in sources:
+                for k, v in results[source].items():
+                    deps[k].update(v)
+            yield path, {k: sorted(v) for k, v in deps.items()}, None
+    finally:
+        analyzed.close()
+        if cache is not None:
+            cache.flush()
@@ -0,0 +1,270 @@
+"""Helpers for spreading file parsing over a pool of worker processes."""
+from __future__ import print_function, division, absolute_import
+
+import logging
+import os
+import traceback
+
+from . import profiling
+
+logger = logging.getLogger('depfinder')
+
+# Below these thresholds the cost of starting the worker processes (each of
+# which has to import depfinder) is larger than the time saved by parsing in
+# parallel, so iterate_over_library falls back to the serial path
+MIN_FILES_FOR_PARALLEL = 200
+MIN_BYTES_FOR_PARALLEL = 2 * 1024 * 1024
+
+# Aim for a few batches per worker so that the pool stays busy at the end of
+# the run, but cap the number of files per batch to keep scheduling granular
+BATCHES_PER_WORKER = 4
+MAX_FILES_PER_BATCH = 64
+
+# Notebook cells are small, but each of them goes through the IPython input
+# transformer, which is slower than parsing. Workers also have to import
+# IPython before they do anything useful.
+MIN_CELLS_FOR_PARALLEL = 500
+
+
+def resolve_jobs(jobs):
+    """Turn the user facing `jobs` value into a number of worker processes
+
+    None or 1 means serial. 0 or a negative number means one worker per CPU
+    that this process may run on, see `available_cpus`.
+    """
+    if jobs is None:
+        return 1
+    jobs = int(jobs)
+    if jobs <= 0:
+        return available_cpus()
+    return jobs
+
+
+def available_cpus():
+    """Return the number of CPUs this process may run on
+
+    That is fewer than `os.cpu_count()` in a container or under ``taskset``.
+    """
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        # not on linux
+        return os.cpu_count() or 1
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def should_parallelize(files_and_sizes, jobs):
+    """Decide whether parsing `files_and_sizes` is worth a process pool"""
+    if jobs <= 1:
+        return False
+    if len(files_and_sizes) < MIN_FILES_FOR_PARALLEL:
+        return False
+    return sum(size for _, size in files_and_sizes) >= MIN_BYTES_FOR_PARALLEL
+
+
+def plan_batches(files_and_sizes, jobs):
+    """Group files into batches of roughly equal total size
+
+    Files are handed out largest first so that a single huge module starts
+    parsing straight away instead of being the last thing the pool works on.
+
+    Parameters
+    ----------
+    files_and_sizes : list of (str, int)
+        Paths of the files to parse and their size in bytes
+    jobs : int
+        Number of worker processes
+
+    Returns
+    -------
+    list of list of str
+        The batches, in the order they should be submitted to the pool
+    """
+    ordered = sorted(files_and_sizes, key=lambda item: item[1], reverse=True)
+    total = sum(size for _, size in ordered)
+    target = max(total // max(jobs * BATCHES_PER_WORKER, 1), 1)
+    batches = []
+    batch = []
+    batch_size = 0
+    for path, size in ordered:
+        if batch and (batch_size + size > target or
+                      len(batch) >= MAX_FILES_PER_BATCH):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(path)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _parse_batch(paths, custom_namespaces, profile=False, target_python=None, lean=False):
+    """Worker entry point. Parse every file in `paths`.
+
+    Returns a list of (path, parse_file result or None, formatted traceback or
+    None) so that failures can be logged by the parent process, and the
+    `ScanProfile.to_dict` of the batch if `profile` is True, otherwise None.
+    """
+    if profile:
+        with profiling.ScanProfile() as batch_profile:
+            results = list(parse_files_serially(paths, custom_namespaces, target_python,
+                                                lean))
+        return results, batch_profile.to_dict()
+    return list(parse_files_serially(paths, custom_namespaces, target_python, lean)), None
+
+
+def parse_files_serially(paths, custom_namespaces=None, target_python=None, lean=False):
+    """Yield (path, parse_file result or None, traceback or None) per file"""
+    from .inspection import parse_file
+    for path in paths:
+        try:
+            yield path, parse_file(path, custom_namespaces=custom_namespaces,
+                                   target_python=target_python, lean=lean), None
+        except Exception:
+            yield path, None, traceback.format_exc()
+
+
+def parse_files(paths, jobs, custom_namespaces=None, target_python=None, lean=False):
+    """Parse `paths`, using a process pool when it is worth it
+
+    Results are yielded in the same order as `paths` regardless of the order
+    in which the workers finish, so the output is identical to the serial path.
+
+    Parameters
+    ----------
+    paths : list of str
+    jobs : int
+        Number of worker processes, as returned by `resolve_jobs`
+    custom_namespaces : list of str, optional
+    target_python : str, optional
+    lean : bool, optional
+        See `depfinder.inspection.parse_file`
+
+    Yields
+    ------
+    tuple
+        (path, parse_file result or None, formatted traceback or None)
+    """
+    files_and_sizes = [(path, _file_size(path)) for path in paths]
+    if not should_parallelize(files_and_sizes, jobs):
+        logger.debug("Parsing %s files serially", len(paths))
+        for result in parse_files_serially(paths, custom_namespaces, target_python, lean):
+            yield result
+        return
+
+    batches = plan_batches(files_and_sizes, jobs)
+    logger.debug("Parsing %s files in %s batches with %s workers",
+                 len(paths), len(batches), jobs)
+    for result in _map_batches(paths, batches, jobs, _parse_batch, custom_namespaces,
+                               target_python=target_python, lean=lean):
+        yield result
+
+
+def _analyze_cell_batch(sources, custom_namespaces, profile=False, target_python=None):
+    """Worker entry point. Find the imports of every notebook cell in `sources`.
+
+    Returns the same as `_parse_batch`, with `cell_dependencies` results.
+    """
+    if profile:
+        with profiling.ScanProfile() as batch_profile:
+            results = list(analyze_cells_serially(sources, custom_namespaces,
+                                                  target_python))
+        return results, batch_profile.to_dict()
+    return list(analyze_cells_serially(sources, custom_namespaces, target_python)), None
+
+
+def analyze_cells_serially(sources, custom_namespaces=None, target_python=None):
+    """Yield (source, cell_dependencies result or None, traceback or None) per cell"""
+    from .notebook import cell_dependencies
+    for source in sources:
+        try:
+            yield source, cell_dependencies(source, custom_namespaces=custom_namespaces,
+                                            target_python=target_python), None
+        except Exception:
+            yield source, None, traceback.format_exc()
+
+
+def analyze_cells(sources, jobs, custom_namespaces=None, target_python=None):
+    """Find the imports of notebook cells, using a process pool when it is worth it
+
+    Parameters
+    ----------
+    sources : list of str
+        The sources of the cells. Must not hold duplicates.
+    jobs : int
+        Number of worker processes, as returned by `resolve_jobs`
+    custom_namespaces : list of str, optional
+    target_python : str, optional
+        See `depfinder.notebook.cell_dependencies`
+
+    Yields
+    ------
+    tuple
+        (source, cell_dependencies result or None, formatted traceback or
+        None), in the order of `sources`
+    """
+    if jobs <= 1 or len(sources) < MIN_CELLS_FOR_PARALLEL:
+        logger.debug("Analyzing %s notebook cells serially", len(sources))
+        for result in analyze_cells_serially(sources, custom_namespaces, target_python):
+            yield result
+        return
+    batches = plan_batches([(source, len(source)) for source in sources], jobs)
+    logger.debug("Analyzing %s notebook cells in %s batches with %s workers",
+                 len(sources), len(batches), jobs)
+    for result in _map_batches(sources, batches, jobs, _analyze_cell_batch,
+                               custom_namespaces, target_python=target_python):
+        yield result
+
+
+def _map_batches(items, batches, jobs, work, *args, **kwargs):
+    """Run ``work(batch, *args, profile=..., **kwargs)`` on a process pool
+
+    `work` returns a list of (item, result, error) for its batch along with
+    the `ScanProfile.to_dict` of the batch or None, like `_parse_batch`. The
+    (item, result, error) tuples are yielded in the order of `items`.
+
+    If a worker dies, e.g. when it runs out of memory, the batches that were
+    not done yet are run in this process instead.
+    """
+    # imported here since pulling in multiprocessing noticeably slows down
+    # `import depfinder`
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    batch_for_item = {item: idx for idx, batch in enumerate(batches)
+                      for item in batch}
+    finished = {}
+    profile = profiling.active()
+    kwargs['profile'] = profile is not None
+    broken = False
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(work, batch, *args, **kwargs) for batch in batches]
+        try:
+            for item in items:
+                if item not in finished:
+                    idx = batch_for_item[item]
+                    try:
+                        batch_results, batch_profile = futures[idx].result()
+                    except BrokenProcessPool:
+                        if not broken:
+                            logger.warning("A worker process died. Running the batches "
+                                           "that were not done in this process.")
+                            broken = True
+                        # anything this process does is already in its profile
+                        batch_results, batch_profile = work(
+                            batches[idx], *args, **dict(kwargs, profile=False))
+                    for done_item, result, error in batch_results:
+                        finished[done_item] = (result, error)
+                    if batch_profile is not None:
+                        profile.merge(batch_profile)
+                result, error = finished.pop(item)
+                yield item, result, error
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,207 @@
+"""Compile the bundled package data into a binary index that loads quickly.
+
+Parsing ``pkg_data/name_mapping.yml`` with PyYAML takes a few hundred ms, which
+is far more than depfinder needs for looking up a handful of import names. At
+build time this module compiles ``name_mapping.yml`` and ``pkg_data.yml`` into
+``pkg_data/index.bin``, a versioned ``marshal`` dump that is loaded with a
+single call. The index records the depfinder version and the size of the yaml
+files it was built from, so that a stale index is ignored and depfinder falls
+back to the yaml files without having to read them. (The mtimes of the yaml
+files are no use for this, since installing a wheel does not keep them.)
+
+To (re)build the index in place::
+
+    python -m depfinder.pkg_index
+
+This module only depends on the standard library and PyYAML so that
+``setup.py`` can load it without importing depfinder.
+"""
+from __future__ import print_function, division, absolute_import
+
+import hashlib
+import logging
+import marshal
+import os
+import pkgutil
+import sys
+
+logger = logging.getLogger('depfinder')
+
+INDEX_MAGIC = b'DFIX'
+# bump this whenever the layout of the index changes
+INDEX_FORMAT = 2
+INDEX_FILENAME = 'index.bin'
+SOURCE_FILES = ('pkg_data.yml', 'name_mapping.yml')
+MAPPING_KEYS = ('import_name', 'conda_name', 'pypi_name', 'mapping_source',
+                'delimiter_min', 'delimiter_max')
+
+_PKG_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pkg_data')
+
+
+def _source_digest(sources):
+    h = hashlib.sha256()
+    for name in SOURCE_FILES:
+        h.update(name.encode('utf-8'))
+        h.update(sources[name])
+    return h.hexdigest()
+
+
+def _source_stamp(pkg_data_dir, version):
+    sizes = tuple(os.stat(os.path.join(pkg_data_dir, name)).st_size
+                  for name in SOURCE_FILES)
+    return (version, sizes)
+
+
+def _package_version():
+    try:
+        from ._version import __version__
+    except ImportError:
+        # not installed, or loaded by setup.py outside of the package
+        return 'unknown'
+    return __version__
+
+
+def _read_sources(pkg_data_dir=_PKG_DATA_DIR):
+    sources = {}
+    for name in SOURCE_FILES:
+        with open(os.path.join(pkg_data_dir, name), 'rb') as f:
+            sources[name] = f.read()
+    return sources
+
+
+def _yaml_load(text):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+
+def build_index_from_mapping(mapping_list, pkg_data):
+    """Turn the name mapping and pkg_data into the lookup tables of the index
+
+    Parameters
+    ----------
+    mapping_list : list of dict
+        Name mapping records as found in ``name_mapping.yml``
+    pkg_data : dict
+        The contents of ``pkg_data.yml``
+
+    Returns
+    -------
+    dict
+    """
+    import_to_conda = {}
+    import_to_pypi = {}
+    for record in mapping_list:
+        import_name = record['import_name']
+        conda_names = import_to_conda.setdefault(import_name, [])
+        if record.get('conda_name') and record['conda_name'] not in conda_names:
+            conda_names.append(record['conda_name'])
+        if record.get('pypi_name'):
+            import_to_pypi.setdefault(import_name, record['pypi_name'])
+    fake_packages = pkg_data.get('_FAKE_PACKAGES', {})
+    return {
+        'mapping_list': [tuple(record.get(k) for k in MAPPING_KEYS)
+                         for record in mapping_list],
+        'import_to_conda': {k: tuple(v) for k, v in import_to_conda.items()},
+        'import_to_pypi': import_to_pypi,
+        'namespace_packages': frozenset(
+            name for name in import_to_conda if '.' in name),
+        'fake_packages': frozenset(
+            fake for fakes in fake_packages.values() for fake in fakes),
+        'package_mapping': dict(pkg_data.get('_PACKAGE_MAPPING', {})),
+        'pkg_data': pkg_data,
+    }
+
+
+def build_index(pkg_data_dir=_PKG_DATA_DIR, version=None):
+    """Parse the yaml files in `pkg_data_dir` and return the serialized index
+
+    Parameters
+    ----------
+    pkg_data_dir : str, optional
+        Directory holding the yaml files
+    version : str, optional
+        Version of depfinder the index is built for. Defaults to the version
+        of the depfinder package this module belongs to.
+    """
+    if version is None:
+        version = _package_version()
+    sources = _read_sources(pkg_data_dir)
+    index = build_index_from_mapping(
+        _yaml_load(sources['name_mapping.yml'].decode('utf-8')),
+        _yaml_load(sources['pkg_data.yml'].decode('utf-8')),
+    )
+    index['format'] = INDEX_FORMAT
+    index['source_digest'] = _source_digest(sources)
+    index['source_stamp'] = _source_stamp(pkg_data_dir, version)
+    return INDEX_MAGIC + marshal.dumps(index)
+
+
+def write_index(output_dir=_PKG_DATA_DIR, pkg_data_dir=_PKG_DATA_DIR, version=None):
+    """Build the index from `pkg_data_dir` and write it to `output_dir`"""
+    data = build_index(pkg_data_dir, version)
+    path = os.path.join(output_dir, INDEX_FILENAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(pkg_data_dir=None, version=None):
+    """Return the compiled index, or None if it is missing or stale
+
+    Only the size of the yaml files is checked, they are not read.
+
+    Parameters
+    ----------
+    pkg_data_dir : str, optional
+        Directory holding the index and the yaml files. Defaults to the
+        ``pkg_data`` directory of the installed depfinder package.
+    version : str, optional
+        Version of depfinder the index has to be built for. Defaults to the
+        version of the depfinder package this module belongs to.
+    """
+    def get_data(name):
+        if pkg_data_dir is None:
+            return pkgutil.get_data('depfinder', 'pkg_data/' + name)
+        with open(os.path.join(pkg_data_dir, name), 'rb') as f:
+            return f.read()
+
+    try:
+        data = get_data(INDEX_FILENAME)
+    except (OSError, IOError):
+        logger.debug("No compiled package index found, falling back to yaml")
+        return None
+    if data is None or not data.startswith(INDEX_MAGIC):
+        return None
+    try:
+        index = marshal.loads(data[len(INDEX_MAGIC):])
+    except (ValueError, EOFError, TypeError):
+        logger.debug("Could not load the compiled package index", exc_info=True)
+        return None
+    if not isinstance(index, dict) or index.get('format') != INDEX_FORMAT:
+        logger.debug("The compiled package index has an unsupported format")
+        return None
+    if version is None:
+        version = _package_version()
+    try:
+        stamp = _source_stamp(pkg_data_dir or _PKG_DATA_DIR, version)
+    except (OSError, IOError):
+        logger.debug("Could not stat the package yaml files", exc_info=True)
+        return None
+    if index.get('source_stamp') != stamp:
+        logger.debug("The compiled package index is stale, falling back to yaml")
+        return None
+    return index
+
+
+def mapping_list_from_index(index):
+    """Rebuild the list of name mapping records stored in the index"""
+    return [{k: v for k, v in zip(MAPPING_KEYS, record) if v is not None}
+            for record in index['mapping_list']]
+
+
+if __name__ == '__main__':
+    output = write_index(*sys.argv[1:2])
+    print("Wrote {}".format(output))
@@ -0,0 +1,242 @@
+"""Per-phase timing of depfinder scans.
+
+Use `ScanProfile` as a context manager around any of the depfinder APIs::
+
+    from depfinder.profiling import ScanProfile
+    with ScanProfile() as profile:
+        simple_import_search('/path/to/source')
+    print(profile.format_table())
+
+While a profile is active, depfinder records the wall and CPU time spent in
+each phase of the scan, the slowest files, the number of AST nodes visited and
+how many lookups were served by the parse cache and the resolver. Phase times
+are exclusive, i.e. the time spent in ``unparse`` is not counted again under
+``visit``. With ``jobs > 1`` the times of the worker processes are added up,
+so the phases can sum to more than the total wall time.
+
+When no profile is active the hooks below cost a single global lookup.
+"""
+from __future__ import print_function, division, absolute_import
+
+import heapq
+import json
+import os
+import time
+from collections import defaultdict
+
+DEFAULT_TOP_FILES = 10
+
+_active = None
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def active():
+    """Return the active `ScanProfile`, or None"""
+    return _active
+
+
+def phase(name):
+    """Context manager that bills the time spent in its body to phase `name`"""
+    if _active is None:
+        return _NULL_PHASE
+    return _active.phase(name)
+
+
+def count(name, n=1):
+    """Add `n` to counter `name` of the active profile"""
+    if _active is not None:
+        _active.counts[name] += n
+
+
+def iterate(name, iterable):
+    """Bill the time spent producing the items of `iterable` to phase `name`"""
+    if _active is None:
+        return iterable
+    return _active.iterate(name, iterable)
+
+
+class _Phase(object):
+    __slots__ = ('profile', 'name', 'wall', 'cpu')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile._children.append([0.0, 0.0])
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        children = self.profile._children
+        child_wall, child_cpu = children.pop()
+        self.profile.add(self.name, wall - child_wall, cpu - child_cpu)
+        if children:
+            children[-1][0] += wall
+            children[-1][1] += cpu
+        return False
+
+
+class _FileTimer(object):
+    __slots__ = ('profile', 'path', 'start')
+
+    def __init__(self, profile, path):
+        self.profile = profile
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        self.profile.record_file(self.path, size, seconds)
+        return False
+
+
+class ScanProfile(object):
+    """Timings and counters of a depfinder scan
+
+    Parameters
+    ----------
+    top : int, optional
+        Number of slowest files to keep
+
+    Attributes
+    ----------
+    phases : dict
+        Maps the name of each phase to [wall seconds, cpu seconds, calls]
+    counts : dict
+        Counters such as ``files``, ``ast_nodes``, ``parse_cache_hits`` and
+        ``resolver_lookups``
+    wall, cpu : float
+        Total wall and CPU seconds the profile was active for
+    """
+
+    def __init__(self, top=DEFAULT_TOP_FILES):
+        self.top = top
+        self.phases = {}
+        self.counts = defaultdict(int)
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._files = []
+        self._children = []
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        self._start = (time.perf_counter(), time.process_time())
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self.wall += time.perf_counter() - self._start[0]
+        self.cpu += time.process_time() - self._start[1]
+        _active = self._previous
+        self._previous = None
+        return False
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, wall, cpu, calls=1):
+        totals = self.phases.get(name)
+        if totals is None:
+            self.phases[name] = [wall, cpu, calls]
+        else:
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+
+    def file(self, path):
+        """Context manager that records the time it takes to scan `path`"""
+        return _FileTimer(self, path)
+
+    def record_file(self, path, size, seconds):
+        self.counts['files'] += 1
+        self._keep_if_slow((seconds, path, size))
+
+    def _keep_if_slow(self, item):
+        if len(self._files) < self.top:
+            heapq.heappush(self._files, item)
+        elif self._files and item > self._files[0]:
+            heapq.heapreplace(self._files, item)
+
+    def iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @property
+    def slowest_files(self):
+        """List of (path, size in bytes, seconds), slowest first"""
+        return [(path, size, seconds)
+                for seconds, path, size in sorted(self._files, reverse=True)]
+
+    def to_dict(self):
+        """Return the profile as json-able data"""
+        return {
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'phases': {name: {'wall': wall, 'cpu': cpu, 'calls': calls}
+                       for name, (wall, cpu, calls) in self.phases.items()},
+            'counts': dict(self.counts),
+            'slowest_files': [{'path': path, 'size': size, 'seconds': seconds}
+                              for path, size, seconds in self.slowest_files],
+        }
+
+    def merge(self, data):
+        """Add the output of another profile's `to_dict`, e.g. of a worker"""
+        for name, totals in data['phases'].items():
+            self.add(name, totals['wall'], totals['cpu'], totals['calls'])
+        for name, n in data['counts'].items():
+            self.counts[name] += n
+        for item in data['slowest_files']:
+            self._keep_if_slow((item['seconds'], item['path'], item['size']))
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def format_table(self):
+        """Return the profile as a human readable table"""
+        lines = ['{:<20} {:>10} {:>10} {:>10}'.format('phase', 'wall (s)', 'cpu (s)', 'calls')]
+        for name, (wall, cpu, calls) in sorted(
+                self.phases.items(), key=lambda item: item[1][0], reverse=True):
+            lines.append('{:<20} {:>10.4f} {:>10.4f} {:>10}'.format(name, wall, cpu, calls))
+        lines.append('{:<20} {:>10.4f} {:>10.4f}'.format('total', self.wall, self.cpu))
+        if self.counts:
+            lines.append('')
+            for name in sorted(self.counts):
+                lines.append('{:<20} {:>10}'.format(name, self.counts[name]))
+        if self._files:
+            lines.append('')
+            lines.append('{:>10} {:>10}  {}'.format('seconds', 'bytes', 'slowest files'))
+            for path, size, seconds in self.slowest_files:
+                lines.append('{:>10.4f} {:>10}  {}'.format(
+                    seconds, '?' if size is None else size, path))
+        return '\n'.join(lines)
@@ -30,11 +30,20 @@
 from __future__ import print_function, division, absolute_import
 
 import logging
-from concurrent.futures._base import as_completed
-from concurrent.futures.thread import ThreadPoolExecutor
-from fnmatch import fnmatch
+import threading
 
-from .stdliblist import builtin_modules as _builtin_modules
+from .resolution import (
+    DEFAULT_BACKOFF,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    run_lookups,
+)
+
+from .ignore import ignore_matcher
+from .inspection import ImportRecord
+from .trie import ModuleTrie, builtin_trie
+from . import profiling, utils
 from .utils import SKETCHY_TYPES_TABLE
 
 
@@ -57,23 +66,66 @@ def extract_pkg_from_import(name):
     import_to_pkg : dict mapping str to sets
         A dict mapping the import name to a set of possible packages that supply that import.
     """
-    from conda_forge_metadata.autotick_bot import map_import_to_package
-    from conda_forge_metadata.autotick_bot import get_pkgs_for_import
     try:
-        supplying_pkgs, _ = get_pkgs_for_import(name)
-        best_import = map_import_to_package(name)
+        return lookup_pkg_from_import(name)
     except Exception:
         logger.exception(
             "could not get package name from conda-forge metadata "
             f"for import {name} due to an error"
         )
-        supplying_pkgs = set()
-        best_import = name
+        return name, {name: set()}
+
+
+def lookup_pkg_from_import(name):
+    """Same as `extract_pkg_from_import`, but errors are raised to the caller
+
+    This lets `ImportResolver` retry lookups that failed.
+    """
+    try:
+        from conda_forge_metadata.autotick_bot import map_import_to_package
+        from conda_forge_metadata.autotick_bot import get_pkgs_for_import
+    except ImportError:
+        return extract_pkg_from_import_with_index(name)
+    supplying_pkgs, _ = get_pkgs_for_import(name)
+    best_import = map_import_to_package(name)
     import_to_pkg = {name: supplying_pkgs or set()}
     return best_import, import_to_pkg
 
 
+def extract_pkg_from_import_with_index(name):
+    """Look `name` up in the bundled name mapping index
+
+    This is what `extract_pkg_from_import` falls back to when
+    conda-forge-metadata is not installed. The dotted name is walked up until
+    an import name that the mapping knows about is found, and failing that the
+    top level name is looked up in the package mapping from pkg_data.yml.
+
+    Returns
+    -------
+    most_likely_pkg : str
+    import_to_pkg : dict mapping str to sets
+    """
+    import_to_conda = utils.import_to_conda
+    found = recursively_search_for_name(name, import_to_conda)
+    if not found:
+        top_level = name.split('.', 1)[0]
+        if top_level in utils.package_mapping:
+            conda_name = utils.package_mapping[top_level]
+            return conda_name, {name: {conda_name}}
+        return name, {name: set()}
+    conda_names = import_to_conda[found]
+    best_import = found if found in conda_names else conda_names[0]
+    return best_import, {name: set(conda_names)}
+
+
 def recursively_search_for_name(name, module_names):
+    """Return the longest dotted prefix of `name` in `module_names`, or False
+
+    `module_names` can be any container of names. A `ModuleTrie` finds the
+    prefix in a single walk over the components of `name`.
+    """
+    if isinstance(module_names, ModuleTrie):
+        return module_names.longest_prefix(name) or False
     while True:
         if name in module_names:
             return name
@@ -84,45 +136,204 @@ def recursively_search_for_name(name, module_names):
                 return False
 
 
-def report_conda_forge_names_from_import_map(total_imports, builtin_modules=None, ignore=None):
-    if ignore is None:
-        ignore = []
+class ImportResolver(object):
+    """Resolve import names to conda-forge packages, memoizing the lookups
+
+    Dotted names are collapsed to their top level name, or namespace package
+    root, before being looked up, so ``numpy``, ``numpy.linalg`` and
+    ``numpy.fft`` only cost a single call to `lookup`. Every root is looked up
+    at most once for the lifetime of the resolver.
+
+    Parameters
+    ----------
+    lookup : callable, optional
+        Function with the signature of `extract_pkg_from_import`. Defaults to
+        `lookup_pkg_from_import`. Lookups that raise are retried.
+    custom_namespaces : list of str, optional
+        Custom namespace packages. See `get_top_level_import_name`.
+    store : depfinder.cache.ResolverStore, optional
+        Persistent store of earlier lookups. Roots found in the store are not
+        looked up again, and new lookups are added to it.
+    max_concurrency : int, optional
+        Maximum number of lookups in flight at any time
+    timeout : float, optional
+        Seconds after which a single lookup is abandoned
+    deadline : float, optional
+        Seconds after which all lookups of a `resolve_many` call that have not
+        finished are abandoned. Defaults to no deadline.
+    retries : int, optional
+        Number of times a lookup that raised or timed out is retried
+    backoff : float, optional
+        Seconds to wait before the first retry. Doubles for every retry.
+
+    Attributes
+    ----------
+    lookups : int
+        Number of times `lookup` has been called
+    memo_hits, store_hits : int
+        Number of roots that were served from the memo of this resolver or
+        from the store instead of being looked up
+    failed : set
+        Roots whose lookup failed, timed out or missed the deadline. They are
+        reported as having no match and are not added to the store.
+    """
+
+    def __init__(self, lookup=None, custom_namespaces=None, store=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 deadline=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.lookup = lookup or lookup_pkg_from_import
+        self.custom_namespaces = custom_namespaces
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.lookups = 0
+        self.memo_hits = 0
+        self.store_hits = 0
+        self.failed = set()
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def root(self, name, custom_namespaces=None):
+        """Return the name `name` is looked up as
+
+        `custom_namespaces` are used on top of those of the resolver.
+        """
+        from .inspection import get_top_level_import_name
+        namespaces = list(self.custom_namespaces or ()) + list(custom_namespaces or ())
+        return get_top_level_import_name(name, custom_namespaces=namespaces or None)
+
+    def _lookup_root(self, root):
+        with self._lock:
+            self.lookups += 1
+        most_likely_pkg, import_to_pkg = self.lookup(root)
+        return most_likely_pkg, set(import_to_pkg.get(root) or ())
+
+    def resolve_many(self, names, custom_namespaces=None):
+        """Resolve every name in `names`
+
+        Parameters
+        ----------
+        names : iterable of str
+        custom_namespaces : list of str, optional
+            Custom namespace packages to use on top of those of the resolver,
+            so that e.g. ``acme.widgets`` is looked up as such rather than as
+            ``acme``
+
+        Returns
+        -------
+        dict
+            Maps each name to a tuple of (most likely package, set of packages
+            that supply the import). Names that could not be matched map to
+            (name, set()), the same as `extract_pkg_from_import`.
+        """
+        names = set(names)
+        roots = {name: self.root(name, custom_namespaces) for name in names}
+        unique_roots = set(roots.values())
+        missing = sorted(unique_roots - set(self._memo))
+        memo_hits = len(unique_roots) - len(missing)
+        self.memo_hits += memo_hits
+        profiling.count('resolver_memo_hits', memo_hits)
+        if self.store is not None:
+            not_stored = []
+            with profiling.phase('resolver_store'):
+                for root in missing:
+                    stored = self.store.get(root)
+                    if stored is None:
+                        not_stored.append(root)
+                    else:
+                        self._memo[root] = stored
+            self.store_hits += len(missing) - len(not_stored)
+            profiling.count('resolver_store_hits', len(missing) - len(not_stored))
+            missing = not_stored
+        if missing:
+            with profiling.phase('lookups'):
+                results, failed = run_lookups(
+                    self._lookup_root, missing, max_concurrency=self.max_concurrency,
+                    timeout=self.timeout, deadline=self.deadline,
+                    retries=self.retries, backoff=self.backoff,
+                )
+            profiling.count('resolver_lookups', len(missing))
+            profiling.count('resolver_failed', len(failed))
+            for root, result in results.items():
+                self._memo[root] = result
+                if self.store is not None:
+                    self.store.put(root, *result)
+            for root in failed:
+                self._memo[root] = (root, set())
+            self.failed.update(failed)
+            if self.store is not None:
+                self.store.flush()
+        resolved = {}
+        for name, root in roots.items():
+            most_likely_pkg, supplying_pkgs = self._memo[root]
+            if not supplying_pkgs:
+                # keep reporting the name that was actually imported when
+                # there is nothing to map it to
+                most_likely_pkg = name
+            resolved[name] = (most_likely_pkg, set(supplying_pkgs))
+        return resolved
+
+
+def resolve_many(names, resolver=None, custom_namespaces=None):
+    """Resolve many import names to conda-forge packages at once
+
+    See `ImportResolver.resolve_many`. A new resolver is used for every call
+    unless one is passed in.
+    """
+    if resolver is None:
+        resolver = ImportResolver()
+    return resolver.resolve_many(names, custom_namespaces=custom_namespaces)
+
+
+def report_conda_forge_names_from_import_map(total_imports, builtin_modules=None, ignore=None,
+                                             resolver=None, custom_namespaces=None):
+    ignore = ignore_matcher(ignore)
     if builtin_modules is None:
-        builtin_modules = _builtin_modules
+        builtin_modules = builtin_trie()
+    elif not isinstance(builtin_modules, ModuleTrie):
+        builtin_modules = ModuleTrie(builtin_modules)
     report_keys = ['required', 'questionable', 'builtin', 'questionable no match', 'required no match']
     report = {k: set() for k in report_keys}
     import_to_pkg = {k: {} for k in report_keys}
-    futures = {}
 
-    with ThreadPoolExecutor() as pool:
-        for name, md in total_imports.items():
-            if all([any(fnmatch(filename, ignore_element) for ignore_element in ignore) for filename, _ in md]):
-                continue
-            elif recursively_search_for_name(name, builtin_modules):
-                report['builtin'].add(name)
-                continue
-            future = pool.submit(extract_pkg_from_import, name)
-            futures[future] = md
-    for future in as_completed(futures):
-        md = futures[future]
-        most_likely_pkg, _import_to_pkg = future.result()
+    names = []
+    for name, md in total_imports.items():
+        if all(ignore(filename) for filename, _ in md):
+            continue
+        elif recursively_search_for_name(name, builtin_modules):
+            report['builtin'].add(name)
+            continue
+        names.append(name)
+    resolved = resolve_many(names, resolver=resolver, custom_namespaces=custom_namespaces)
+
+    for name in names:
+        md = total_imports[name]
+        most_likely_pkg, supplying_pkgs = resolved[name]
+        _import_to_pkg = {name: supplying_pkgs}
 
         for (filename, lineno), import_metadata in md.items():
             # Make certain to throw out imports, since an import can happen multiple times
             # under different situations, import matplotlib is required by a test file
             # but is questionable for a regular file
-            if any(fnmatch(filename, ignore_element) for ignore_element in ignore):
+            if ignore(filename):
                 continue
-            _name = list(_import_to_pkg.keys())[0]
-            if any(import_metadata.get(v, False) for v in SKETCHY_TYPES_TABLE.values()):
+            if isinstance(import_metadata, ImportRecord):
+                questionable = import_metadata.questionable
+            else:
+                questionable = any(import_metadata.get(v, False)
+                                   for v in SKETCHY_TYPES_TABLE.values())
+            if questionable:
                 # if we couldn't find any artifacts to represent this then it doesn't exist in our maps
-                if not _import_to_pkg[_name]:
+                if not supplying_pkgs:
                     report_key = 'questionable no match'
                 else:
                     report_key = 'questionable'
             else:
                 # if we couldn't find any artifacts to represent this then it doesn't exist in our maps
-                if not _import_to_pkg[_name]:
+                if not supplying_pkgs:
                     report_key = 'required no match'
                 else:
                     report_key = 'required'
@@ -0,0 +1,184 @@
+"""Bounded-concurrency engine for running many blocking lookups.
+
+The conda-forge lookups made by `depfinder.reports.ImportResolver` block on
+the network. This module runs them from an asyncio event loop with a cap on
+the number of lookups in flight, a timeout per lookup, retries with
+exponential backoff and an overall deadline, so that one slow lookup can not
+hang a whole report.
+
+Each lookup runs in its own daemon thread. A lookup that times out can not be
+interrupted, but it is abandoned and does not keep the interpreter from
+exiting. It keeps holding its slot until it does return, though, so there are
+never more than `max_concurrency` lookups running, retries included.
+"""
+from __future__ import print_function, division, absolute_import
+
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger('depfinder')
+
+DEFAULT_MAX_CONCURRENCY = 8
+# seconds
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+
+
+def _set_future(semaphore, future, result=None, exception=None):
+    # the thread is done, whether or not anyone still waits for it
+    semaphore.release()
+    if future.done():
+        # the lookup was abandoned because it took too long
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def _run_in_daemon_thread(loop, semaphore, func, arg):
+    """Call ``func(arg)`` in a new thread, which releases `semaphore` when done"""
+    future = loop.create_future()
+
+    def target():
+        try:
+            result = func(arg)
+        except Exception as e:
+            callback_args = (future, None, e)
+        else:
+            callback_args = (future, result, None)
+        try:
+            loop.call_soon_threadsafe(_set_future, semaphore, *callback_args)
+        except RuntimeError:
+            # the event loop was closed after the overall deadline passed
+            pass
+
+    thread = threading.Thread(target=target, name='depfinder-lookup')
+    thread.daemon = True
+    try:
+        thread.start()
+    except Exception:
+        semaphore.release()
+        raise
+    return future
+
+
+async def _lookup_with_retries(loop, semaphore, func, arg, timeout, retries, backoff):
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            # waiting for a slot counts against the timeout too, in case all
+            # of them are held by abandoned lookups
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+            return await asyncio.wait_for(
+                _run_in_daemon_thread(loop, semaphore, func, arg), timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Looking up %s timed out after %ss (attempt %s/%s)",
+                           arg, timeout, attempt + 1, retries + 1)
+        except Exception:
+            logger.warning("Looking up %s failed (attempt %s/%s)",
+                           arg, attempt + 1, retries + 1, exc_info=True)
+    raise LookupError(arg)
+
+
+async def _run_all(func, args, max_concurrency, timeout, deadline, retries, backoff):
+    # the running loop, asyncio.get_running_loop needs python 3.7
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = {
+        arg: loop.create_task(_lookup_with_retries(
+            loop, semaphore, func, arg, timeout, retries, backoff))
+        for arg in args
+    }
+    if not tasks:
+        return {}, set()
+    done, pending = await asyncio.wait(list(tasks.values()), timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("Gave up on %s lookups after the %ss deadline",
+                       len(pending), deadline)
+        await asyncio.wait(pending)
+    results = {}
+    failed = set()
+    for arg, task in tasks.items():
+        if task in done and task.exception() is None:
+            results[arg] = task.result()
+        else:
+            failed.add(arg)
+    return results, failed
+
+
+def _run_coroutine(coroutine_function, *args):
+    # rather than asyncio.run and asyncio.get_running_loop, which need python 3.7
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine_function(*args))
+        finally:
+            loop.close()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+    # we were called from inside a running event loop (e.g. in a notebook), so
+    # run ours in a separate thread rather than trying to nest them
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = run()
+        except BaseException as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=target, name='depfinder-resolution')
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def run_lookups(func, args, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                timeout=DEFAULT_TIMEOUT, deadline=None, retries=DEFAULT_RETRIES,
+                backoff=DEFAULT_BACKOFF):
+    """Call `func` once for every item of `args`, concurrently
+
+    Parameters
+    ----------
+    func : callable
+        Blocking function of one argument
+    args : iterable
+    max_concurrency : int, optional
+        Maximum number of calls running at any time, including those that
+        were abandoned after a timeout but have not returned yet
+    timeout : float, optional
+        Seconds after which a single call is abandoned. None waits forever.
+    deadline : float, optional
+        Seconds after which all calls that have not finished are abandoned.
+        None waits forever.
+    retries : int, optional
+        Number of times a call that raised or timed out is retried
+    backoff : float, optional
+        Seconds to wait before the first retry. Doubles for every retry.
+
+    Returns
+    -------
+    results : dict
+        Maps every argument whose call succeeded to its return value
+    failed : set
+        The arguments whose calls failed, timed out or missed the deadline
+    """
+    start = time.time()
+    results, failed = _run_coroutine(
+        _run_all, func, list(args), max(int(max_concurrency), 1), timeout,
+        deadline, retries, backoff)
+    logger.debug("Ran %s lookups in %.2fs, %s failed",
+                 len(results) + len(failed), time.time() - start, len(failed))
+    return results, failed
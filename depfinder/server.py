@@ -0,0 +1,517 @@
+"""A long running depfinder that answers scans over a local socket.
+
+Every run of ``depfinder`` pays for starting python, loading the package data
+and the name mapping (which may be fetched over the network) and opening the
+parse cache before it parses anything. `serve` pays for those once and keeps
+them in memory, along with the parse results it has seen, so a scan of a tree
+that did not change only costs a walk and a ``stat`` of each file.
+
+The server speaks HTTP on a unix socket or on localhost::
+
+    POST /scan    {"argv": [...], "stdin": "...", "cwd": "..."}
+    GET  /status
+
+`argv` are the arguments of the ``depfinder`` command line, run in `cwd`
+with `stdin` as its standard input. The reply is ``{"stdout": ...,
+"stderr": ..., "returncode": ...}``, which is what the command would have
+printed. ``depfinder --server ADDRESS ...`` is a client that does just that.
+
+Requests are answered one at a time. There is no authentication: anyone who
+can connect can have the server read the files its user can read, so the
+unix socket is only accessible to its owner and the TCP server only listens
+on localhost. Requests must be json and name localhost in their Host header,
+so that web pages can not send them.
+"""
+from __future__ import print_function, division, absolute_import
+
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+from .cache import ParseCache, default_cache_dir
+
+logger = logging.getLogger('depfinder')
+
+DEFAULT_HOST = '127.0.0.1'
+# the only hosts the TCP server listens on, see the module docstring
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+# parse results kept in memory per cache directory, on top of those on disk
+MAX_RESIDENT_RESULTS = 100000
+
+
+def default_address():
+    """Return the unix socket the server listens on when not told otherwise"""
+    return os.path.join(default_cache_dir(), 'server.sock')
+
+
+def _parse_address(address):
+    """Return (path of a unix socket, None) or (host, port)
+
+    Raises ValueError if the host is not one of `LOOPBACK_HOSTS`.
+    """
+    address = str(address)
+    host, sep, port = address.rpartition(':')
+    if port.isdigit() and os.sep not in address:
+        # [::1]:port is the usual way of writing an ipv6 host with a port
+        host = host.strip('[]') or DEFAULT_HOST
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError("The depfinder server only listens on localhost, not "
+                             "on {}. Use one of {}".format(host, ', '.join(LOOPBACK_HOSTS)))
+        return host, int(port)
+    return address, None
+
+
+def _is_loopback_host(header):
+    """Whether the Host header `header` names one of `LOOPBACK_HOSTS`"""
+    host = (header or '').strip().lower()
+    if host.startswith('['):
+        host = host[1:].partition(']')[0]
+    elif host.count(':') == 1:
+        host = host.partition(':')[0]
+    return host in LOOPBACK_HOSTS
+
+
+def _check_scan_request(request):
+    """Return (argv, stdin, cwd) of the json body of a scan request
+
+    Raises ValueError, KeyError or TypeError if it is not a valid request.
+    """
+    if not isinstance(request['argv'], list):
+        raise TypeError("argv must be a list")
+    argv = [str(arg) for arg in request['argv']]
+    for field in ('stdin', 'cwd'):
+        value = request.get(field)
+        if value is not None and not isinstance(value, str):
+            # os.chdir would take an integer cwd for a file descriptor
+            raise TypeError("{} must be a string, not {}".format(field, type(value).__name__))
+    # a scan can not start a server of its own, nor forward to one
+    if argv[:1] == ['serve']:
+        raise ValueError("the server does not run `depfinder serve`")
+    if any(_is_server_option(arg) for arg in argv):
+        raise ValueError("the server does not run `depfinder --server`")
+    return argv, request.get('stdin'), request.get('cwd')
+
+
+def _is_server_option(arg):
+    # argparse also takes unambiguous prefixes, e.g. --serv
+    option = arg.partition('=')[0]
+    return len(option) > 2 and '--server'.startswith(option)
+
+
+def _without_server_option(argv):
+    """Return `argv` without its --server ADDRESS"""
+    kept = []
+    args = iter(argv)
+    for arg in args:
+        if _is_server_option(arg):
+            if '=' not in arg:
+                next(args, None)
+            continue
+        kept.append(arg)
+    return kept
+
+
+class ResidentParseCache(ParseCache):
+    """ParseCache that also keeps what it has read in memory
+
+    Files whose mtime and size did not change are neither read nor looked up
+    in the database, and their parse results are served from memory. Up to
+    `max_resident` results are kept, the least recently used ones are dropped
+    first.
+    """
+
+    def __init__(self, cache_dir=None, max_resident=MAX_RESIDENT_RESULTS, **kwargs):
+        super(ResidentParseCache, self).__init__(cache_dir, **kwargs)
+        self.max_resident = max_resident
+        self._digests = {}
+        self._resident = OrderedDict()
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        digest = super(ResidentParseCache, self).file_digest(path)
+        self._digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def _remember(self, key, payload):
+        self._resident[key] = payload
+        self._resident.move_to_end(key)
+        if len(self._resident) > self.max_resident:
+            self._resident.popitem(last=False)
+
+    def _get(self, key):
+        payload = self._resident.get(key)
+        if payload is not None:
+            self.hits += 1
+            self._resident.move_to_end(key)
+            return payload
+        payload = super(ResidentParseCache, self)._get(key)
+        if payload is not None:
+            self._remember(key, payload)
+        return payload
+
+    def put(self, key, payload):
+        super(ResidentParseCache, self).put(key, payload)
+        self._remember(key, payload)
+
+    def flush(self):
+        # results served from memory do not bump their last use on disk, so
+        # that a scan of an unchanged tree never writes to the database
+        if self._seen_files or self._new_results or self._used_keys:
+            super(ResidentParseCache, self).flush()
+
+
+@contextlib.contextmanager
+def _redirect(stdin, stdout, stderr):
+    saved = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    try:
+        yield
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved
+
+
+class DepfinderServer(object):
+    """Run depfinder command lines in this process, keeping its state warm
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Default directory of the parse cache, see
+        `depfinder.cache.default_cache_dir`. Requests with --cache-dir get
+        a resident cache of their own.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.caches = {}
+        self.requests = 0
+        self.started = time.time()
+
+    def warm_up(self):
+        """Load the package data, the name mapping and the module tries"""
+        from . import utils
+        from .trie import module_trie
+        start = time.perf_counter()
+        utils.fake_packages
+        utils.package_mapping
+        module_trie()
+        logger.info("Loaded the package data and the name mapping in %.2fs",
+                    time.perf_counter() - start)
+
+    def parse_cache(self, cache_dir=None):
+        """Return the resident parse cache of `cache_dir`, opening it if needed"""
+        import sqlite3
+        cache_dir = cache_dir or self.cache_dir or default_cache_dir()
+        if cache_dir not in self.caches:
+            try:
+                self.caches[cache_dir] = ResidentParseCache(cache_dir)
+            except (OSError, sqlite3.Error):
+                logger.warning("Could not open the parse cache in %s. Continuing "
+                               "without it.", cache_dir, exc_info=True)
+                return None
+        return self.caches[cache_dir]
+
+    def scan(self, argv, stdin='', cwd=None):
+        """Run ``depfinder argv`` and return what it printed
+
+        Returns
+        -------
+        dict
+            With 'stdout', 'stderr' and 'returncode'
+        """
+        from . import cli, inspection, main, utils
+        self.requests += 1
+        saved = (inspection.PACKAGE_NAME, main.STRICT_CHECKING, utils.OFFLINE,
+                 utils.MAPPING_TTL, sys.excepthook, list(logger.handlers), logger.level)
+        saved_cwd = os.getcwd()
+        stdout, stderr = io.StringIO(), io.StringIO()
+        # every scan starts from the state of a fresh process
+        inspection.PACKAGE_NAME = None
+        try:
+            if cwd:
+                os.chdir(cwd)
+            with _redirect(io.StringIO(stdin or ''), stdout, stderr):
+                try:
+                    returncode = cli.cli(list(argv), open_cache=self.parse_cache)
+                except SystemExit as e:
+                    # argparse errors, --help
+                    if e.code is None or isinstance(e.code, int):
+                        returncode = e.code
+                    else:
+                        print(e.code, file=sys.stderr)
+                        returncode = 1
+                except Exception:
+                    traceback.print_exc()
+                    returncode = 1
+        except OSError:
+            print(traceback.format_exc(), file=stderr)
+            returncode = 1
+        finally:
+            os.chdir(saved_cwd)
+            (inspection.PACKAGE_NAME, main.STRICT_CHECKING, utils.OFFLINE,
+             utils.MAPPING_TTL, sys.excepthook, logger.handlers[:], level) = saved
+            logger.setLevel(level)
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(),
+                'returncode': returncode or 0}
+
+    def status(self):
+        from . import __version__
+        return {'version': __version__, 'pid': os.getpid(), 'requests': self.requests,
+                'uptime': time.time() - self.started}
+
+    def close(self):
+        for cache in self.caches.values():
+            cache.close()
+        self.caches = {}
+
+
+def _handler_class():
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, code, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _check_host(self):
+            # without this, a web page whose name was rebound to 127.0.0.1
+            # could talk to the TCP server as if it was the same site
+            if _is_loopback_host(self.headers.get('Host')):
+                return True
+            self._reply(403, {'error': 'unexpected Host header: {}'.format(
+                self.headers.get('Host'))})
+            return False
+
+        def do_GET(self):
+            if not self._check_host():
+                return
+            if self.path != '/status':
+                return self._reply(404, {'error': 'not found'})
+            self._reply(200, self.server.depfinder.status())
+
+        def do_POST(self):
+            if not self._check_host():
+                return
+            if self.path != '/scan':
+                return self._reply(404, {'error': 'not found'})
+            # a browser can not send a cross-site json request without asking
+            # first, so this keeps web pages from having the server scan files
+            if self.headers.get_content_type() != 'application/json':
+                return self._reply(415, {'error': 'expected Content-Type: application/json'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+                argv, stdin, cwd = _check_scan_request(request)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {'error': 'invalid request: {}'.format(e)})
+            start = time.perf_counter()
+            reply = self.server.depfinder.scan(argv, stdin=stdin, cwd=cwd)
+            logger.debug("Answered %s in %.1fms", argv, 1000 * (time.perf_counter() - start))
+            self._reply(200, reply)
+
+        def address_string(self):
+            # unix sockets have no client address
+            return str(self.client_address[0]) if self.client_address else 'unix'
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def make_server(address, depfinder_server):
+    """Return an HTTP server on `address` answering with `depfinder_server`
+
+    `address` is the path of a unix socket or [host:]port, see `serve`.
+    """
+    import socketserver
+    from http.server import HTTPServer
+    host, port = _parse_address(address)
+    if port is None:
+        if os.path.exists(host):
+            # a server that is still running answers, a stale socket does not
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(host)
+            except OSError:
+                os.remove(host)
+            else:
+                raise RuntimeError("A server is already listening on {}".format(host))
+            finally:
+                probe.close()
+        elif os.path.dirname(host) and not os.path.isdir(os.path.dirname(host)):
+            os.makedirs(os.path.dirname(host))
+        old_umask = os.umask(0o177)
+        try:
+            server = socketserver.UnixStreamServer(host, _handler_class())
+        finally:
+            os.umask(old_umask)
+    else:
+        class TCPServer(HTTPServer):
+            address_family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        server = TCPServer((host, port), _handler_class())
+    server.depfinder = depfinder_server
+    return server
+
+
+def serve(address=None, cache_dir=None):
+    """Answer scans on `address` until interrupted
+
+    Parameters
+    ----------
+    address : str, optional
+        The path of a unix socket, or [host:]port to listen on localhost.
+        Defaults to `default_address()`, or port 0 (any free port) where there
+        are no unix sockets.
+    cache_dir : str, optional
+        Default directory of the parse cache
+    """
+    if address is None:
+        address = default_address() if hasattr(socket, 'AF_UNIX') else '0'
+    # refuse a bad address before paying for the warm up
+    _parse_address(address)
+    depfinder_server = DepfinderServer(cache_dir)
+    depfinder_server.warm_up()
+    depfinder_server.parse_cache()
+    server = make_server(address, depfinder_server)
+    if isinstance(server.server_address, tuple):
+        address = '{}:{}'.format(*server.server_address[:2])
+    logger.info("Listening on %s", address)
+    print(address, flush=True)
+    if threading.current_thread() is threading.main_thread():
+        # shut down cleanly, removing the socket, when terminated
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        depfinder_server.close()
+        if _parse_address(address)[1] is None and os.path.exists(address):
+            os.remove(address)
+    return 0
+
+
+def _connection(address, timeout=None):
+    from http.client import HTTPConnection
+    host, port = _parse_address(address)
+    if port is not None:
+        return HTTPConnection(host, port, timeout=timeout)
+
+    class UnixHTTPConnection(HTTPConnection):
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX)
+            if timeout is not None:
+                self.sock.settimeout(timeout)
+            self.sock.connect(host)
+
+    return UnixHTTPConnection('localhost', timeout=timeout)
+
+
+def request(address, argv, stdin=None, cwd=None, timeout=None):
+    """Have the server on `address` run ``depfinder argv``
+
+    Returns
+    -------
+    dict
+        With 'stdout', 'stderr' and 'returncode', see `DepfinderServer.scan`
+    """
+    body = json.dumps({'argv': list(argv), 'stdin': stdin,
+                       'cwd': cwd or os.getcwd()}).encode('utf-8')
+    conn = _connection(address, timeout)
+    try:
+        conn.request('POST', '/scan', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        data = json.loads(response.read().decode('utf-8'))
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError("depfinder server on {} answered {}: {}".format(
+            address, response.status, data.get('error')))
+    return data
+
+
+def forward(address, argv):
+    """Run ``depfinder argv`` on the server at `address`, printing its output"""
+    argv = _without_server_option(argv)
+    stdin = sys.stdin.read() if '-' in argv else None
+    reply = request(address, argv, stdin=stdin)
+    sys.stdout.write(reply['stdout'])
+    sys.stdout.flush()
+    sys.stderr.write(reply['stderr'])
+    return reply['returncode']
+
+
+def _init_parser():
+    p = ArgumentParser(
+        prog='depfinder serve',
+        description=("Keep depfinder running and answer the scans of "
+                     "`depfinder --server ADDRESS ...`"),
+    )
+    p.add_argument(
+        'address',
+        nargs='?',
+        default=None,
+        help=("Path of the unix socket to listen on, or [host:]port to listen "
+              "on localhost. Defaults to server.sock in the cache directory")
+    )
+    p.add_argument(
+        '--cache-dir',
+        default=None,
+        help=("Directory of the parse cache. Defaults to $DEPFINDER_CACHE_DIR, "
+              "then $XDG_CACHE_HOME/depfinder, then ~/.cache/depfinder")
+    )
+    p.add_argument(
+        '--offline',
+        action='store_true',
+        default=False,
+        help="Never fetch the conda-forge name mapping over the network"
+    )
+    p.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help="Log every request"
+    )
+    return p
+
+
+def serve_cli(argv=None):
+    parser = _init_parser()
+    args = parser.parse_args(argv)
+    if args.address is not None:
+        try:
+            _parse_address(args.address)
+        except ValueError as e:
+            parser.error(str(e))
+    from . import utils
+    if args.offline:
+        utils.OFFLINE = True
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(stream_handler)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    return serve(args.address, cache_dir=args.cache_dir)
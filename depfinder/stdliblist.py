@@ -1,9 +1,25 @@
+"""The modules of the python standard library.
+
+`builtin_modules` lists the stdlib modules of the interpreter that is running
+depfinder. To classify code that targets a different version of python, use
+`stdlib_modules` with a `target_python` version. The module names of every
+version in `TARGET_PYTHON_VERSIONS` are bundled in ``pkg_data/stdlib/X.Y.txt``
+and only loaded when they are first asked for.
+
+The profiles are all made by ``tools/stdlib_profiles.py``. To add or refresh
+the profile of a version, run it with the pythons to profile::
+
+    python tools/stdlib_profiles.py python3.14
+"""
+import pkgutil
 import sys
 import logging
 
 logger = logging.getLogger('depfinder')
 MAJOR, MINOR = sys.version_info.major, sys.version_info.minor
 
+TARGET_PYTHON_VERSIONS = ('3.8', '3.9', '3.10', '3.11', '3.12', '3.13')
+
 if MAJOR == 3 and MINOR >= 10:
     builtin_modules = list(set(list(sys.stdlib_module_names) + list(sys.builtin_module_names)))
 else:
@@ -14,4 +30,50 @@ else:
         del pyver
     except ImportError:
         logger.exception('stdlib-list required for python <= 3.9')
-        raise
\ No newline at end of file
+        raise
+
+_profiles = {}
+
+
+def normalize_target_python(target_python):
+    """Turn '3.12', '3.12.1', (3, 12) or sys.version_info into '3.12'
+
+    Returns None for None. Raises ValueError for versions that depfinder has
+    no stdlib profile for.
+    """
+    if target_python is None:
+        return None
+    if isinstance(target_python, str):
+        parts = target_python.strip().split('.')
+    else:
+        parts = [str(part) for part in tuple(target_python)]
+    version = '.'.join(parts[:2])
+    if version not in TARGET_PYTHON_VERSIONS:
+        raise ValueError(
+            "No stdlib profile for python {!r}. Supported target versions are "
+            "{}".format(target_python, ', '.join(TARGET_PYTHON_VERSIONS)))
+    return version
+
+
+def stdlib_modules(target_python=None):
+    """Return the names of the stdlib modules of `target_python`
+
+    Parameters
+    ----------
+    target_python : str or tuple, optional
+        Version of python, e.g. '3.12'. Defaults to the running interpreter.
+
+    Returns
+    -------
+    frozenset of str
+    """
+    version = normalize_target_python(target_python)
+    profile = _profiles.get(version)
+    if profile is None:
+        if version is None:
+            profile = frozenset(builtin_modules)
+        else:
+            data = pkgutil.get_data('depfinder', 'pkg_data/stdlib/%s.txt' % version)
+            profile = frozenset(data.decode('utf-8').split())
+        _profiles[version] = profile
+    return profile
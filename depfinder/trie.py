@@ -0,0 +1,156 @@
+"""Prefix trie of dotted module names.
+
+Working out the top level name of an import, or whether it belongs to the
+standard library, means looking at every dotted prefix of the name, e.g.
+``google.cloud.storage.blob`` -> ``google.cloud.storage`` -> ``google.cloud``.
+Keeping the known names in a trie keyed on their components makes that a
+single walk over the components of the name, whatever the number of known
+names.
+
+`module_trie` and `builtin_trie` return the tries used by
+`depfinder.inspection.ImportFinder` and `depfinder.reports`, built once and
+reused.
+"""
+from __future__ import print_function, division, absolute_import
+
+import threading
+
+from .stdliblist import normalize_target_python, stdlib_modules
+
+# flags of a node of the trie
+KNOWN = 1
+CUSTOM_NAMESPACE = 2
+
+
+class ModuleTrie(object):
+    """Prefix trie of dotted module names
+
+    Parameters
+    ----------
+    names : iterable of str, optional
+        Module names, such as stdlib modules and namespace packages, that are
+        reported as they are rather than collapsed to their top level name
+    custom_namespaces : iterable of str, optional
+        Custom namespace packages. Their direct children are reported as top
+        level names, e.g. ``foo.bar.baz`` collapses to ``foo.bar`` when ``foo``
+        is a custom namespace.
+    """
+    __slots__ = ('_root',)
+
+    def __init__(self, names=(), custom_namespaces=()):
+        # every node is a list of [flags, {component: child node}]
+        self._root = {}
+        for name in names:
+            self.add(name)
+        for name in custom_namespaces:
+            self.add(name, custom_namespace=True)
+
+    def add(self, name, custom_namespace=False):
+        children = self._root
+        node = None
+        for part in name.split('.'):
+            node = children.get(part)
+            if node is None:
+                node = children[part] = [0, {}]
+            children = node[1]
+        node[0] |= KNOWN | (CUSTOM_NAMESPACE if custom_namespace else 0)
+
+    def __contains__(self, name):
+        children = self._root
+        node = None
+        for part in name.split('.'):
+            node = children.get(part)
+            if node is None:
+                return False
+            children = node[1]
+        return bool(node[0] & KNOWN)
+
+    def longest_prefix(self, name):
+        """Return the longest prefix of `name` that is in the trie, or None
+
+        The name itself counts as a prefix, so ``os.path`` returns ``os.path``
+        when it is in the trie and ``os`` when only ``os`` is.
+        """
+        parts = name.split('.')
+        children = self._root
+        found = 0
+        for depth, part in enumerate(parts, 1):
+            node = children.get(part)
+            if node is None:
+                break
+            if node[0] & KNOWN:
+                found = depth
+            children = node[1]
+        if not found:
+            return None
+        return name if found == len(parts) else '.'.join(parts[:found])
+
+    def top_level(self, name):
+        """Return the name that an import of `name` should be reported as
+
+        That is the longest prefix of `name` that is in the trie or that is a
+        direct child of a custom namespace, or the first component of `name`
+        if there is no such prefix.
+        """
+        if '.' not in name:
+            return name
+        parts = name.split('.')
+        children = self._root
+        found = 1
+        for depth, part in enumerate(parts, 1):
+            node = children.get(part)
+            if node is None:
+                break
+            flags, children = node
+            if flags & CUSTOM_NAMESPACE and depth < len(parts):
+                found = depth + 1
+            elif flags & KNOWN:
+                found = max(found, depth)
+        return name if found == len(parts) else '.'.join(parts[:found])
+
+
+_lock = threading.Lock()
+_module_tries = {}
+_builtin_tries = {}
+
+# custom namespace configurations are normally few; this only guards against
+# unbounded growth in long running processes
+_MAX_MODULE_TRIES = 32
+
+
+def builtin_trie(target_python=None):
+    """Return the trie of the standard library modules of `target_python`
+
+    See `depfinder.stdliblist.stdlib_modules`.
+    """
+    version = normalize_target_python(target_python)
+    trie = _builtin_tries.get(version)
+    if trie is None:
+        trie = _builtin_tries[version] = ModuleTrie(stdlib_modules(version))
+    return trie
+
+
+def module_trie(custom_namespaces=None, target_python=None):
+    """Return the trie used to find the top level name of imports
+
+    It holds the standard library modules of `target_python`, the namespace
+    packages known to the name mapping and `custom_namespaces`. Tries are
+    cached per target version and set of custom namespaces, and rebuilt if the
+    name mapping is reloaded.
+    """
+    from . import utils
+    namespace_packages = utils.namespace_packages
+    version = normalize_target_python(target_python)
+    custom_namespaces = tuple(sorted(set(custom_namespaces or ())))
+    key = (version, custom_namespaces)
+    cached = _module_tries.get(key)
+    if cached is not None and cached[0] is namespace_packages:
+        return cached[1]
+    trie = ModuleTrie(stdlib_modules(version), custom_namespaces)
+    for name in namespace_packages:
+        trie.add(name)
+    with _lock:
+        if len(_module_tries) >= _MAX_MODULE_TRIES:
+            _module_tries.clear()
+        _module_tries[key] = (namespace_packages, trie)
+    return trie
@@ -2,13 +2,14 @@ from __future__ import print_function, division, absolute_import
 
 import ast
 import logging
+import os
 import pkgutil
 import sys
+import threading
+import time
+import types
 
-import requests
-import requests.exceptions
-import yaml
-from .stdliblist import builtin_modules
+from . import profiling
 
 logger = logging.getLogger("depfinder")
 
@@ -57,30 +58,201 @@ SKETCHY_TYPES_TABLE[ast.AsyncFor] = 'async-for'
 del AST_TRY
 del AST_MATCH
 
-try:
-    # Try and use the C extensions because they're faster
-    yaml_loader = yaml.CSafeLoader
-except ImportError:
-    # Fall back to the slower python implementation of the extensions because
-    # that is what is available from the PyYAML pip package
-    yaml_loader = yaml.SafeLoader
-
-pkg_data = yaml.load(
-    pkgutil.get_data(__name__, 'pkg_data/pkg_data.yml').decode(),
-    Loader=yaml_loader,
+
+def _env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+# Never fetch the conda-forge name mapping over the network. A previously
+# cached copy is used regardless of its age, falling back to the bundled one
+OFFLINE = _env_flag('DEPFINDER_OFFLINE')
+# Seconds after which the cached conda-forge name mapping is refreshed. A stale
+# copy keeps being served while the refresh happens in the background
+MAPPING_TTL = float(os.environ.get('DEPFINDER_MAPPING_TTL', 24 * 60 * 60))
+# Seconds to wait for the conda-forge name mapping when nothing is cached yet
+# before falling back to the bundled one. The fetch carries on in the background
+MAPPING_FETCH_TIMEOUT = float(os.environ.get('DEPFINDER_MAPPING_FETCH_TIMEOUT', 10))
+
+# The package data and name mapping are expensive to build (the name mapping
+# is a large yaml file and may be fetched over the network), so they are only
+# loaded the first time they are accessed. See _load_lazy_attribute
+#
+# package_index     the bundled package data, read from the compiled index in
+#                   pkg_data/index.bin or from the yaml files if it is missing
+#                   or stale. See depfinder.pkg_index
+# name_index        lookup tables for the name mapping in use, which is the
+#                   conda-forge one when available and the bundled one otherwise
+_LAZY_ATTRIBUTES = (
+    'yaml_loader',
+    'package_index',
+    'name_index',
+    'pkg_data',
+    'fake_packages',
+    'package_mapping',
+    'mapping_list',
+    'namespace_packages',
+    'import_to_conda',
 )
 
-try:
-    import conda_forge_metadata.autotick_bot
-    mapping_list = conda_forge_metadata.autotick_bot.get_pypi_name_mapping()
-except (ImportError, AttributeError, requests.exceptions.HTTPError):
+
+def _get(name):
+    if name in globals():
+        return globals()[name]
+    return _load_lazy_attribute(name)
+
+
+def _get_yaml_loader():
+    import yaml
+    try:
+        # Try and use the C extensions because they're faster
+        return yaml.CSafeLoader
+    except AttributeError:
+        # Fall back to the slower python implementation of the extensions because
+        # that is what is available from the PyYAML pip package
+        return yaml.SafeLoader
+
+
+def _load_yaml_data(filename):
+    import yaml
+    return yaml.load(
+        pkgutil.get_data(__name__, 'pkg_data/' + filename).decode(),
+        Loader=_get_yaml_loader(),
+    )
+
+
+def _load_package_index():
+    from .pkg_index import build_index_from_mapping, load_index
+    index = load_index()
+    if index is None:
+        index = build_index_from_mapping(
+            _load_yaml_data('name_mapping.yml'),
+            _load_yaml_data('pkg_data.yml'),
+        )
+    return index
+
+
+def _log_mapping_error():
     logger.exception(
         "could not get the conda-forge metadata pypi-to-conda name mapping "
         "due to error. defaulting to an internal one which may be out of date."
     )
-    mapping_list = yaml.load(
-        pkgutil.get_data(__name__, 'pkg_data/name_mapping.yml').decode(),
-        Loader=yaml_loader,
+
+
+def _fetch_pypi_name_mapping():
+    try:
+        import conda_forge_metadata.autotick_bot
+    except ImportError:
+        _log_mapping_error()
+        return None
+    # requests is slow to import so only pull it in once we know that
+    # conda-forge-metadata is around to use it
+    import requests.exceptions
+    try:
+        return conda_forge_metadata.autotick_bot.get_pypi_name_mapping()
+    except (AttributeError, requests.exceptions.RequestException):
+        _log_mapping_error()
+        return None
+
+
+_refresh_thread = None
+
+
+def _fetch_and_cache_mapping(mapping_cache, result):
+    try:
+        mapping = _fetch_pypi_name_mapping()
+    except Exception:
+        _log_mapping_error()
+        mapping = None
+    if mapping is not None:
+        mapping_cache.save(mapping)
+    result.append(mapping)
+
+
+def _fetch_in_background(mapping_cache):
+    global _refresh_thread
+    result = []
+    _refresh_thread = threading.Thread(
+        target=_fetch_and_cache_mapping, args=(mapping_cache, result),
+        name='depfinder-mapping-refresh',
     )
+    # a refresh never keeps the process alive. One that is cut short is tried
+    # again by the next run, since the cache is only replaced once it is done
+    _refresh_thread.daemon = True
+    _refresh_thread.start()
+    return _refresh_thread, result
+
+
+def _get_pypi_name_mapping():
+    """Return the conda-forge name mapping, or None to use the bundled one
+
+    Honors OFFLINE, MAPPING_TTL and MAPPING_FETCH_TIMEOUT, so that how long
+    this takes does not depend on the health of the network.
+    """
+    from .cache import NameMappingCache
+    mapping_cache = NameMappingCache()
+    cached = mapping_cache.load()
+    if cached is not None:
+        fetched_at, mapping = cached
+        if not OFFLINE and time.time() - fetched_at > MAPPING_TTL:
+            logger.debug("The cached name mapping is stale, refreshing it in "
+                         "the background")
+            _fetch_in_background(mapping_cache)
+        return mapping
+    if OFFLINE:
+        logger.debug("Offline and no cached name mapping, using the bundled one")
+        return None
+    thread, result = _fetch_in_background(mapping_cache)
+    thread.join(MAPPING_FETCH_TIMEOUT)
+    if not result:
+        logger.warning(
+            "Timed out after %ss fetching the conda-forge name mapping. Using "
+            "the bundled one for now.", MAPPING_FETCH_TIMEOUT)
+        return None
+    return result[0]
+
+
+def _load_name_index():
+    from .pkg_index import build_index_from_mapping
+    mapping = _get_pypi_name_mapping()
+    if mapping is None:
+        return _get('package_index')
+    return build_index_from_mapping(mapping, _get('pkg_data'))
+
+
+def _load_mapping_list():
+    from .pkg_index import mapping_list_from_index
+    return mapping_list_from_index(_get('name_index'))
+
+
+def _load_lazy_attribute(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    loader = {
+        'yaml_loader': _get_yaml_loader,
+        'package_index': _load_package_index,
+        'name_index': _load_name_index,
+        'pkg_data': lambda: _get('package_index')['pkg_data'],
+        'fake_packages': lambda: _get('package_index')['fake_packages'],
+        'package_mapping': lambda: _get('package_index')['package_mapping'],
+        'mapping_list': _load_mapping_list,
+        'namespace_packages': lambda: _get('name_index')['namespace_packages'],
+        'import_to_conda': lambda: _get('name_index')['import_to_conda'],
+    }[name]
+    with profiling.phase('load_mapping'):
+        value = loader()
+    globals()[name] = value
+    return value
+
+
+class _LazyModule(types.ModuleType):
+    """Module whose missing attributes are loaded by `_load_lazy_attribute`
+
+    The module level ``__getattr__`` of PEP 562 needs python 3.7, while the
+    class of a module can be swapped for a subclass of ModuleType from 3.5.
+    """
+
+    def __getattr__(self, name):
+        return _load_lazy_attribute(name)
+
 
-namespace_packages = {pkg['import_name'] for pkg in mapping_list if '.' in pkg['import_name']}
+sys.modules[__name__].__class__ = _LazyModule
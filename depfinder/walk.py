@@ -0,0 +1,326 @@
+"""Finding the python files, and optionally the notebooks, of a source tree.
+
+`walk_python_files` lists directories with `os.scandir` and skips, without
+listing them, the directories that never hold first party code:
+
+* version control and tool caches such as ``.git``, ``.tox`` and
+  ``node_modules`` (see `DEFAULT_EXCLUDES`)
+* virtual environments and conda environments, recognized by their
+  ``pyvenv.cfg`` or ``conda-meta``, and ``site-packages`` directories
+* the ``lib*`` and ``bdist.*`` copies of the sources in the ``build``
+  directory next to a ``setup.py`` or ``pyproject.toml``
+
+Optionally, paths that git ignores are skipped too. The ``.gitignore`` files
+of the tree and of its parent directories, up to the root of the repository,
+are honored. ``.git/info/exclude`` and the global excludes file are not.
+"""
+from __future__ import print_function, division, absolute_import
+
+import logging
+import os
+import re
+
+from . import profiling
+from .ignore import ignore_matcher
+
+logger = logging.getLogger('depfinder')
+
+DEFAULT_EXCLUDES = frozenset([
+    '.git', '.hg', '.svn', '.bzr',
+    '.tox', '.nox', '.venv', 'venv', '.eggs', '__pypackages__',
+    '__pycache__', '.mypy_cache', '.pytest_cache', '.ruff_cache',
+    '.ipynb_checkpoints', 'node_modules',
+    'site-packages', 'dist-packages',
+])
+# entries that mark a directory as the root of a python environment
+ENVIRONMENT_MARKERS = frozenset(['pyvenv.cfg', 'conda-meta'])
+_BUILD_COPY = re.compile(r'(?:lib|bdist)(?:\..*)?$')
+# files that make the ``build`` directory next to them a build directory
+PROJECT_FILES = ('setup.py', 'pyproject.toml')
+
+
+def _suffixes(include_notebooks):
+    return ('.py', '.ipynb') if include_notebooks else '.py'
+
+
+def _translate_gitignore(pattern):
+    """Return (regex, negated, only matches directories) for one gitignore line
+
+    The regex is matched against paths relative to the directory of the
+    ``.gitignore`` file, with ``/`` as the separator. Returns None for blank
+    lines and comments.
+    """
+    if pattern.endswith('\n'):
+        pattern = pattern[:-1]
+    # trailing spaces are ignored unless they are escaped
+    stripped = pattern.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(pattern):
+        stripped += ' '
+    pattern = stripped
+    if not pattern or pattern.startswith('#'):
+        return None
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith('\\#') or pattern.startswith('\\!'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+    # a slash anywhere but at the end anchors the pattern to the directory of
+    # the .gitignore, otherwise it matches at any depth
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/'):
+            if i + 2 == n:
+                # trailing '/**' matches everything inside
+                regex.append('.*')
+                i += 2
+                continue
+            if pattern[i + 2] == '/':
+                # leading '**/' and '/**/' match zero or more directories
+                regex.append('(?:.*/)?')
+                i += 3
+                continue
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2 if pattern[i + 1:i + 2] in ('!', '^') else i + 1)
+            if end == -1:
+                regex.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                regex.append('[%s]' % body.replace('\\', '\\\\'))
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    try:
+        return re.compile(prefix + ''.join(regex) + r'\Z', re.DOTALL), negated, dir_only
+    except re.error:
+        logger.debug("Ignoring invalid gitignore pattern %r", pattern)
+        return None
+
+
+class GitIgnore(object):
+    """The rules of one ``.gitignore`` file
+
+    Parameters
+    ----------
+    base : str
+        The directory the ``.gitignore`` is in
+    lines : iterable of str
+        The lines of the ``.gitignore``
+    """
+    __slots__ = ('base', 'rules')
+
+    def __init__(self, base, lines):
+        self.base = base
+        self.rules = [rule for rule in map(_translate_gitignore, lines) if rule]
+
+    @classmethod
+    def from_directory(cls, directory):
+        """Return the GitIgnore of `directory`, or None if it has no rules"""
+        try:
+            with open(os.path.join(directory, '.gitignore'), encoding='utf-8',
+                      errors='replace') as f:
+                gitignore = cls(directory, f)
+        except OSError:
+            return None
+        return gitignore if gitignore.rules else None
+
+    def match(self, relpath, is_dir):
+        """Return True if ignored, False if re-included or None if no rule matches
+
+        `relpath` is relative to `base` and uses ``/`` as the separator.
+        """
+        result = None
+        for regex, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                result = not negated
+        return result
+
+
+def _is_ignored(gitignores, relpath, is_dir):
+    # the rules of deeper .gitignore files take precedence
+    for gitignore, strip, prefix in reversed(gitignores):
+        result = gitignore.match(prefix + relpath[strip:], is_dir)
+        if result is not None:
+            return result
+    return False
+
+
+def _parent_gitignores(root):
+    """Return the .gitignore files between the repository root and `root`
+
+    As (GitIgnore, 0, path of `root` relative to the .gitignore + '/')
+    """
+    gitignores = []
+    root = os.path.abspath(root)
+    directory = root
+    while not os.path.exists(os.path.join(directory, '.git')):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+        gitignore = GitIgnore.from_directory(directory)
+        if gitignore is not None:
+            prefix = os.path.relpath(root, directory).replace(os.sep, '/') + '/'
+            gitignores.append((gitignore, 0, prefix))
+    gitignores.reverse()
+    return gitignores
+
+
+def _is_build_directory(directory):
+    """Whether `directory` is where a python project puts its build copies"""
+    if os.path.basename(directory) != 'build':
+        return False
+    parent = os.path.dirname(directory)
+    return any(os.path.isfile(os.path.join(parent, name)) for name in PROJECT_FILES)
+
+
+def _skips_directory(name, path, relpath, in_build, ignore, gitignores, default_excludes):
+    if default_excludes and (name in DEFAULT_EXCLUDES or
+                             (in_build and _BUILD_COPY.match(name))):
+        return True
+    return bool((ignore and ignore.prunes(path)) or
+                (gitignores and _is_ignored(gitignores, relpath, True)))
+
+
+def _skips_file(path, relpath, ignore, gitignores):
+    return bool((ignore and ignore(path)) or
+                (gitignores and _is_ignored(gitignores, relpath, False)))
+
+
+def walk_python_files(root, ignore=None, default_excludes=False, respect_gitignore=False,
+                      include_notebooks=False):
+    """Yield the paths of the .py files under `root`
+
+    Files are yielded in the same order as with `os.walk`: the files of a
+    directory first, then the contents of each of its subdirectories.
+    Symlinked directories are not followed.
+
+    Parameters
+    ----------
+    root : str
+    ignore : list of str or depfinder.ignore.IgnoreMatcher, optional
+        fnmatch patterns of file paths to skip. Directories whose contents all
+        match a pattern are not walked at all.
+    default_excludes : bool, optional
+        Skip `DEFAULT_EXCLUDES`, environments and build copies. `root` itself
+        is always walked.
+    respect_gitignore : bool, optional
+        Skip the paths that git would ignore
+    include_notebooks : bool, optional
+        Also yield the paths of the .ipynb files
+
+    Yields
+    ------
+    str
+        Path of each python file
+    """
+    suffixes = _suffixes(include_notebooks)
+    ignore = ignore_matcher(ignore)
+    gitignores = _parent_gitignores(root) if respect_gitignore else []
+    # (directory, its path relative to root with '/' separators, the
+    # .gitignore files that apply to it)
+    stack = [(root, '', gitignores)]
+    while stack:
+        directory, rel, gitignores = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.debug("Could not list %s: %s", directory, e)
+            continue
+        if default_excludes and rel and \
+                any(entry.name in ENVIRONMENT_MARKERS for entry in entries):
+            profiling.count('pruned_dirs')
+            continue
+        if respect_gitignore:
+            gitignore = GitIgnore.from_directory(directory)
+            if gitignore is not None:
+                gitignores = gitignores + [(gitignore, len(rel) + 1 if rel else 0, '')]
+        in_build = default_excludes and _is_build_directory(directory)
+        subdirectories = []
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if entry.is_symlink():
+                    continue
+                path = os.path.join(directory, name)
+                relpath = rel + '/' + name if rel else name
+                if _skips_directory(name, path, relpath, in_build, ignore, gitignores,
+                                    default_excludes):
+                    profiling.count('pruned_dirs')
+                    continue
+                subdirectories.append((path, relpath))
+            elif name.endswith(suffixes):
+                path = os.path.join(directory, name)
+                if _skips_file(path, rel + '/' + name if rel else name, ignore, gitignores):
+                    profiling.count('ignored_files')
+                    continue
+                yield path
+        for path, relpath in reversed(subdirectories):
+            stack.append((path, relpath, gitignores))
+
+
+def is_walked(root, path, ignore=None, default_excludes=False, respect_gitignore=False,
+              include_notebooks=False):
+    """Return whether `walk_python_files` would yield or descend into `path`
+
+    Only the directories between `root` and `path` are looked at, so this is
+    much cheaper than walking the tree. `path` does not have to exist: a
+    missing path is treated as a file.
+    """
+    rel = os.path.relpath(path, root)
+    if rel == os.curdir:
+        return True
+    parts = rel.split(os.sep)
+    if parts[0] == os.pardir or os.path.isabs(rel):
+        return False
+    ignore = ignore_matcher(ignore)
+    gitignores = _parent_gitignores(root) if respect_gitignore else []
+    directory, relpath = root, ''
+    for depth, name in enumerate(parts):
+        if respect_gitignore:
+            gitignore = GitIgnore.from_directory(directory)
+            if gitignore is not None:
+                gitignores = gitignores + [
+                    (gitignore, len(relpath) + 1 if relpath else 0, '')]
+        in_build = default_excludes and _is_build_directory(directory)
+        child = os.path.join(directory, name)
+        child_relpath = relpath + '/' + name if relpath else name
+        if depth < len(parts) - 1 or os.path.isdir(child):
+            if os.path.islink(child) or _skips_directory(
+                    name, child, child_relpath, in_build, ignore, gitignores,
+                    default_excludes):
+                return False
+            if default_excludes and any(os.path.exists(os.path.join(child, marker))
+                                        for marker in ENVIRONMENT_MARKERS):
+                return False
+        elif not name.endswith(_suffixes(include_notebooks)) or _skips_file(
+                child, child_relpath, ignore, gitignores):
+            return False
+        directory, relpath = child, child_relpath
+    return True
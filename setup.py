@@ -1,4 +1,29 @@
+import importlib.util
+import os
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class build_py_with_index(build_py):
+    """Compile the bundled package data into depfinder/pkg_data/index.bin"""
+
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        # load the module by path since depfinder itself is not importable yet
+        spec = importlib.util.spec_from_file_location(
+            "_depfinder_pkg_index", os.path.join("depfinder", "pkg_index.py"))
+        pkg_index = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(pkg_index)
+        output_dir = os.path.join(self.build_lib, "depfinder", "pkg_data")
+        self.mkpath(output_dir)
+        pkg_index.write_index(
+            output_dir=output_dir,
+            pkg_data_dir=os.path.join("depfinder", "pkg_data"),
+            version=self.distribution.get_version(),
+        )
 
 
 setup(
@@ -8,4 +33,5 @@ setup(
         "write_to_template": '__version__ = "{version}"',
         "tag_regex": r"^(?P<prefix>v)?(?P<version>[^\+]+)(?P<suffix>.*)?$",
     },
+    cmdclass={"build_py": build_py_with_index},
 )
@@ -1,9 +1,12 @@
 from __future__ import (unicode_literals, print_function, division,
                         absolute_import)
 
+import ast
 import contextlib
 import itertools
+import json
 import os
+import pickle
 import random
 import subprocess
 import sys
@@ -16,10 +19,14 @@ import six
 from nbformat import v4
 
 import depfinder
-from depfinder import cli, main, inspection, parse_file
+from depfinder import cli, main, inspection, parallel, parse_file, profiling
+from depfinder.cache import ParseCache
+from depfinder.profiling import ScanProfile
+from depfinder.trie import ModuleTrie
 from depfinder.main import simple_import_search_conda_forge_import_map, simple_import_to_pkg_map
 from depfinder.reports import report_conda_forge_names_from_import_map, extract_pkg_from_import, \
-    recursively_search_for_name, _builtin_modules
+    recursively_search_for_name, ImportResolver
+from depfinder.stdliblist import builtin_modules
 
 try:
     import conda_forge_metadata  # noqa
@@ -29,6 +36,9 @@ except ImportError:
 
 random.seed(12345)
 
+# keep the cli tests from writing to the parse cache in the user's home dir
+os.environ.setdefault('DEPFINDER_CACHE_DIR', tempfile.mkdtemp(prefix='depfinder-test-cache-'))
+
 # Testing spec:
 # - targets: dict
 #   - required: Iterable of library imports that should be found
@@ -187,6 +197,43 @@ def test_nested_namespace_builtins(using_stdlib_list):
     assert imports.describe() == test_object.targets
 
 
+@pytest.mark.parametrize('target_python, expected', [
+    ('3.8', {'builtin': {'distutils'}, 'required': {'graphlib', 'tomllib'}}),
+    ('3.10', {'builtin': {'distutils', 'graphlib'}, 'required': {'tomllib'}}),
+    ('3.12', {'builtin': {'graphlib', 'tomllib'}, 'required': {'distutils'}}),
+])
+def test_target_python(target_python, expected):
+    code = 'import distutils.core\nimport graphlib\nfrom tomllib import loads'
+    imports = main.get_imported_libs(code, target_python=target_python)
+    assert imports.describe() == expected
+
+
+def test_target_python_profiles():
+    from depfinder import stdliblist
+    for version in stdliblist.TARGET_PYTHON_VERSIONS:
+        modules = stdliblist.stdlib_modules(version)
+        assert isinstance(modules, frozenset)
+        assert {'os', 'sys', 'json'} <= modules
+        assert stdliblist.stdlib_modules(version) is modules
+    assert stdliblist.normalize_target_python((3, 12, 1)) == '3.12'
+    assert stdliblist.normalize_target_python('3.9.2') == '3.9'
+    with pytest.raises(ValueError):
+        stdliblist.normalize_target_python('2.7')
+
+
+def test_target_python_is_part_of_the_cache_key(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('mod.py').write('import tomllib\n')
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        for _ in range(2):
+            assert main.simple_import_search(
+                str(src), remap=False, cache=cache, target_python='3.10') == {
+                    'required': ['tomllib']}
+            assert main.simple_import_search(
+                str(src), remap=False, cache=cache, target_python='3.11') == {
+                    'builtin': ['tomllib']}
+
+
 class Initter(object):
     def __init__(self, artifact):
         targets = artifact.get('targets', {})
@@ -201,6 +248,271 @@ def test_imports():
         assert imports.describe() == test_object.targets
 
 
+class _RecursiveImportFinder(inspection.ImportFinder):
+    """The ast.NodeVisitor recursion that ImportFinder.visit replaced"""
+
+    def visit(self, node):
+        kind = None
+        if isinstance(node, depfinder.utils.AST_QUESTIONABLE):
+            kind = depfinder.utils.SKETCHY_TYPES_TABLE[node.__class__]
+            self._context.append(kind)
+        ast.NodeVisitor.visit(self, node)
+        if kind is not None:
+            self._context.pop()
+
+
+def _walker_sources():
+    for artifact in complex_imports + simple_imports + relative_imports:
+        yield artifact['code']
+    yield """
+match command:
+    case 'go':
+        import inside_match
+    case _:
+        try:
+            import inside_match_try
+        except ImportError:
+            from .rel import thing
+with context:
+    import inside_with
+    async def f():
+        async for x in y:
+            import inside_async_for
+        async with z:
+            import inside_async_with
+lambda: __import__('not_an_import_statement')
+"""
+    for fname in inspection._iter_python_files(dirname(depfinder.__file__)):
+        with open(fname) as f:
+            yield f.read()
+    sys.path.insert(0, join(dirname(__file__), 'benchmarks'))
+    try:
+        import synthetic
+    finally:
+        sys.path.pop(0)
+    rng = random.Random(0)
+    for _ in range(20):
+        yield synthetic.module_source(rng, depth=5, nested_fraction=0.8,
+                                      custom_namespaces=['acme'])
+
+
+def test_walker_matches_node_visitor():
+    for code in _walker_sources():
+        tree = ast.parse(code)
+        expected = _RecursiveImportFinder(filename='f.py', custom_namespaces=['acme'])
+        expected.visit(tree)
+        finder = inspection.ImportFinder(filename='f.py', custom_namespaces=['acme'])
+        finder.visit(tree)
+        assert finder.describe() == expected.describe()
+        assert list(finder.total_imports.items()) == list(expected.total_imports.items())
+        assert [list(v.items()) for v in finder.total_imports.values()] == [
+            list(v.items()) for v in expected.total_imports.values()]
+        assert finder.imports == expected.imports
+        assert finder.import_froms == expected.import_froms
+
+
+def test_walker_does_not_recurse():
+    code = 'import os\nx = ' + ' + '.join(['1'] * 800) + '\n'
+    assert main.get_imported_libs(code).describe() == {'builtin': {'os'}}
+
+
+@pytest.mark.skipif(not hasattr(ast, 'unparse'), reason="needs ast.unparse")
+def test_import_record(tmpdir, monkeypatch):
+    code = ('import os, sys\n'
+            'try:\n'
+            '    from a.b import (c,\n'
+            '                     d)\n'
+            'except ImportError:\n'
+            '    pass\n')
+    finder = main.get_imported_libs(code)
+    record = finder.total_imports['a.b'][('', 3)]
+    assert isinstance(record, inspection.ImportRecord)
+    # the dict view has the same keys, in the same order, as it always had
+    assert list(record) == ['exact_line', 'try', 'match', 'function', 'async-function',
+                            'if', 'while', 'for', 'async-for', 'import_from']
+    assert dict(record) == {
+        'exact_line': 'from a.b import c, d', 'try': True, 'match': False,
+        'function': False, 'async-function': False, 'if': False, 'while': False,
+        'for': False, 'async-for': False, 'import_from': {'a.b'}}
+    assert record.questionable
+    # both names of one statement share their record
+    assert finder.total_imports['os'][('', 1)] is finder.total_imports['sys'][('', 1)]
+    assert finder.total_imports['os'][('', 1)]['exact_line'] == 'import os, sys'
+
+    # exact_line is only worked out when asked for, not while scanning
+    unparsed = []
+    unparse = ast.unparse
+    monkeypatch.setattr(ast, 'unparse', lambda node: unparsed.append(node) or unparse(node))
+    src = tmpdir.join('mod.py')
+    src.write(code)
+    _, _, catcher = parse_file(str(src))
+    assert unparsed == []
+    record = catcher.total_imports['os'][(str(src), 1)]
+    # the records keep the source of their statement, not the whole file,
+    # and do not read the file again
+    assert catcher.source is None
+    src.write('import json\n')
+    assert record.exact_line == 'import os, sys'
+    restored = pickle.loads(pickle.dumps(catcher.total_imports))
+    assert restored == catcher.total_imports
+    assert restored['a.b'][(str(src), 3)]['exact_line'] == 'from a.b import c, d'
+
+
+@pytest.mark.skipif(not hasattr(ast, 'unparse'), reason="needs ast.unparse")
+def test_import_record_exact_line_matches_unparse():
+    code = ('if True:\n'
+            '    from x import (a,  # pick a\n'
+            '                   b)\n'
+            'import os,sys ; import \\\n'
+            '    json as  j\n'
+            'from  été import ca  # ça\n')
+    finder = inspection.get_imported_libs(code)
+    record = finder.total_imports['x'][('', 2)]
+    assert record.exact_line == 'from x import a, b'
+    assert record.source_segment() == ('from x import (a,  # pick a\n'
+                                       '                   b)')
+    assert finder.total_imports['json'][('', 4)].source_segment() == 'import \\\n    json as  j'
+    assert finder.total_imports['été'][('', 6)].source_segment() == 'from  été import ca'
+
+    # the same as when ast.unparse ran on every import while scanning
+    path = os.path.dirname(ast.__file__)
+    for name in ('ast.py', 'typing.py', 'subprocess.py', 'tarfile.py'):
+        source = os.path.join(path, name)
+        with open(source, encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        _, _, catcher = parse_file(source)
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and not getattr(node, 'level', 0):
+                imported = node.module if isinstance(node, ast.ImportFrom) else node.names[0].name
+                record = catcher.total_imports[imported][(source, node.lineno)]
+                assert record.exact_line == ast.unparse(node)
+
+
+def test_lean_import_finder(tmpdir):
+    code = 'import os\nfrom foo import bar\n'
+    full = main.get_imported_libs(code)
+    lean = main.get_imported_libs(code, lean=True)
+    assert lean.imports == [] and lean.import_froms == []
+    assert len(full.imports) == len(full.import_froms) == 1
+    assert lean.describe() == full.describe()
+    assert lean.total_imports == full.total_imports
+
+    src = tmpdir.mkdir('src')
+    src.join('mod.py').write(code)
+    for _, _, catcher in main.iterate_over_library(str(src), lean=True):
+        assert catcher.imports == [] and catcher.import_froms == []
+        assert catcher.describe() == full.describe()
+
+
+def test_incremental_import_search(tmpdir, count_parses):
+    from depfinder.cache import ScanSnapshot
+    src = tmpdir.mkdir('pkg')
+    src.join('a.py').write('import numpy\n')
+    src.join('b.py').write('import os\ntry:\n    import yaml\nexcept ImportError:\n    pass\n')
+    src.mkdir('sub').join('c.py').write('import requests\n')
+    src.mkdir('tests').join('test_a.py').write('import pytest\n')
+    kwargs = dict(remap=False, ignore=['*/tests/*'])
+
+    def check(changed):
+        del count_parses[:]
+        with ScanSnapshot(str(src), cache_dir=str(tmpdir.join('cache'))) as snapshot:
+            result = main.incremental_import_search(
+                str(src), changed=changed, snapshot=snapshot, **kwargs)
+        parsed = sorted(os.path.basename(path) for path in count_parses)
+        assert result == main.simple_import_search(str(src), **kwargs)
+        return parsed
+
+    # the first run scans everything
+    assert check([]) == ['a.py', 'b.py', 'c.py']
+    src.join('a.py').write('import scipy\n')
+    src.join('d.py').write('import numpy\n')
+    src.join('tests', 'test_a.py').write('import hypothesis\n')
+    assert check([str(src.join('a.py')), str(src.join('d.py')),
+                   str(src.join('tests', 'test_a.py'))]) == ['a.py', 'd.py']
+    src.join('b.py').remove()
+    src.join('sub').remove()
+    assert check([str(src.join('b.py')), str(src.join('sub'))]) == []
+    # nothing changed
+    assert check([]) == []
+    # different options mean a new full scan
+    kwargs['ignore'] = []
+    assert check([]) == ['a.py', 'd.py', 'test_a.py']
+
+
+def test_incremental_import_search_interrupted(tmpdir, monkeypatch, count_parses):
+    from depfinder.cache import ScanSnapshot
+    src = tmpdir.mkdir('pkg')
+    src.join('a.py').write('import numpy\n')
+    src.join('b.py').write('import requests\n')
+    iterate_over_files = inspection._iterate_over_files
+
+    def interrupted(*args, **kwargs):
+        for item in iterate_over_files(*args, **kwargs):
+            yield item
+            raise KeyboardInterrupt
+
+    def run(**kwargs):
+        with ScanSnapshot(str(src), cache_dir=str(tmpdir.join('cache'))) as snapshot:
+            return main.incremental_import_search(
+                str(src), changed=[], remap=False, snapshot=snapshot, **kwargs)
+
+    expected = main.simple_import_search(str(src), remap=False)
+    monkeypatch.setattr(inspection, '_iterate_over_files', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run()
+    monkeypatch.setattr(inspection, '_iterate_over_files', iterate_over_files)
+    # the first scan did not finish, so this one scans everything again
+    assert run() == expected
+
+    # a new scan that stops half way leaves the last complete one in place
+    monkeypatch.setattr(inspection, '_iterate_over_files', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(ignore=['b.py'])
+    monkeypatch.setattr(inspection, '_iterate_over_files', iterate_over_files)
+    del count_parses[:]
+    assert run() == expected
+    assert count_parses == []
+
+
+@pytest.mark.skipif(subprocess.call(['git', '--version'], stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL) != 0,
+                    reason="needs git")
+def test_incremental_import_search_with_git(tmpdir, count_parses):
+    from depfinder.cache import ScanSnapshot
+    src = tmpdir.mkdir('repo')
+    src.join('a.py').write('import numpy\n')
+    src.join('b.py').write('import scipy\n')
+
+    def git(*args):
+        subprocess.check_call(['git', '-C', str(src), '-c', 'user.name=t',
+                               '-c', 'user.email=t@example.com'] + list(args),
+                              stdout=subprocess.DEVNULL)
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'initial')
+
+    def check():
+        del count_parses[:]
+        with ScanSnapshot(str(src), cache_dir=str(tmpdir.join('cache'))) as snapshot:
+            result = main.incremental_import_search(str(src), remap=False, snapshot=snapshot)
+        parsed = sorted(os.path.basename(path) for path in count_parses)
+        assert result == main.simple_import_search(str(src), remap=False)
+        return parsed
+
+    assert check() == ['a.py', 'b.py']
+    # uncommitted and untracked changes
+    src.join('a.py').write('import pandas\n')
+    src.join('c.py').write('import requests\n')
+    assert check() == ['a.py', 'c.py']
+    # reverting a change that was picked up by the last run
+    git('checkout', '--', 'a.py')
+    assert check() == ['a.py', 'c.py']
+    # committed changes
+    src.join('b.py').write('import xarray\n')
+    git('commit', '-q', '-am', 'b')
+    assert check() == ['b.py', 'c.py']
+
+
 def test_relative_imports():
     for rel in relative_imports:
         test_object = Initter(rel)
@@ -220,6 +532,233 @@ def test_for_smoke():
     assert main.simple_import_search('.') is not None
 
 
+def test_benchmarks_smoke(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    subprocess.check_call([
+        sys.executable, join(dirname(__file__), 'benchmarks', 'run.py'),
+        '--files', '5', '--imports', '3', '--notebooks', '1', '--namespaces', '1',
+        '--repeat', '1', '--output', output])
+    with open(output) as f:
+        results = json.load(f)
+    assert results['params']['files'] == 5
+    for phase in ('walk', 'ast.parse', 'ImportFinder.visit', 'parse_file',
+                  'sanitize_deps', 'notebook_path_to_dependencies',
+                  'report_conda_forge_names_from_import_map'):
+        assert results['phases'][phase]['seconds'] >= 0
+
+
+def test_plan_batches_largest_first():
+    files = [('small%s.py' % i, 10) for i in range(10)] + [('huge.py', 1000)]
+    batches = parallel.plan_batches(files, jobs=2)
+    assert batches[0] == ['huge.py']
+    assert sorted(f for batch in batches for f in batch) == sorted(f for f, _ in files)
+
+
+def test_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_FILES_FOR_PARALLEL', 0)
+    monkeypatch.setattr(parallel, 'MIN_BYTES_FOR_PARALLEL', 0)
+    path = dirname(depfinder.__file__)
+    serial = [(fname, catcher.describe(), catcher.total_imports)
+              for _, fname, catcher in main.iterate_over_library(path)]
+    parallel_result = [(fname, catcher.describe(), catcher.total_imports)
+                       for _, fname, catcher in main.iterate_over_library(path, jobs=2)]
+    assert serial == parallel_result
+    assert main.simple_import_search(path, jobs=2) == main.simple_import_search(path)
+
+
+def test_parallel_survives_a_dying_worker(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_FILES_FOR_PARALLEL', 0)
+    monkeypatch.setattr(parallel, 'MIN_BYTES_FOR_PARALLEL', 0)
+    path = dirname(depfinder.__file__)
+    parent = os.getpid()
+    parse_files_serially = parallel.parse_files_serially
+
+    def crash_in_workers(paths, *args):
+        if os.getpid() != parent and any(p.endswith('inspection.py') for p in paths):
+            os._exit(1)
+        return parse_files_serially(paths, *args)
+    # the workers are forked, so they see the patched function too
+    monkeypatch.setattr(parallel, 'parse_files_serially', crash_in_workers)
+    expected = [(fname, catcher.describe())
+                for _, fname, catcher in main.iterate_over_library(path)]
+    assert [(fname, catcher.describe())
+            for _, fname, catcher in main.iterate_over_library(path, jobs=2)] == expected
+
+
+def test_resolve_jobs_counts_the_usable_cpus(monkeypatch):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1, 2}, raising=False)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 64)
+    assert parallel.resolve_jobs(0) == parallel.resolve_jobs(-1) == 3
+    assert parallel.resolve_jobs(None) == 1
+    assert parallel.resolve_jobs(5) == 5
+    monkeypatch.delattr(os, 'sched_getaffinity')
+    assert parallel.resolve_jobs(0) == 64
+
+
+def test_parallel_falls_back_to_serial_for_small_trees(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("a process pool should not be started")
+    import concurrent.futures
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', no_pool)
+    path = dirname(depfinder.__file__)
+    assert main.simple_import_search(path, jobs=4) == main.simple_import_search(path)
+
+
+def test_profile_scan(tmpdir):
+    path = dirname(depfinder.__file__)
+    with ScanProfile(top=3) as profile:
+        with ParseCache(str(tmpdir)) as cache:
+            deps = main.simple_import_search(path, cache=cache)
+    assert deps == main.simple_import_search(path)
+    assert profiling.active() is None
+    data = profile.to_dict()
+    n_files = len(list(inspection._iter_python_files(path)))
+    assert {'walk', 'read', 'parse', 'visit'} <= set(data['phases'])
+    assert data['phases']['parse']['calls'] == n_files
+    assert data['counts']['files'] == n_files
+    assert data['counts']['parse_cache_misses'] == n_files
+    assert data['counts']['ast_nodes'] > n_files
+    assert [f['seconds'] for f in data['slowest_files']] == sorted(
+        [f['seconds'] for f in data['slowest_files']], reverse=True)
+    assert len(data['slowest_files']) == 3
+    assert 'slowest files' in profile.format_table()
+    json.loads(profile.to_json())
+
+
+def test_profile_merges_worker_profiles(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_FILES_FOR_PARALLEL', 0)
+    monkeypatch.setattr(parallel, 'MIN_BYTES_FOR_PARALLEL', 0)
+    path = dirname(depfinder.__file__)
+    with ScanProfile() as profile:
+        main.simple_import_search(path, jobs=2)
+    n_files = len(list(inspection._iter_python_files(path)))
+    assert profile.counts['files'] == n_files
+    assert profile.phases['parse'][2] == n_files
+
+
+@pytest.fixture
+def count_parses(monkeypatch):
+    calls = []
+    get_imported_libs = inspection.get_imported_libs
+
+    def counting_get_imported_libs(code, filename='', **kwargs):
+        calls.append(filename)
+        return get_imported_libs(code, filename=filename, **kwargs)
+    monkeypatch.setattr(inspection, 'get_imported_libs', counting_get_imported_libs)
+    return calls
+
+
+def test_parse_cache_matches_uncached(tmpdir, count_parses):
+    path = dirname(depfinder.__file__)
+    expected = [(fname, catcher.describe(), catcher.total_imports)
+                for _, fname, catcher in main.iterate_over_library(path)]
+    del count_parses[:]
+    for _ in range(2):
+        with ParseCache(str(tmpdir)) as cache:
+            result = [(fname, catcher.describe(), catcher.total_imports)
+                      for _, fname, catcher in main.iterate_over_library(path, cache=cache)]
+        assert result == expected
+    # only the first, cold, run parsed anything
+    assert len(count_parses) == len(expected)
+
+
+def test_parse_cache_skips_hashing_unchanged_files(tmpdir, monkeypatch):
+    src = tmpdir.mkdir('src')
+    src.join('mod.py').write('import foo\n')
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        list(main.iterate_over_library(str(src), cache=cache))
+
+    from depfinder import cache as cache_module
+    hashed = []
+    hash_file = cache_module.hash_file
+    monkeypatch.setattr(cache_module, 'hash_file', lambda p: hashed.append(p) or hash_file(p))
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        list(main.iterate_over_library(str(src), cache=cache))
+        assert hashed == []
+        src.join('mod.py').write('import foo\nimport bar\n')
+        _, _, catcher = parse_file(str(src.join('mod.py')), cache=cache)
+    assert len(hashed) == 1
+    assert catcher.describe() == {'required': {'foo', 'bar'}}
+
+
+def test_parse_cache_key_covers_namespace_packages(tmpdir, monkeypatch):
+    from depfinder import utils
+    src = tmpdir.mkdir('src')
+    src.join('mod.py').write('import acme.widgets\n')
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        assert main.simple_import_search(str(src), remap=False, cache=cache) == \
+            {'required': ['acme']}
+        monkeypatch.setattr(utils, 'namespace_packages',
+                            utils.namespace_packages | {'acme.widgets'})
+        assert main.simple_import_search(str(src), remap=False, cache=cache) == \
+            {'required': ['acme.widgets']}
+
+
+def test_parse_file_leaves_flushing_to_the_caller(tmpdir, monkeypatch):
+    src = tmpdir.mkdir('src')
+    paths = []
+    for name in ('a', 'b', 'c'):
+        src.join(name + '.py').write('import {}\n'.format(name))
+        paths.append(str(src.join(name + '.py')))
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        flushes = []
+        flush = cache.flush
+        monkeypatch.setattr(cache, 'flush', lambda: flushes.append(1) or flush())
+        for path in paths:
+            parse_file(path, cache=cache)
+        assert flushes == []
+    # written when the cache was closed
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        for path in paths:
+            parse_file(path, cache=cache)
+        assert cache.hits == 3
+
+
+def test_parse_cache_lookups_follow_the_serial_scan(tmpdir, monkeypatch, count_parses):
+    src = tmpdir.mkdir('src')
+    for name in ('a', 'b', 'c'):
+        src.join(name + '.py').write('import {}\n'.format(name))
+    # a copy of a.py, which is not parsed again
+    src.join('d.py').write('import a\n')
+    for expected_parses in (3, 0):
+        del count_parses[:]
+        with ParseCache(str(tmpdir.join('cache'))) as cache:
+            looked_up = []
+            key_for_file = cache.key_for_file
+            monkeypatch.setattr(cache, 'key_for_file',
+                                lambda path, *args: looked_up.append(path) or key_for_file(path, *args))
+            catchers = main.iterate_over_library(str(src), cache=cache, lean=True)
+            _, path, catcher = next(catchers)
+            # the first result does not wait for the rest of the tree
+            assert looked_up == [path]
+            results = [(path, catcher.describe())] + [
+                (path, catcher.describe()) for _, path, catcher in catchers]
+        assert len(looked_up) == 4
+        assert len(count_parses) == expected_parses
+        assert results == [(path, catcher.describe()) for _, path, catcher in
+                           main.iterate_over_library(str(src), lean=True)]
+
+
+def test_parse_cache_dedupes_identical_files(tmpdir, count_parses):
+    src = tmpdir.mkdir('src')
+    for name in ('a', 'b', 'c'):
+        src.mkdir(name).join('vendored.py').write('import foo\ntry:\n    import bar\nexcept ImportError:\n    pass\n')
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        results = list(main.iterate_over_library(str(src), cache=cache))
+    assert len(count_parses) == 1
+    assert len(results) == 3
+    for _, fname, catcher in results:
+        assert catcher.describe() == {'required': {'foo'}, 'questionable': {'bar'}}
+        assert list(catcher.total_imports['foo']) == [(fname, 1)]
+
+
+def test_parse_cache_evicts_least_recently_used(tmpdir):
+    with ParseCache(str(tmpdir), max_size=1) as cache:
+        cache.put('old', {'describe': {}, 'total_imports': []})
+        cache.flush()
+        assert cache.get('old') is None
+
+
 ### NOTEBOOK TESTING CODE ###
 
 @contextlib.contextmanager
@@ -283,6 +822,82 @@ def test_multiple_code_cells(capsys):
         assert targets == eval(stdout)
 
 
+
+def test_iter_code_cells(tmpdir, monkeypatch):
+    from depfinder import notebook
+    nb = v4.new_notebook()
+    nb['cells'] = [
+        v4.new_markdown_cell('import not_code'),
+        v4.new_code_cell('import numpy as np\nprint("\\"quoted\\"")\n'),
+        v4.new_code_cell(''),
+        v4.new_code_cell(),
+    ]
+    nb['cells'][1]['outputs'] = [v4.new_output(
+        'display_data', data={'image/png': 'iVBORw0K' * 20000,
+                              'text/plain': ['{"not": ["a", "cell"]}\\']})]
+    # nbformat allows the source to be a list of lines
+    nb['cells'][3]['source'] = ['from snowman import \u2603\n', '  # \u00e9\\']
+    fname = str(tmpdir.join('outputs.ipynb'))
+    with open(fname, 'w') as f:
+        f.write(v4.writes(nb))
+    with open(fname) as f:
+        expected = [''.join(cell['source']) for cell in json.load(f)['cells']
+                    if cell['cell_type'] == 'code']
+    assert list(notebook.iter_code_cells(fname)) == expected
+    # stream even the small notebooks
+    monkeypatch.setattr(notebook, 'STREAMING_THRESHOLD', 0)
+    for chunk_size in (1, 2, 7, 4096):
+        assert list(notebook.iter_code_cells(fname, chunk_size)) == expected
+
+    with open(fname, 'w') as f:
+        f.write('{"cells": [{"cell_type": "code", "source": "import os')
+    with pytest.raises(ValueError):
+        list(notebook.iter_code_cells(fname))
+
+
+def test_notebooks_to_dependencies(tmpdir, monkeypatch, capsys):
+    from depfinder import notebook
+    template = ['%matplotlib inline\nimport numpy as np\nimport os', 'x = 1']
+    cells = [template + ['import requests'], template + ['from .sibling import helper'],
+             template, ['import (broken']]
+    paths = []
+    for idx, code_cells in enumerate(cells):
+        nb = v4.new_notebook()
+        nb['cells'] = [v4.new_code_cell(code_cell) for code_cell in code_cells]
+        paths.append(str(tmpdir.join('nb%s.ipynb' % idx)))
+        with open(paths[-1], 'w') as f:
+            f.write(v4.writes(nb))
+    expected = {path: main.notebook_path_to_dependencies(path, remap=False)
+                for path in paths[:3]}
+
+    parsed = []
+    get_imported_libs = notebook.get_imported_libs
+
+    def counting_get_imported_libs(code, **kwargs):
+        parsed.append(code)
+        return get_imported_libs(code, **kwargs)
+
+    monkeypatch.setattr(notebook, 'get_imported_libs', counting_get_imported_libs)
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        # the template cell is parsed once and 'x = 1' is never parsed
+        assert expected == main.notebooks_to_dependencies(paths, remap=False,
+                                                          cache=cache)
+        assert len(parsed) == 4
+        del parsed[:]
+        assert expected == main.notebooks_to_dependencies(paths, remap=False,
+                                                          cache=cache)
+        # only the cell that failed to parse is tried again
+        assert parsed == ['import (broken\n']
+
+    monkeypatch.setattr(parallel, 'MIN_CELLS_FOR_PARALLEL', 1)
+    assert expected == main.notebooks_to_dependencies(paths, remap=False, jobs=2)
+
+    # several notebooks on the command line
+    _run_cli(path_to_check=paths[0], extra_flags=paths[1:] + ['--no-remap'])
+    stdout, stderr = capsys.readouterr()
+    assert eval(stdout) == {'builtin': ['os'], 'relative': ['sibling'],
+                            'required': ['numpy', 'requests']}
+
 ### CLI TESTING CODE ###
 
 def _process_args(path_to_check, extra_flags):
@@ -342,8 +957,17 @@ def known_flags():
     flags.remove('--pdb')
     flags.remove('--ignore')
     flags.remove('--custom-namespaces')
+    flags.remove('-j')
+    flags.remove('--jobs')
+    flags.remove('--cache-dir')
+    flags.remove('--mapping-ttl')
+    flags.remove('--profile-top')
+    flags.remove('--target-python')
+    flags.remove('--format')
+    flags.remove('--changed')
+    flags.remove('--server')
     flags.extend(['-k all', '-k required', '-k optional', '-k builtin',
-                  '-k relative'])
+                  '-k relative', '--format=ndjson', '--format=yaml'])
     return flags
 
 
@@ -400,13 +1024,37 @@ def test_cli(path, req, capsys):
     stdout, stderr = capsys.readouterr()
     print('stdout\n{}'.format(stdout))
     print('stderr\n{}'.format(stderr))
+    found = eval(stdout)
     if req is None:
         dependencies_file = join(dirname(dirname(depfinder.__file__)),
                                  'requirements.txt')
         dependencies = set([dep for dep in open(dependencies_file, 'r').read().split('\n') if not dep.startswith("stdlib")])
-    else:
-        dependencies = req
-    assert dependencies == set(eval(stdout).get('required', set()))
+        # depfinder imports its dependencies lazily to keep `import depfinder`
+        # fast, so they are reported as questionable instead of required
+        assert dependencies <= set(found.get('questionable', set()))
+        req = set()
+    assert req == set(found.get('required', set()))
+
+
+def test_cli_ndjson(tmpdir, capsys):
+    src = tmpdir.mkdir('src')
+    src.join('a.py').write('import os\nimport numpy\n')
+    src.join('b.py').write('try:\n    import yaml\nexcept ImportError:\n    pass\n')
+    old_argv = sys.argv
+    try:
+        _run_cli(path_to_check=str(src), extra_flags=['--format', 'ndjson', '--no-cache'])
+    finally:
+        sys.argv = old_argv
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(lines) == 3 and lines[-1]['path'] is None
+    per_file = {line['path']: line for line in lines[:-1]}
+    assert per_file[str(src.join('a.py'))]['deps'] == {'builtin': ['os'],
+                                                       'required': ['numpy']}
+    assert per_file[str(src.join('b.py'))]['deps'] == {'questionable': ['pyyaml']}
+    assert all(line['seconds'] >= 0 for line in lines)
+    assert lines[-1]['files'] == 2
+    assert lines[-1]['deps'] == {'builtin': ['os'], 'required': ['numpy'],
+                                 'questionable': ['pyyaml']}
 
 
 def test_known_fail_cli(tmpdir):
@@ -445,6 +1093,130 @@ def test_fake_packages():
     assert main.sanitize_deps(imports.describe()) == {}
 
 
+def test_import_does_not_load_mapping():
+    code = (
+        "import sys, depfinder, depfinder.cli, depfinder.utils\n"
+        "assert 'name_index' not in vars(depfinder.utils)\n"
+        "assert 'pkg_data' not in vars(depfinder.utils)\n"
+        "assert 'yaml' not in sys.modules\n"
+        "assert 'requests' not in sys.modules\n"
+        "assert depfinder.utils.namespace_packages\n"
+        "assert 'name_index' in vars(depfinder.utils)\n"
+    )
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_pkg_index(tmpdir, monkeypatch):
+    from depfinder import pkg_index, utils
+    pkg_data_dir = str(tmpdir)
+    for name in pkg_index.SOURCE_FILES:
+        tmpdir.join(name).write_binary(
+            open(join(dirname(depfinder.__file__), 'pkg_data', name), 'rb').read())
+    assert pkg_index.load_index(pkg_data_dir) is None
+
+    pkg_index.write_index(output_dir=pkg_data_dir, pkg_data_dir=pkg_data_dir)
+    with monkeypatch.context() as m:
+        # checking that the index is fresh does not read the yaml files
+        def fail(*args):
+            raise AssertionError("the yaml files were read")
+        m.setattr(pkg_index, '_read_sources', fail)
+        m.setattr(pkg_index, '_source_digest', fail)
+        index = pkg_index.load_index(pkg_data_dir)
+    expected = pkg_index.build_index_from_mapping(
+        utils._load_yaml_data('name_mapping.yml'), utils._load_yaml_data('pkg_data.yml'))
+    for k, v in expected.items():
+        assert index[k] == v
+    assert 'google.cloud.storage' in index['namespace_packages']
+    assert 'mpl_toolkits' in index['fake_packages']
+    assert pkg_index.mapping_list_from_index(index) == utils._load_yaml_data('name_mapping.yml')
+    # and it is only built for one version of depfinder
+    assert pkg_index.load_index(pkg_data_dir, version='0.0.1') is None
+
+    # the index is ignored once the yaml it was built from changes
+    tmpdir.join('pkg_data.yml').write('_PACKAGE_MAPPING: {}\n', mode='a')
+    assert pkg_index.load_index(pkg_data_dir) is None
+
+
+@pytest.fixture
+def remote_mapping(tmpdir, monkeypatch):
+    """Local, file based stand in for the conda-forge name mapping"""
+    from depfinder import utils
+    import yaml
+    remote = tmpdir.join('remote_mapping.yml')
+    remote.write(yaml.dump([
+        {'import_name': 'foo.bar', 'conda_name': 'foo-bar', 'pypi_name': 'foo-bar',
+         'mapping_source': 'test'},
+    ]))
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return yaml.safe_load(remote.read())
+    monkeypatch.setattr(utils, '_fetch_pypi_name_mapping', fetch)
+    monkeypatch.setenv('DEPFINDER_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(utils, 'OFFLINE', False)
+    monkeypatch.setattr(utils, 'MAPPING_TTL', 60)
+    return remote, calls
+
+
+def test_name_mapping_cache(remote_mapping):
+    from depfinder import utils
+    remote, calls = remote_mapping
+    assert 'foo.bar' in utils._load_name_index()['namespace_packages']
+    assert len(calls) == 1
+    # served from the cache while it is fresh, even if the remote is gone
+    remote.remove()
+    assert 'foo.bar' in utils._load_name_index()['namespace_packages']
+    assert len(calls) == 1
+
+
+def test_name_mapping_cache_serves_stale_and_refreshes(remote_mapping, monkeypatch):
+    from depfinder import utils
+    from depfinder.cache import NameMappingCache
+    import yaml
+    remote, calls = remote_mapping
+    NameMappingCache().save(yaml.safe_load(remote.read()), fetched_at=0)
+    remote.write(yaml.dump([
+        {'import_name': 'baz.qux', 'conda_name': 'baz-qux', 'pypi_name': 'baz-qux',
+         'mapping_source': 'test'},
+    ]))
+    assert 'foo.bar' in utils._load_name_index()['namespace_packages']
+    utils._refresh_thread.join()
+    assert len(calls) == 1
+    assert 'baz.qux' in utils._load_name_index()['namespace_packages']
+
+
+def test_name_mapping_offline(remote_mapping, monkeypatch):
+    from depfinder import utils
+    from depfinder.cache import NameMappingCache
+    import yaml
+    remote, calls = remote_mapping
+    monkeypatch.setattr(utils, 'OFFLINE', True)
+    assert utils._load_name_index() is utils.package_index
+    NameMappingCache().save(yaml.safe_load(remote.read()), fetched_at=0)
+    assert 'foo.bar' in utils._load_name_index()['namespace_packages']
+    assert calls == []
+
+
+def test_name_mapping_fetch_timeout(remote_mapping, monkeypatch):
+    from depfinder import utils
+    import threading
+    release = threading.Event()
+    monkeypatch.setattr(utils, '_fetch_pypi_name_mapping', lambda: release.wait() and None)
+    monkeypatch.setattr(utils, 'MAPPING_FETCH_TIMEOUT', 0.01)
+    assert utils._load_name_index() is utils.package_index
+    release.set()
+
+
+def test_extract_pkg_from_import_with_index():
+    from depfinder.reports import extract_pkg_from_import_with_index
+    assert extract_pkg_from_import_with_index('yaml') == ('pyyaml', {'yaml': {'pyyaml'}})
+    assert extract_pkg_from_import_with_index('sklearn.svm') == (
+        'scikit-learn', {'sklearn.svm': {'scikit-learn'}})
+    assert extract_pkg_from_import_with_index('not_a_real_pkg.sub') == (
+        'not_a_real_pkg.sub', {'not_a_real_pkg.sub': set()})
+
+
 def test_get_top_level_import():
     name = 'this.that.something'
     top_level_name = inspection.get_top_level_import_name(name)
@@ -455,6 +1227,35 @@ def test_get_top_level_import():
     assert top_level_name == 'google.cloud.storage'
 
 
+def _reference_top_level_import_name(name, known, custom_namespaces):
+    # the component by component walk that ModuleTrie replaces
+    while '.' in name:
+        if name in known or name in custom_namespaces or any(
+                name.count('.') - nsp.count('.') == 1 and name.startswith(nsp + '.')
+                for nsp in custom_namespaces):
+            return name
+        name = name.rsplit('.', 1)[0]
+    return name
+
+
+def test_module_trie_matches_reference():
+    known = ['os', 'os.path', 'concurrent.futures', 'google.cloud.storage', 'azure.mgmt']
+    custom_namespaces = ['acme', 'corp.tools', 'azure.mgmt']
+    trie = ModuleTrie(known, custom_namespaces)
+    components = ['os', 'path', 'acme', 'corp', 'tools', 'google', 'cloud',
+                  'storage', 'azure', 'mgmt', 'x', 'futures', 'concurrent']
+    rng = random.Random(0)
+    for _ in range(2000):
+        name = '.'.join(rng.choice(components) for _ in range(rng.randint(1, 5)))
+        assert trie.top_level(name) == _reference_top_level_import_name(
+            name, known, custom_namespaces), name
+        assert trie.longest_prefix(name) == (
+            recursively_search_for_name(name, known + custom_namespaces) or None), name
+    assert 'os.path' in trie and 'os.pat' not in trie and 'google' not in trie
+    assert inspection.get_top_level_import_name(
+        'acme.core.io', custom_namespaces=['acme']) == 'acme.core'
+
+
 @pytest.mark.skipif(
     not HAS_CF_METADATA,
     reason="test of optional conda-forge-metadata integration",
@@ -462,13 +1263,352 @@ def test_get_top_level_import():
 def test_report_conda_forge_names_from_import_map():
     m, f, c = parse_file(join(dirname(depfinder.__file__), 'utils.py'))
     report, import_to_pkg = report_conda_forge_names_from_import_map(c.total_imports)
-    assert report['required'] == {'pyyaml', 'requests'}
+    # utils only imports its dependencies when the name mapping is first used
+    assert {'pyyaml', 'requests'} <= report['questionable']
 
 
 @pytest.mark.skipif(
     not HAS_CF_METADATA,
     reason="test of optional conda-forge-metadata integration",
 )
+def test_ignore_matcher():
+    from fnmatch import fnmatch
+    from depfinder.ignore import IgnoreMatcher
+    patterns = ['*/tests/*', '*_pb2.py', '*/build/lib?/*', 'setup.py']
+    ignore = IgnoreMatcher(patterns)
+    for path in ['pkg/tests/test_a.py', 'pkg/a_pb2.py', 'pkg/build/lib3/a.py',
+                 'setup.py', 'pkg/setup.py', 'pkg/testsuite/a.py', 'pkg/a.py']:
+        assert ignore(path) == any(fnmatch(path, p) for p in patterns)
+    assert ignore.prunes('pkg/tests')
+    assert ignore.prunes('pkg/build/lib3')
+    assert not ignore.prunes('pkg/testsuite')
+    assert not ignore.prunes('pkg')
+    assert not IgnoreMatcher()
+    assert not IgnoreMatcher()('pkg/a.py')
+
+
+def test_ignore_prunes_before_parsing(tmpdir, count_parses, monkeypatch):
+    src = tmpdir.mkdir('src')
+    src.join('mod.py').write('import foo\n')
+    src.mkdir('tests').join('test_mod.py').write('import pytest\n')
+    src.mkdir('_vendor').mkdir('six').join('six.py').write('import bar\n')
+    walked = []
+    real_scandir = os.scandir
+
+    def recording_scandir(path):
+        walked.append(os.path.basename(path))
+        return real_scandir(path)
+    monkeypatch.setattr(os, 'scandir', recording_scandir)
+    deps = main.simple_import_search(str(src), remap=False,
+                                     ignore=['*/tests/*', '*/_vendor/*'])
+    assert deps == {'required': ['foo']}
+    assert count_parses == [str(src.join('mod.py'))]
+    assert walked == ['src']
+
+
+def _make_checkout(root):
+    layout = {
+        'pkg/__init__.py': 'import numpy\n',
+        'pkg/build/helpers.py': 'import in_build_subpackage\n',
+        'build/lib/pkg/__init__.py': 'import build_copy\n',
+        'build/bdist.linux-x86_64/pkg/mod.py': 'import bdist_copy\n',
+        '.git/hooks/hook.py': 'import git_hook\n',
+        '.tox/py311/lib/mod.py': 'import tox_env\n',
+        'env/pyvenv.cfg': 'home = /usr/bin\n',
+        'env/lib/python3.11/mod.py': 'import venv_module\n',
+        'conda-env/conda-meta/history': '',
+        'conda-env/mod.py': 'import conda_env_module\n',
+        'scripts/generated_pb2.py': 'import protobuf\n',
+        'scripts/run.py': 'import click\n',
+        'scripts/local/debug.py': 'import ipdb\n',
+        'scripts/local/keep.py': 'import rich\n',
+        'docs/conf.py': 'import sphinx\n',
+        'pyproject.toml': '[project]\nname = "pkg"\n',
+    }
+    for path, content in layout.items():
+        target = root.join(*path.split('/'))
+        target.dirpath().ensure(dir=True)
+        target.write(content)
+    root.join('.gitignore').write('# generated\n*_pb2.py\n/docs/\n')
+    root.join('scripts', 'local', '.gitignore').write('*\n!keep.py\n')
+    return root
+
+
+def test_walker_default_excludes(tmpdir):
+    from depfinder.walk import walk_python_files
+    root = str(_make_checkout(tmpdir.mkdir('checkout')))
+    found = sorted(os.path.relpath(path, root).replace(os.sep, '/')
+                   for path in walk_python_files(root, default_excludes=True))
+    assert found == ['docs/conf.py', 'pkg/__init__.py', 'pkg/build/helpers.py',
+                     'scripts/generated_pb2.py', 'scripts/local/debug.py',
+                     'scripts/local/keep.py', 'scripts/run.py']
+    everything = list(walk_python_files(root, default_excludes=False))
+    assert len(everything) == 13
+    # same files, in the same order, as os.walk
+    assert everything == [os.path.join(parent, f) for parent, _, files in os.walk(root)
+                          for f in files if f.endswith('.py')]
+
+
+def test_walker_keeps_build_directories_of_no_project(tmpdir):
+    from depfinder.walk import is_walked, walk_python_files
+    root = tmpdir.mkdir('checkout')
+    for path in ('build/libfoo/__init__.py', 'pkg/build/lib/mod.py', 'build/lib/pkg/mod.py'):
+        root.join(*path.split('/')).write('import foo\n', ensure=True)
+    found = sorted(os.path.relpath(path, str(root)).replace(os.sep, '/')
+                   for path in walk_python_files(str(root), default_excludes=True))
+    assert found == ['build/lib/pkg/mod.py', 'build/libfoo/__init__.py',
+                     'pkg/build/lib/mod.py']
+    # only the build directory next to the project file holds build copies
+    root.join('setup.py').write('from setuptools import setup\n')
+    found = sorted(os.path.relpath(path, str(root)).replace(os.sep, '/')
+                   for path in walk_python_files(str(root), default_excludes=True))
+    assert found == ['build/libfoo/__init__.py', 'pkg/build/lib/mod.py', 'setup.py']
+    assert not is_walked(str(root), str(root.join('build', 'lib', 'pkg', 'mod.py')),
+                         default_excludes=True)
+    assert is_walked(str(root), str(root.join('pkg', 'build', 'lib', 'mod.py')),
+                     default_excludes=True)
+    # the api walks everything unless asked not to
+    assert len(list(walk_python_files(str(root)))) == 4
+
+
+def test_walker_respects_gitignore(tmpdir):
+    from depfinder.walk import walk_python_files
+    root = _make_checkout(tmpdir.mkdir('checkout'))
+    found = sorted(os.path.relpath(path, str(root)).replace(os.sep, '/')
+                   for path in walk_python_files(str(root), default_excludes=True,
+                                                 respect_gitignore=True))
+    assert found == ['pkg/__init__.py', 'pkg/build/helpers.py',
+                     'scripts/local/keep.py', 'scripts/run.py']
+    # the .gitignore of the parent directories apply too
+    scripts = str(root.join('scripts'))
+    assert [os.path.basename(path) for path in
+            walk_python_files(scripts, respect_gitignore=True)] == ['run.py', 'keep.py']
+    deps = main.simple_import_search(str(root), remap=False, default_excludes=True,
+                                     respect_gitignore=True)
+    assert deps == {'required': ['click', 'in_build_subpackage', 'numpy', 'rich']}
+
+
+
+def test_simple_import_search_includes_notebooks(tmpdir, capsys):
+    root = tmpdir.mkdir('mixed')
+    root.join('mod.py').write('import numpy\n')
+    for path, code in [('analysis.ipynb', '%matplotlib inline\nimport pandas as pd'),
+                       ('.ipynb_checkpoints/analysis-checkpoint.ipynb', 'import stale')]:
+        nb = v4.new_notebook()
+        nb['cells'] = [v4.new_code_cell(code), v4.new_code_cell('pd.DataFrame()')]
+        target = root.join(*path.split('/'))
+        target.dirpath().ensure(dir=True)
+        target.write(v4.writes(nb))
+    assert main.simple_import_search(str(root), remap=False) == {'required': ['numpy']}
+    expected = {'required': ['numpy', 'pandas']}
+    assert main.simple_import_search(str(root), remap=False, default_excludes=True,
+                                     include_notebooks=True) == expected
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        for _ in range(2):
+            assert main.simple_import_search(str(root), remap=False, cache=cache,
+                                             default_excludes=True,
+                                             include_notebooks=True) == expected
+        assert cache.hits == 2
+    _run_cli(path_to_check=str(root), extra_flags=['--include-notebooks', '--no-remap'])
+    stdout, stderr = capsys.readouterr()
+    assert eval(stdout) == expected
+
+
+def test_scan_archives_in_place(tmpdir, capsys):
+    import tarfile
+    import zipfile
+    root = _make_checkout(tmpdir.mkdir('checkout'))
+    root.join('pkg', 'bom.py').write_binary(b'\xef\xbb\xbfimport bom_module\n')
+    files = [str(path) for path in root.visit() if path.check(file=True)]
+    archives = [str(tmpdir.join('checkout-1.0-py3-none-any.whl')),
+                str(tmpdir.join('checkout-1.0.tar.gz')),
+                str(tmpdir.join('checkout-1.0.tar.bz2'))]
+    with zipfile.ZipFile(archives[0], 'w') as f:
+        for path in files:
+            f.write(path, os.path.relpath(path, str(root)))
+    for archive, mode in zip(archives[1:], ['w:gz', 'w:bz2']):
+        with tarfile.open(archive, mode) as f:
+            f.add(str(root), arcname='checkout-1.0')
+
+    for kwargs in [{}, {'default_excludes': True},
+                   {'ignore': ['*/scripts/local/*', '*_pb2.py']}]:
+        expected = main.simple_import_search(str(root), remap=False, **kwargs)
+        for archive in archives:
+            assert main.simple_import_search(archive, remap=False, **kwargs) == expected
+    assert 'bom_module' in expected['required']
+
+    # members are named after the archive
+    paths = [path for _, path, _ in inspection.iterate_over_library(archives[0])]
+    assert os.path.join(archives[0], 'pkg', '__init__.py') in paths
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        for _ in range(2):
+            assert main.simple_import_search(archives[1], remap=False, cache=cache) == \
+                main.simple_import_search(str(root), remap=False)
+        assert cache.hits == len(paths)
+
+    # the cli skips the default excludes
+    _run_cli(path_to_check=archives[0], extra_flags=['--no-remap'])
+    stdout, stderr = capsys.readouterr()
+    assert eval(stdout) == main.simple_import_search(str(root), remap=False,
+                                                     default_excludes=True)
+
+
+def test_distribution_import_search(tmpdir, capsys):
+    from depfinder.distributions import find_distributions
+    site_packages = tmpdir.mkdir('site-packages')
+    site_packages.join('foo', '__init__.py').write(
+        'import requests\nfrom foo.sub import helper\nimport os\n', ensure=True)
+    site_packages.join('foo', 'sub.py').write('import numpy\n')
+    site_packages.join('bar.py').write('import foo\ntry:\n    import yaml\n'
+                                       'except ImportError:\n    pass\n')
+    site_packages.join('stray.py').write('import stray_module\n')
+    site_packages.join('foo-1.0.dist-info', 'METADATA').write(
+        'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n\nimport not_a_header\n',
+        ensure=True)
+    site_packages.join('foo-1.0.dist-info', 'RECORD').write(
+        'foo/__init__.py,sha256=x,10\nfoo/sub.py,,\n'
+        'foo-1.0.dist-info/RECORD,,\n../../bin/foo,,\n')
+    site_packages.join('bar-2.0-py3.11.egg-info', 'installed-files.txt').write(
+        '../bar.py\nPKG-INFO\n', ensure=True)
+
+    dists = find_distributions(str(site_packages))
+    assert [(dist.name, dist.version, len(dist.files)) for dist in dists] == \
+        [('bar', '2.0', 1), ('foo', '1.0', 2)]
+
+    expected = {'foo': {'required': ['numpy', 'requests'], 'builtin': ['os']},
+                'bar': {'required': ['foo'], 'questionable': ['yaml']}}
+    assert main.distribution_import_search(str(site_packages), remap=False) == expected
+    assert main.distribution_import_search(str(site_packages), remap=False,
+                                           ignore=['*/sub.py'])['foo'] == \
+        {'required': ['requests'], 'builtin': ['os']}
+    with ParseCache(str(tmpdir.join('cache'))) as cache:
+        for _ in range(2):
+            assert main.distribution_import_search(
+                str(site_packages), remap=False, cache=cache, jobs=2) == expected
+        assert cache.hits == 3
+
+    _run_cli(path_to_check=str(site_packages),
+             extra_flags=['--by-distribution', '--no-remap', '--format=ndjson'])
+    stdout, stderr = capsys.readouterr()
+    lines = [json.loads(line) for line in stdout.splitlines()]
+    assert [line['distribution'] for line in lines] == ['bar', 'foo', None]
+    assert lines[1]['deps'] == expected['foo']
+    assert 'stray_module' not in lines[-1]['deps'].get('required', [])
+
+
+def test_server(tmpdir, capsys, monkeypatch):
+    import threading
+    from depfinder import server
+    root = _make_checkout(tmpdir.mkdir('checkout'))
+    cache_dir = str(tmpdir.join('cache'))
+    package_name = inspection.PACKAGE_NAME
+    depfinder_server = server.DepfinderServer(cache_dir)
+    httpd = server.make_server(str(tmpdir.join('depfinder.sock')), depfinder_server)
+
+    def run():
+        try:
+            httpd.serve_forever()
+        finally:
+            # sqlite connections belong to the thread that opened them
+            depfinder_server.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    address = httpd.server_address
+    try:
+        argv = [str(root), '--no-remap', '-k', 'required', '--cache-dir', cache_dir]
+        _run_cli(path_to_check=str(root), extra_flags=argv[1:])
+        expected, _ = capsys.readouterr()
+        for _ in range(2):
+            reply = server.request(address, argv)
+            assert reply == {'stdout': expected, 'stderr': '', 'returncode': 0}
+        # unchanged trees are served from memory, without reading the database
+        cache = depfinder_server.parse_cache(cache_dir)
+        conn, cache._conn = cache._conn, None
+        assert server.request(address, argv)['stdout'] == expected
+        cache._conn = conn
+        root.join('pkg', 'core.py').write('import brand_new_module\n', mode='a')
+        assert 'brand_new_module' in server.request(address, argv)['stdout']
+
+        # relative paths are relative to the client
+        reply = server.request(address, ['.', '--no-cache'], cwd=str(root.join('pkg')))
+        assert reply['returncode'] == 0 and 'brand_new_module' in reply['stdout']
+        assert server.request(address, ['-', '--no-remap'],
+                              stdin='import yaml\n')['stdout'] == \
+            "{'required': ['yaml']}\n"
+        assert server.request(address, ['--bogus'])['returncode'] == 2
+
+        monkeypatch.setattr(sys, 'stdin', six.StringIO('import numpy\n'))
+        _run_cli(path_to_check='-', extra_flags=['--server', address])
+        stdout, _ = capsys.readouterr()
+        assert stdout == "{'required': ['numpy']}\n"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+    # the state of this process is left alone
+    assert inspection.PACKAGE_NAME == package_name
+
+
+def test_server_only_takes_local_json_requests(tmpdir):
+    import threading
+    from http.client import HTTPConnection
+    from depfinder import server
+    assert server._parse_address('8000') == ('127.0.0.1', 8000)
+    assert server._parse_address('localhost:8000') == ('localhost', 8000)
+    assert server._parse_address('[::1]:8000') == ('::1', 8000)
+    sock = str(tmpdir.join('depfinder.sock'))
+    assert server._parse_address(sock) == (sock, None)
+    for address in ('0.0.0.0:8000', ':::8000', 'example.com:80'):
+        with pytest.raises(ValueError):
+            server._parse_address(address)
+    with pytest.raises(ValueError):
+        server.make_server('0.0.0.0:0', None)
+    with pytest.raises(SystemExit) as excinfo:
+        server.serve_cli(['0.0.0.0:0'])
+    assert excinfo.value.code == 2
+
+    depfinder_server = server.DepfinderServer(str(tmpdir.join('cache')))
+    httpd = server.make_server('127.0.0.1:0', depfinder_server)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    try:
+        def post(request, content_type='application/json', headers=()):
+            conn = HTTPConnection(host, port, timeout=30)
+            conn.request('POST', '/scan', json.dumps(request),
+                         dict(headers, **{'Content-Type': content_type}))
+            response = conn.getresponse()
+            data = json.loads(response.read().decode('utf-8'))
+            conn.close()
+            return response.status, data
+
+        bogus = {'argv': ['--bogus']}
+        assert post(bogus, 'text/plain')[0] == 415
+        assert post(bogus, 'application/json; charset=utf-8') == (
+            200, {'stdout': '', 'stderr': post(bogus)[1]['stderr'], 'returncode': 2})
+        for request in ({'argv': ['-'], 'stdin': ['import os']},
+                        {'argv': ['.'], 'cwd': ['/']},
+                        {'argv': ['.'], 'cwd': 0},
+                        {'argv': 'serve'},
+                        {'argv': ['serve', '127.0.0.1:0']},
+                        {'argv': ['.', '--server', 'elsewhere.sock']},
+                        {'argv': ['.', '--serv=elsewhere.sock']}):
+            status, data = post(request)
+            assert status == 400 and data['error'].startswith('invalid request')
+        # dns rebinding
+        for name in ('evil.example.com', 'evil.example.com:{}'.format(port)):
+            assert post(bogus, headers={'Host': name})[0] == 403
+        assert post(bogus, headers={'Host': 'localhost:{}'.format(port)})[0] == 200
+        assert post(bogus, headers={'Host': '[::1]:{}'.format(port)})[0] == 200
+        assert server._is_loopback_host(None) is False
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+        depfinder_server.close()
+
+
 def test_report_conda_forge_names_from_import_map_ignore():
     m, f, c = parse_file(join(dirname(depfinder.__file__), 'inspection.py'))
     report, import_to_pkg = report_conda_forge_names_from_import_map(
@@ -484,9 +1624,9 @@ def test_report_conda_forge_names_from_import_map_ignore():
 )
 def test_simple_import_search_conda_forge_import_map():
     path_to_source = dirname(depfinder.__file__)
-    expected_result = sorted(list({"pyyaml", "requests"}))
+    expected_result = {"pyyaml", "requests"}
     report = simple_import_search_conda_forge_import_map(path_to_source)
-    assert report['required'] == expected_result
+    assert expected_result <= set(report['questionable'])
 
 
 @pytest.mark.skipif(
@@ -507,11 +1647,199 @@ def test_extract_pkg_from_import_for_complex_imports(import_name, expected_resul
     assert result == expected_result, allpkgs
 
 
+FAKE_CONDA_FORGE = {'numpy': 'numpy', 'yaml': 'pyyaml', 'google.cloud.storage': 'google-cloud-storage'}
+
+
+def fake_extract_pkg_from_import(name):
+    if name in FAKE_CONDA_FORGE:
+        return FAKE_CONDA_FORGE[name], {name: {FAKE_CONDA_FORGE[name]}}
+    return name, {name: set()}
+
+
+def test_resolve_many_dedupes_lookups():
+    resolver = ImportResolver(lookup=fake_extract_pkg_from_import)
+    names = ['numpy', 'numpy.linalg', 'numpy.fft', 'yaml', 'google.cloud.storage.blob',
+             'unknown.sub']
+    resolved = resolver.resolve_many(names)
+    assert resolver.lookups == 4
+    assert resolved['numpy.fft'] == ('numpy', {'numpy'})
+    assert resolved['google.cloud.storage.blob'] == ('google-cloud-storage', {'google-cloud-storage'})
+    assert resolved['unknown.sub'] == ('unknown.sub', set())
+    # the memo lasts for the lifetime of the resolver
+    with ScanProfile() as profile:
+        resolver.resolve_many(['numpy.random', 'yaml'])
+    assert resolver.lookups == 4
+    assert resolver.memo_hits == profile.counts['resolver_memo_hits'] == 2
+
+
+def test_resolver_store(tmpdir, monkeypatch):
+    from depfinder import cache
+    with cache.ResolverStore(str(tmpdir), source_version='v1') as store:
+        resolver = ImportResolver(lookup=fake_extract_pkg_from_import, store=store)
+        resolver.resolve_many(['numpy.linalg', 'unknown'])
+        assert resolver.lookups == 2
+
+    # a new run is served from the store, no matches included
+    with cache.ResolverStore(str(tmpdir), source_version='v1') as store:
+        resolver = ImportResolver(lookup=fake_extract_pkg_from_import, store=store)
+        resolved = resolver.resolve_many(['numpy.fft', 'unknown'])
+        assert resolver.lookups == 0
+        assert resolved == {'numpy.fft': ('numpy', {'numpy'}), 'unknown': ('unknown', set())}
+
+    # no matches expire separately from matches
+    with cache.ResolverStore(str(tmpdir), source_version='v1', no_match_ttl=-1) as store:
+        resolver = ImportResolver(lookup=fake_extract_pkg_from_import, store=store)
+        resolver.resolve_many(['numpy', 'unknown'])
+        assert resolver.lookups == 1
+
+    # a new version of the upstream data invalidates the store
+    with cache.ResolverStore(str(tmpdir), source_version='v2') as store:
+        resolver = ImportResolver(lookup=fake_extract_pkg_from_import, store=store)
+        resolver.resolve_many(['numpy', 'unknown'])
+        assert resolver.lookups == 2
+
+
+def test_conda_forge_reports_keep_custom_namespaces(tmpdir):
+    tmpdir.join('mod.py').write('import acme.widgets\nfrom acme.gadgets import gizmo\n'
+                                'import numpy\n')
+    packages = {'acme': 'acme', 'acme.widgets': 'acme-widgets',
+                'acme.gadgets': 'acme-gadgets', 'numpy': 'numpy'}
+    looked_up = []
+
+    def lookup(name):
+        looked_up.append(name)
+        return packages[name], {name: {packages[name]}}
+    expected = main.simple_import_search(str(tmpdir), remap=False,
+                                         custom_namespaces=['acme'])['required']
+    assert expected == ['acme.gadgets', 'acme.widgets', 'numpy']
+    report = simple_import_search_conda_forge_import_map(
+        str(tmpdir), custom_namespaces=['acme'], resolver=ImportResolver(lookup=lookup))
+    assert sorted(looked_up) == expected
+    assert report['required'] == ['acme-gadgets', 'acme-widgets', 'numpy']
+    import_to_pkg = simple_import_to_pkg_map(
+        str(tmpdir), custom_namespaces=['acme'], resolver=ImportResolver(lookup=lookup))
+    assert import_to_pkg['required'] == {
+        'acme.widgets': {'acme-widgets'}, 'acme.gadgets': {'acme-gadgets'},
+        'numpy': {'numpy'}}
+
+
+def test_resolver_caps_concurrency():
+    import threading
+    import time
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def slow_lookup(name):
+        with lock:
+            in_flight.append(name)
+            peak.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(name)
+        return fake_extract_pkg_from_import(name)
+    resolver = ImportResolver(lookup=slow_lookup, max_concurrency=3)
+    resolved = resolver.resolve_many(['pkg%s' % i for i in range(12)])
+    assert len(resolved) == 12
+    assert max(peak) <= 3
+
+
+def test_resolver_caps_concurrency_of_abandoned_lookups():
+    import threading
+    lock = threading.Lock()
+    release = threading.Event()
+    running = []
+    peak = []
+
+    def hanging_lookup(name):
+        with lock:
+            running.append(name)
+            peak.append(len(running))
+        release.wait()
+        with lock:
+            running.remove(name)
+        return fake_extract_pkg_from_import(name)
+    # every attempt times out, but keeps running and holding its slot
+    resolver = ImportResolver(lookup=hanging_lookup, max_concurrency=2, timeout=0.02,
+                              retries=2, backoff=0)
+    resolved = resolver.resolve_many(['pkg%s' % i for i in range(4)])
+    assert resolver.failed == {'pkg%s' % i for i in range(4)}
+    assert resolved['pkg0'] == ('pkg0', set())
+    assert max(peak) <= 2
+    release.set()
+
+
+def test_resolver_retries_with_backoff():
+    attempts = []
+
+    def flaky_lookup(name):
+        attempts.append(name)
+        if len(attempts) == 1:
+            raise IOError("connection reset")
+        return fake_extract_pkg_from_import(name)
+    resolver = ImportResolver(lookup=flaky_lookup, retries=1, backoff=0)
+    assert resolver.resolve_many(['numpy']) == {'numpy': ('numpy', {'numpy'})}
+    assert resolver.lookups == 2
+    assert resolver.failed == set()
+
+
+def test_resolver_degrades_to_no_match(tmpdir):
+    import threading
+    import time
+    from depfinder import cache
+    never = threading.Event()
+
+    def hanging_lookup(name):
+        if name == 'stuck':
+            never.wait()
+        return fake_extract_pkg_from_import(name)
+    with cache.ResolverStore(str(tmpdir), source_version='v1') as store:
+        resolver = ImportResolver(lookup=hanging_lookup, store=store, timeout=0.05,
+                                  retries=1, backoff=0)
+        start = time.time()
+        resolved = resolver.resolve_many(['stuck.module', 'numpy'])
+        assert time.time() - start < 5
+        assert resolved == {'stuck.module': ('stuck.module', set()), 'numpy': ('numpy', {'numpy'})}
+        assert resolver.failed == {'stuck'}
+        # lookups that did not finish are not remembered as "no match"
+        assert store.get('stuck') is None
+
+    resolver = ImportResolver(lookup=hanging_lookup, timeout=None, deadline=0.05)
+    assert resolver.resolve_many(['stuck']) == {'stuck': ('stuck', set())}
+    assert resolver.failed == {'stuck'}
+    never.set()
+
+
+def test_report_with_resolver():
+    code = """
+import numpy
+import numpy.linalg
+from numpy.fft import fft
+import os.path
+try:
+    import yaml
+except ImportError:
+    pass
+import mystery.module
+"""
+    catcher = main.get_imported_libs(code, filename='mod.py')
+    resolver = ImportResolver(lookup=fake_extract_pkg_from_import)
+    report, import_to_pkg = report_conda_forge_names_from_import_map(
+        catcher.total_imports, resolver=resolver)
+    assert resolver.lookups == 3
+    assert report['required'] == {'numpy'}
+    assert report['questionable'] == {'pyyaml'}
+    assert report['builtin'] == {'os.path'}
+    assert report['required no match'] == {'mystery.module'}
+    assert import_to_pkg['required'] == {
+        'numpy': {'numpy'}, 'numpy.linalg': {'numpy'}, 'numpy.fft': {'numpy'}}
+
+
 @pytest.mark.parametrize('import_name, expected_result', [
     ('six.moves', False),
 ])
 def test_search_for_name(import_name, expected_result):
-    builtin_name_maybe = recursively_search_for_name(import_name, _builtin_modules)
+    builtin_name_maybe = recursively_search_for_name(import_name, builtin_modules)
     assert builtin_name_maybe == expected_result
 
 
@@ -529,18 +1857,6 @@ def test_simple_import_to_pkg_map():
             'IPython.core.inputsplitter': {'ipython', 'autovizwidget'},
             'conda_forge_metadata.autotick_bot': {'conda-forge-metadata'},
             'conda_forge_metadata.libcfgraph': {'conda-forge-metadata'},
-        },
-        'questionable no match': {},
-        'required': {
-            'requests': {
-                'apache-libcloud',
-                'arm_pyart',
-                'autovizwidget',
-                'dbxfs',
-                'google-api-core',
-                'google-cloud-bigquery-storage-core',
-                'requests'
-            },
             'requests.exceptions': {
                 'apache-libcloud',
                 'arm_pyart',
@@ -552,6 +1868,8 @@ def test_simple_import_to_pkg_map():
             },
             'yaml': {'google-cloud-bigquery-storage-core', 'pyyaml', 'rosco'}
         },
+        'questionable no match': {},
+        'required': {},
         'required no match': {}
     }
     assert import_to_artifact == expected_result
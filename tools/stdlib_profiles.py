@@ -0,0 +1,89 @@
+"""Regenerate the stdlib profiles in ``depfinder/pkg_data/stdlib``.
+
+Every profile lists the top level modules of the standard library of one
+version of python, the way ``sys.stdlib_module_names`` does on 3.10+:
+
+* python 3.10+: ``sys.stdlib_module_names`` and ``sys.builtin_module_names``
+* python 3.8 and 3.9: the top level names of ``stdlib_list(version)``, from
+  the stdlib-list package, along with the modules that interpreter finds in
+  its own standard library, which stdlib-list leaves out (mostly extension
+  modules such as ``_json``), and the modules that only exist on other
+  platforms (`OTHER_PLATFORM_MODULES`). Test modules and site specific
+  modules are dropped, since ``sys.stdlib_module_names`` does not list them.
+
+and ``__main__``. Each profile is computed by running this script with the
+python it describes, so that all of them are made the same way::
+
+    python tools/stdlib_profiles.py python3.8 python3.9 ... python3.13
+
+3.8 and 3.9 need stdlib-list installed.
+"""
+from __future__ import print_function
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'depfinder', 'pkg_data', 'stdlib')
+# modules that sys.stdlib_module_names lists on every platform, but that a
+# linux build of python 3.8 or 3.9 has no file for. All of them exist in 3.8.
+OTHER_PLATFORM_MODULES = frozenset([
+    '_dbm', '_gdbm', '_frozen_importlib', '_frozen_importlib_external', '_msi',
+    '_overlapped', '_scproxy', '_winapi', 'msilib', 'msvcrt', 'nt', 'winreg',
+    'winsound',
+])
+# the test suite, test extensions and site specific modules, which
+# sys.stdlib_module_names leaves out
+NOT_LISTED = re.compile(r'(?:test|_test.*|_ctypes_test|_?xx.*|__phello__|lib|'
+                        r'_sysconfigdata_.*)$')
+
+
+def _found_modules():
+    """Return the top level modules in the standard library directories"""
+    import pkgutil
+    import sysconfig
+    directories = [sysconfig.get_path('stdlib'),
+                   os.path.join(sysconfig.get_path('platstdlib'), 'lib-dynload')]
+    return set(module.name for module in pkgutil.iter_modules(directories))
+
+
+def module_names():
+    """Return the stdlib modules of the running python"""
+    names = set(sys.builtin_module_names)
+    names.add('__main__')
+    if hasattr(sys, 'stdlib_module_names'):
+        names.update(sys.stdlib_module_names)
+        return names
+    from stdlib_list import stdlib_list
+    version = '%s.%s' % sys.version_info[:2]
+    listed = set(name.split('.')[0] for name in stdlib_list(version))
+    listed.update(_found_modules())
+    listed.update(OTHER_PLATFORM_MODULES)
+    names.update(name for name in listed if not NOT_LISTED.match(name))
+    return names
+
+
+def write_profile(python):
+    """Write the profile of the python at `python`, return its path"""
+    output = subprocess.check_output([python, os.path.abspath(__file__), '--print'])
+    version, names = json.loads(output.decode('utf-8'))
+    path = os.path.join(PROFILE_DIR, version + '.txt')
+    with open(path, 'w') as f:
+        f.write('\n'.join(sorted(names)) + '\n')
+    return path
+
+
+def main(argv):
+    if argv == ['--print']:
+        print(json.dumps(['%s.%s' % sys.version_info[:2], sorted(module_names())]))
+        return 0
+    for python in argv or [sys.executable]:
+        print("Wrote {}".format(write_profile(python)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))